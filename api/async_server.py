@@ -0,0 +1,300 @@
+"""Asyncio HTTP server scoring concurrent requests in micro-batches
+
+Concurrent requests are queued and scored together: a batch is closed when it
+reaches `max_batch_size` rows or `max_wait_ms` after its first request, runs once
+through the preprocessing pipeline and the model, and the probabilities are sent
+back to each caller. The JSON contract is the one of `main.customer_intention`.
+Up to `--workers` batches are scored at the same time, each in a thread, and the
+requests arriving while every worker is busy are grouped into the next batch.
+
+Requests are validated before they are queued, so a malformed one is answered with
+a 400 instead of failing the batch it would have joined, and when a batch still
+fails its requests are scored one by one, so only the failing ones get the error.
+
+    MODEL_DIR=models python api/async_server.py --port 8080
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from main import feature_names, predict_proba, request_to_columns
+from model_registry import get_registry
+from prediction_cache import get_prediction_cache
+
+STATUS = {
+    200: '200 OK',
+    400: '400 Bad Request',
+    404: '404 Not Found',
+    405: '405 Method Not Allowed',
+    500: '500 Internal Server Error',
+}
+
+
+class MicroBatcher:
+    """Groups concurrent scoring calls into batches"""
+
+    def __init__(
+        self,
+        score: Callable[[Dict[str, list]], list],
+        max_batch_size: int = 256,
+        max_wait_ms: float = 5.0,
+        workers: int = 1,
+    ) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        score : callable : function scoring a columnar payload, rows in input order
+        max_batch_size : int : rows that close a batch
+        max_wait_ms : float : milliseconds a batch waits for more requests
+        workers : int : batches scored at the same time
+        batches : int : number of batches scored
+        rows : int : number of rows scored
+        """
+        self.score = score
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.workers = workers
+        self.batches = 0
+        self.rows = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def submit(self, columns: Dict[str, list]) -> list:
+        """Score the rows of one request along with the other pending requests
+        Args:
+            columns: dict, values of each feature, as returned by `request_to_columns`
+        Returns:
+            list, probabilities of the rows of this request
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((columns, future))
+        return await future
+
+    async def run(self) -> None:
+        """Collect batches and score up to `workers` at a time until cancelled"""
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        workers = asyncio.Semaphore(self.workers)
+        scoring = set()
+        try:
+            while True:
+                await workers.acquire()
+                batch = await self._collect_batch(loop)
+                task = asyncio.create_task(self._score_batch(batch))
+                scoring.add(task)
+                task.add_done_callback(scoring.discard)
+                task.add_done_callback(lambda _: workers.release())
+        finally:
+            for task in scoring:
+                task.cancel()
+
+    async def _collect_batch(
+        self, loop: asyncio.AbstractEventLoop
+    ) -> List[Tuple[Dict[str, list], asyncio.Future]]:
+        """Wait for a request and the ones following it until the batch is closed"""
+        batch = [await self._queue.get()]
+        rows = _n_rows(batch[0][0])
+        deadline = loop.time() + self.max_wait_ms / 1000
+        while rows < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            rows += _n_rows(item[0])
+        return batch
+
+    async def _score_batch(self, batch: List[Tuple[Dict[str, list], asyncio.Future]]) -> None:
+        """Score a batch in the executor and fan the results out"""
+        columns = {feature: [] for feature in batch[0][0]}
+        for request_columns, _ in batch:
+            for feature, values in columns.items():
+                values.extend(request_columns[feature])
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.score, columns
+            )
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            for item in batch:
+                await self._score_batch([item])
+            return
+
+        self.batches += 1
+        start = 0
+        for request_columns, future in batch:
+            stop = start + _n_rows(request_columns)
+            if not future.done():
+                future.set_result(result[start:stop])
+            start = stop
+        self.rows += start
+
+    def stats(self) -> dict:
+        """Return the batching counters"""
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "mean_batch_rows": self.rows / self.batches if self.batches else 0.0,
+        }
+
+
+def _n_rows(columns: Dict[str, list]) -> int:
+    """Return the number of rows of a columnar payload"""
+    return len(next(iter(columns.values())))
+
+
+def validate_columns(columns: Dict[str, list]) -> Dict[str, list]:
+    """Return a columnar payload with its numeric features as floats
+    Args:
+        columns: dict, values of each feature, as returned by `request_to_columns`
+    Returns:
+        dict, the same values, numbers of the numeric features converted to float
+    Raises:
+        ValueError: when a feature is not a list, the features have different number
+            of values, a numeric feature has a value that is not a number or a
+            category feature a value that is not a JSON scalar
+    """
+    _, category_features = feature_names()
+    for feature, values in columns.items():
+        if not isinstance(values, list):
+            raise ValueError(f"Values of {feature} must be a list")
+    if len({len(values) for values in columns.values()}) > 1:
+        raise ValueError("Features with different number of values")
+
+    validated = {}
+    for feature, values in columns.items():
+        if feature in category_features:
+            invalid = [
+                value for value in values if not isinstance(value, (str, int, float))
+            ]
+            if invalid:
+                raise ValueError(f"Invalid values of {feature}: {invalid[:5]}")
+            validated[feature] = values
+        else:
+            invalid = [
+                value
+                for value in values
+                if isinstance(value, bool) or not isinstance(value, (int, float))
+            ]
+            if invalid:
+                raise ValueError(f"Non numeric values of {feature}: {invalid[:5]}")
+            validated[feature] = [float(value) for value in values]
+    return validated
+
+
+def score_columns(columns: Dict[str, list]) -> list:
+    """Score a columnar payload with the serving function internals"""
+    return predict_proba(columns).tolist()
+
+
+class Server:
+    """Minimal HTTP/1.1 server, POST scores a payload and GET /stats reports counters"""
+
+    def __init__(self, batcher: MicroBatcher) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        batcher : MicroBatcher : batcher scoring the requests
+        """
+        self.batcher = batcher
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, dict]:
+        """Return the status code and JSON response of a request"""
+        if method == 'GET' and path == '/stats':
+            cache = get_prediction_cache()
+            return 200, {
+                "batching": self.batcher.stats(),
+                "models": get_registry().stats(),
+                "predictions": cache.stats() if cache else None,
+            }
+        if method == 'GET':
+            return 404, {"error": f"Unknown path: {path}"}
+        if method != 'POST':
+            return 405, {"error": f"Unsupported method: {method}"}
+
+        try:
+            columns = validate_columns(request_to_columns(json.loads(body)))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return 400, {"error": str(e)}
+        try:
+            return 200, {"pred": await self.batcher.submit(columns)}
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve the requests of one connection, keeping it alive between requests"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, payload = await self.dispatch(method, path, body)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f'HTTP/1.1 {STATUS[status]}\r\n'
+                    f'Content-Type: application/json\r\n'
+                    f'Content-Length: {len(data)}\r\n\r\n'.encode()
+                    + data
+                )
+                await writer.drain()
+
+                if version == 'HTTP/1.0' or headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        """Run the batcher and the HTTP server until cancelled"""
+        batching = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                batching.cancel()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    batcher = MicroBatcher(
+        score_columns,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        workers=args.workers,
+    )
+    asyncio.run(Server(batcher).serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""module responsible for serving the final model straight from the LightGBM booster"""
+import ctypes
+import threading
+
+import lightgbm
+import numpy as np
+
+
+class BoosterModel:
+    """LightGBM booster with the `predict_proba` contract of LGBMClassifier
+
+    Rows go to the booster as contiguous float64 arrays, skipping the sklearn input
+    validation and pandas conversion. Single rows use the LightGBM single-row fast
+    predictor, whose configuration is built once per model.
+    """
+
+    def __init__(self, booster: lightgbm.Booster, num_threads: int = 1) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        booster : lightgbm.Booster : booster loaded from the native model file
+        num_threads : int : threads used by each prediction
+        """
+        self.booster = booster
+        self.num_threads = num_threads
+        self._n_features = booster.num_feature()
+        self._fast_config = None
+        self._lock = threading.Lock()
+        self._init_fast_predictor()
+
+    def _init_fast_predictor(self) -> None:
+        """Build the single-row fast predictor, left disabled when unavailable"""
+        try:
+            from lightgbm.basic import (
+                _LIB,
+                C_API_DTYPE_FLOAT64,
+                C_API_PREDICT_NORMAL,
+                _safe_call,
+                c_str,
+            )
+
+            fast_config = ctypes.c_void_p()
+            _safe_call(
+                _LIB.LGBM_BoosterPredictForMatSingleRowFastInit(
+                    self.booster.handle,
+                    ctypes.c_int(C_API_PREDICT_NORMAL),
+                    ctypes.c_int(0),
+                    ctypes.c_int(-1),
+                    ctypes.c_int(C_API_DTYPE_FLOAT64),
+                    ctypes.c_int32(self._n_features),
+                    c_str(f'num_threads={self.num_threads}'),
+                    ctypes.byref(fast_config),
+                )
+            )
+        except (AttributeError, ImportError, lightgbm.basic.LightGBMError):
+            return
+
+        self._fast_config = fast_config
+        # kept for __del__, which can run when imports no longer work at exit
+        self._free_fast_config = _LIB.LGBM_FastConfigFree
+        self._row = np.empty(self._n_features, dtype=np.float64)
+        self._result = np.empty(1, dtype=np.float64)
+        self._result_len = ctypes.c_int64(0)
+        self._row_pointer = self._row.ctypes.data_as(ctypes.c_void_p)
+        self._result_pointer = self._result.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+
+    def _predict_row(self, row: np.ndarray) -> float:
+        """Return the probability of one row through the fast predictor"""
+        from lightgbm.basic import _LIB, _safe_call
+
+        with self._lock:
+            self._row[:] = row
+            _safe_call(
+                _LIB.LGBM_BoosterPredictForMatSingleRowFast(
+                    self._fast_config,
+                    self._row_pointer,
+                    ctypes.byref(self._result_len),
+                    self._result_pointer,
+                )
+            )
+            return float(self._result[0])
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Return the class probabilities of each row
+        Args:
+            X: array-like of shape (rows, features), transformed rows
+        Returns:
+            np.ndarray of shape (rows, 2), same values as LGBMClassifier.predict_proba
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if len(X) == 1 and self._fast_config is not None:
+            proba = np.array([self._predict_row(X[0])])
+        else:
+            proba = self.booster.predict(X, num_threads=self.num_threads)
+        return np.vstack((1.0 - proba, proba)).transpose()
+
+    def __del__(self) -> None:
+        if getattr(self, '_fast_config', None) is not None:
+            self._free_fast_config(self._fast_config)
+            self._fast_config = None
+
+
+def load_booster_model(path: str, num_threads: int = 1) -> BoosterModel:
+    """Load a native LightGBM model file
+    Args:
+        path: str, path to the model file saved with `Booster.save_model`
+        num_threads: int, threads used by each prediction
+    Returns:
+        BoosterModel
+    """
+    return BoosterModel(lightgbm.Booster(model_file=path), num_threads=num_threads)
@@ -0,0 +1,180 @@
+"""module responsible for running the fitted preprocessing pipeline without pandas"""
+from typing import Any, Dict, List, Mapping, Optional
+
+import numpy as np
+
+
+def compile_plan(pipe) -> dict:
+    """Export the fitted pipeline as a plan made of plain lists and NumPy arrays
+    Args:
+        pipe: fitted sklearn Pipeline with the steps 'rare_enc', 'onehot' and 'minmax'
+    Returns:
+        plan: dict, rare-label maps, one-hot column indices and min/max scale vectors
+    """
+    rare_enc = pipe.named_steps['rare_enc']
+    onehot = pipe.named_steps['onehot']
+    minmax = pipe.named_steps['minmax']
+    scaler = minmax.transformer_
+
+    feature_names_in = [str(feature) for feature in rare_enc.feature_names_in_]
+    not_encoded = set(rare_enc.variables_) - set(onehot.variables_)
+    if not_encoded:
+        raise ValueError(f"Rare label variables without one-hot encoding: {not_encoded}")
+
+    numeric = [feature for feature in feature_names_in if feature not in onehot.variables_]
+    feature_names_out = list(numeric)
+    categorical = []
+    for feature in onehot.variables_:
+        categories = list(onehot.encoder_dict_[feature])
+        start = len(feature_names_out)
+        feature_names_out.extend(f"{feature}_{category}" for category in categories)
+        onehot_index = {category: start + i for i, category in enumerate(categories)}
+
+        if feature in rare_enc.variables_:
+            lookup = {
+                category: onehot_index.get(category, -1)
+                for category in rare_enc.encoder_dict_[feature]
+            }
+            default = onehot_index.get(rare_enc.replace_with, -1)
+        else:
+            lookup = onehot_index
+            default = -1
+        categorical.append(
+            {
+                "feature": feature,
+                "lookup": lookup,
+                "default": default,
+                "start": start,
+                "stop": len(feature_names_out),
+            }
+        )
+
+    scale = np.ones(len(numeric), dtype=np.float64)
+    offset = np.zeros(len(numeric), dtype=np.float64)
+    scaled = np.zeros(len(numeric), dtype=bool)
+    for i, feature in enumerate(minmax.variables_):
+        j = numeric.index(feature)
+        scale[j] = scaler.scale_[i]
+        offset[j] = scaler.min_[i]
+        scaled[j] = True
+
+    return {
+        "feature_names_in": feature_names_in,
+        "feature_names_out": feature_names_out,
+        "numeric": numeric,
+        "scale": scale,
+        "offset": offset,
+        "scaled": scaled,
+        "clip": tuple(scaler.feature_range) if scaler.clip else None,
+        "categorical": categorical,
+    }
+
+
+class CompiledPipeline:
+    """Applies a plan exported by `compile_plan` to columns of raw values
+
+    The output is written directly into a preallocated matrix and matches
+    `pipe.transform(data).to_numpy(dtype)` bit for bit. Missing values are not
+    validated, the fitted pipeline raises on them while this plan does not.
+    """
+
+    def __init__(self, plan: dict) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        plan : dict : plan exported by `compile_plan`
+        feature_names_in : list : input columns expected by `transform`
+        feature_names_out : list : columns of the transformed matrix
+        """
+        self.plan = plan
+        self.feature_names_in: List[str] = plan['feature_names_in']
+        self.feature_names_out: List[str] = plan['feature_names_out']
+
+    @classmethod
+    def from_pipeline(cls, pipe) -> 'CompiledPipeline':
+        """Compile a fitted pipeline
+        Args:
+            pipe: fitted sklearn Pipeline
+        Returns:
+            CompiledPipeline
+        """
+        return cls(compile_plan(pipe))
+
+    def transform(
+        self,
+        data: Mapping[str, Any],
+        out: Optional[np.ndarray] = None,
+        dtype=np.float64,
+    ) -> np.ndarray:
+        """Transform raw columns into the model matrix
+        Args:
+            data: mapping of input feature to a sequence of values (dict or DataFrame)
+            out: np.ndarray, optional preallocated matrix of shape (rows, features out)
+            dtype: dtype of the matrix allocated when `out` is not given
+        Returns:
+            np.ndarray, transformed matrix
+        """
+        plan = self.plan
+        n_rows = len(data[self.feature_names_in[0]])
+        if out is None:
+            out = np.empty((n_rows, len(self.feature_names_out)), dtype=dtype)
+
+        for j, feature in enumerate(plan['numeric']):
+            values = np.asarray(data[feature], dtype=np.float64)
+            if plan['scaled'][j]:
+                values = values * plan['scale'][j]
+                values += plan['offset'][j]
+                if plan['clip'] is not None:
+                    np.clip(values, plan['clip'][0], plan['clip'][1], out=values)
+            out[:, j] = values
+
+        rows = np.arange(n_rows)
+        for encoding in plan['categorical']:
+            out[:, encoding['start'] : encoding['stop']] = 0
+            lookup = encoding['lookup']
+            default = encoding['default']
+            columns = np.fromiter(
+                (lookup.get(value, default) for value in data[encoding['feature']]),
+                dtype=np.intp,
+                count=n_rows,
+            )
+            found = columns >= 0
+            out[rows[found], columns[found]] = 1
+
+        return out
+
+
+def check_parity(pipe, compiled: CompiledPipeline, data, dtype=np.float64) -> None:
+    """Raise when the compiled plan differs from the fitted pipeline
+    Args:
+        pipe: fitted sklearn Pipeline
+        compiled: CompiledPipeline built from `pipe`
+        data: pd.DataFrame, raw input rows
+        dtype: dtype used to compare both outputs
+    """
+    expected = pipe.transform(data)
+    if list(expected.columns) != compiled.feature_names_out:
+        raise ValueError(
+            f"Compiled columns {compiled.feature_names_out} differ from "
+            f"pipeline columns {list(expected.columns)}"
+        )
+
+    expected = np.ascontiguousarray(expected.to_numpy(dtype=dtype))
+    result = compiled.transform(data, dtype=dtype)
+    if expected.tobytes() != result.tobytes():
+        mismatches = int((expected != result).sum())
+        raise ValueError(f"Compiled pipeline differs from pipeline in {mismatches} values")
+
+
+def load_plan(path: str) -> CompiledPipeline:
+    """Load a plan saved with joblib, memory-mapping its arrays
+    Args:
+        path: str, path to the plan file
+    Returns:
+        CompiledPipeline
+    """
+    import joblib
+
+    plan: Dict[str, Any] = joblib.load(path, mmap_mode='r')
+    return CompiledPipeline(plan)
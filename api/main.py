@@ -1,68 +1,206 @@
+"""Cloud function scoring the purchase intention of sessions
+
+Only the registry and the request parsing are imported with the module, pandas,
+joblib, NumPy and LightGBM are imported on the first request that needs them, so a
+cold start of the function does not pay for the modules of the other serving modes.
+"""
 import os
-import joblib
-import pandas as pd
-from google.cloud import storage
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union
+
+import yaml
+
+from model_registry import get_registry
+from prediction_cache import get_prediction_cache, row_keys
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+PROCESS_CONFIG_PATH = os.environ.get(
+    'PROCESS_CONFIG_PATH',
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '../config/process/process.yaml'
+    ),
+)
+USE_COMPILED_PIPELINE = os.environ.get('COMPILED_PIPELINE', '0') == '1'
+USE_NATIVE_BOOSTER = os.environ.get('NATIVE_BOOSTER', '0') == '1'
+MMAP_ARTIFACTS = os.environ.get('MMAP_ARTIFACTS', '0') == '1'
+LGBM_NUM_THREADS = int(os.environ.get('LGBM_NUM_THREADS', 1))
+
 
-def load_model(name_file: str):
-    """Return model from model directory
+@lru_cache(maxsize=None)
+def feature_names() -> Tuple[List[str], List[str]]:
+    """Return the input features expected by the pipeline
+    Returns:
+        features: list, every input feature in training order
+        category_features: list, features encoded as categories
+    """
+    with open(PROCESS_CONFIG_PATH) as file:
+        enconding = yaml.safe_load(file)['enconding']
+
+    category_features = list(enconding['onehot_enc'])
+    features = list(enconding['minmax_scaler']) + category_features
+    return features, category_features
+
+
+def request_to_columns(request_json: Union[dict, list]) -> Dict[str, list]:
+    """Return the values of each input feature from a request payload
     Args:
-        name_file: str, name for file to be save
+        request_json: one session as a JSON object, a JSON array of sessions or a
+            columnar JSON object mapping each feature to a list of values
     Returns:
-        model loaded from directory
+        columns: dict, values of each feature in training order
     """
-    bucket_name = 'models_customer_intention'
-    storage_client = storage.Client('customer-intention')
-    bucket = storage_client.get_bucket(bucket_name)
+    features, _ = feature_names()
 
-    blob = bucket.blob(f'{name_file}.joblib')
-    folder = '/tmp/'
+    if isinstance(request_json, dict) and not isinstance(
+        request_json.get(features[0]), list
+    ):
+        request_json = [request_json]
 
-    if not os.path.exists(folder):
-        os.makedirs(folder)
-    
-    blob.download_to_filename(f'/tmp/{name_file}.joblib')
+    if isinstance(request_json, list):
+        return {feature: [row[feature] for row in request_json] for feature in features}
 
-    model = joblib.load(f'/tmp/{name_file}.joblib')
-    return model
+    missing = [feature for feature in features if feature not in request_json]
+    if missing:
+        raise KeyError(f"Missing features in request: {missing}")
+    return {feature: request_json[feature] for feature in features}
 
 
-def customer_intention(request):
+def request_to_frame(request_json: Union[dict, list]) -> 'pd.DataFrame':
+    """Build the input frame from a request payload in one step
+    Args:
+        request_json: payload accepted by `request_to_columns`
+    Returns:
+        data: pd.DataFrame, one row per session in input order
     """
+    import pandas as pd
+
+    _, category_features = feature_names()
+    data = pd.DataFrame(request_to_columns(request_json))
+    return data.astype({feature: object for feature in category_features})
+
+
+def _artifact_names() -> Tuple[str, str]:
+    """Return the registry file names of the pipeline and the model being served"""
+    pipeline = 'pipeline_plan.joblib' if USE_COMPILED_PIPELINE else 'pipeline.joblib'
+    model = 'final_model.txt' if USE_NATIVE_BOOSTER else 'final_model.joblib'
+    return pipeline, model
+
+
+def _artifact_loaders() -> dict:
+    """Return the loader of the pipeline and of the model being served, by file name
+
+    The compiled plan is made of NumPy arrays and is always memory-mapped. The
+    sklearn pipeline and model hold no large arrays, so memory-mapping them only
+    slows the load down, see benchmarks/load_models.py, and `MMAP_ARTIFACTS=1`
+    opts into it.
     """
-    request_json = request.get_json()
+    import joblib
+
+    joblib_loader = joblib.load
+    if MMAP_ARTIFACTS:
+        joblib_loader = partial(joblib.load, mmap_mode='r')
+    if USE_COMPILED_PIPELINE:
+        from compiled_pipeline import load_plan as pipeline_loader
+    else:
+        pipeline_loader = joblib_loader
+    if USE_NATIVE_BOOSTER:
+        from booster import load_booster_model
+
+        model_loader = partial(load_booster_model, num_threads=LGBM_NUM_THREADS)
+    else:
+        model_loader = joblib_loader
+
+    pipeline, model = _artifact_names()
+    return {pipeline: pipeline_loader, model: model_loader}
 
+
+def load_artifacts() -> tuple:
+    """Return the pipeline and the model being served, with their versions
+    Returns:
+        transformer: fitted pipeline, or compiled plan with `COMPILED_PIPELINE=1`
+        model: sklearn model, or native booster with `NATIVE_BOOSTER=1`
+        versions: tuple, registry versions of the transformer and the model
+
+    Both are read from one registry snapshot, so a background swap to a new
+    release never pairs the pipeline of one release with the model of another,
+    and the versions are the ones of the returned artifacts.
+    """
     try:
-        pipe = load_model('pipeline')
-        model = load_model('final_model')
+        (transformer, model), versions = get_registry().get_many(_artifact_loaders())
     except FileNotFoundError as e:
         print(f"The pipeline/model file does not exist: {e}")
         raise e
-    data = pd.DataFrame(
-        [
-            {
-                "Administrative": request_json['Administrative'],
-                "Administrative_Duration": request_json['Administrative_Duration'],
-                "Informational": request_json['Informational'],
-                "Informational_Duration": request_json['Informational_Duration'],
-                "ProductRelated": request_json['ProductRelated'],
-                "ProductRelated_Duration": request_json['ProductRelated_Duration'],
-                "BounceRates": request_json['BounceRates'],
-                "ExitRates": request_json['ExitRates'],
-                "PageValues": request_json['PageValues'],
-                "SpecialDay": request_json['SpecialDay'],
-                "Month": request_json['Month'],
-                "OperatingSystems": request_json['OperatingSystems'],
-                "Browser": request_json['Browser'],
-                "Region": request_json['Region'],
-                "TrafficType": request_json['TrafficType'],
-                "VisitorType": request_json['VisitorType'],
-                "Weekend": request_json['Weekend'],
-            }
+    return transformer, model, versions
+
+
+def _predict(request_json: Union[dict, list], transformer, model):
+    """Return the class probabilities of each session, without the prediction cache"""
+    if USE_COMPILED_PIPELINE:
+        data_transformed = transformer.transform(request_to_columns(request_json))
+    else:
+        data_transformed = transformer.transform(request_to_frame(request_json))
+    return model.predict_proba(data_transformed)
+
+
+def predict_proba(request_json: Union[dict, list]):
+    """Return the class probabilities of each session
+    Args:
+        request_json: payload accepted by `request_to_columns`
+    Returns:
+        np.ndarray, probabilities in input order
+
+    With `COMPILED_PIPELINE=1` the preprocessing runs through the plan exported
+    by `src/export_pipeline.py` instead of the fitted pipeline, and with
+    `NATIVE_BOOSTER=1` the model is the native `final_model.txt` booster, run with
+    `LGBM_NUM_THREADS` threads, instead of the sklearn wrapper.
+
+    With `PREDICTION_CACHE_SIZE` set, sessions already scored with the current
+    pipeline and model versions are served from the prediction cache and only the
+    distinct new sessions go through the pipeline and the model.
+    """
+    transformer, model, version = load_artifacts()
+    cache = get_prediction_cache()
+    if cache is None:
+        return _predict(request_json, transformer, model)
+
+    import numpy as np
+
+    features, _ = feature_names()
+    columns = request_to_columns(request_json)
+    keys = row_keys(columns, features)
+    cached = cache.get_many(keys, version)
+
+    missing = {}
+    for i, (key, value) in enumerate(zip(keys, cached)):
+        if value is None and key not in missing:
+            missing[key] = i
+    if missing:
+        rows = list(missing.values())
+        computed = _predict(
+            {feature: [values[i] for i in rows] for feature, values in columns.items()},
+            transformer,
+            model,
+        ).tolist()
+        cache.put_many(list(missing), computed, version)
+        computed = dict(zip(missing, computed))
+        cached = [
+            computed[key] if value is None else value for key, value in zip(keys, cached)
         ]
-    )
 
-    data_transformed = pipe.transform(data)
-    predict = model.predict_proba(data_transformed)
+    return np.array(cached, dtype=np.float64).reshape(len(keys), 2)
+
+
+def customer_intention(request):
+    """Score one or many sessions
+
+    Accepts a single session, a JSON array of sessions or a columnar object with
+    a list of values per feature and returns the probabilities in input order.
+    """
+    request_json = request.get_json()
+
+    predict = predict_proba(request_json)
 
     result = {"pred": predict.tolist()}
 
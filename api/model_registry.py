@@ -0,0 +1,420 @@
+"""module responsible for keeping serving artifacts warm across requests"""
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import structlog
+
+BUCKET_NAME = 'models_customer_intention'
+PROJECT_NAME = 'customer-intention'
+DOWNLOAD_FOLDER = '/tmp/'
+
+logger = structlog.getLogger()
+
+
+class LocalBackend:
+    """Artifacts read straight from a local directory (stand-in for the bucket)"""
+
+    def __init__(self, directory: str) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        directory : str : the directory where the artifacts are located
+        """
+        self.directory = directory
+
+    def version(self, filename: str) -> str:
+        """Return a cheap version token for the artifact
+        Args:
+            filename: str, artifact file name
+        Returns:
+            version: str, modification time and size of the file
+        """
+        stat = os.stat(os.path.join(self.directory, filename))
+        return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+    def fetch(self, filename: str, version: str) -> str:
+        """Return the local path of the artifact
+        Args:
+            filename: str, artifact file name
+            version: str, version token returned by `version`
+        Returns:
+            path: str, path to the artifact file
+        """
+        return os.path.join(self.directory, filename)
+
+    def snapshot(self, filenames: List[str]) -> Dict[str, str]:
+        """Return the version of each artifact"""
+        return {filename: self.version(filename) for filename in filenames}
+
+
+class GCSBackend:
+    """Artifacts downloaded from a Google Cloud Storage bucket"""
+
+    def __init__(
+        self, bucket_name: str, project: str, folder: str = DOWNLOAD_FOLDER
+    ) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        bucket : google.cloud.storage.Bucket : bucket where the artifacts are stored
+        folder : str : local folder where the artifacts are downloaded
+        """
+        from google.cloud import storage
+
+        self.bucket = storage.Client(project).bucket(bucket_name)
+        self.folder = folder
+
+    def version(self, filename: str) -> str:
+        """Return the blob generation, a metadata-only request
+        Args:
+            filename: str, artifact file name
+        Returns:
+            version: str, generation of the blob
+        """
+        blob = self.bucket.get_blob(filename)
+        if blob is None:
+            raise FileNotFoundError(f'gs://{self.bucket.name}/{filename}')
+        return str(blob.generation)
+
+    def fetch(self, filename: str, version: str) -> str:
+        """Download the given generation of the artifact
+        Args:
+            filename: str, artifact file name
+            version: str, generation returned by `version`
+        Returns:
+            path: str, path to the downloaded file
+        """
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        path = os.path.join(self.folder, filename)
+        partial_path = f'{path}.{os.getpid()}.part'
+        blob = self.bucket.blob(filename, generation=int(version))
+        blob.download_to_filename(partial_path)
+        os.replace(partial_path, path)
+        return path
+
+    def snapshot(self, filenames: List[str]) -> Dict[str, str]:
+        """Return the version of each artifact"""
+        return {filename: self.version(filename) for filename in filenames}
+
+
+class ManifestBackend:
+    """Artifacts of the release promoted in a registry directory
+
+    The layout is the one written by `src/registry.py`: `refs/<name>` holds the
+    promoted version, `manifests/<name>/<version>.json` the sha256 of each artifact
+    of that version and `blobs/<sha256>` their content. Blobs are never rewritten,
+    so a worker never reads a half-written artifact, and the version token of an
+    artifact is its digest, so a release sharing the pipeline does not reload it.
+    """
+
+    def __init__(self, directory: str, name: str = 'final_model') -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        directory : str : the registry directory
+        name : str : name of the released model to serve
+        """
+        self.directory = directory
+        self.name = name
+        self._manifests: Dict[str, dict] = {}
+
+    def release(self) -> str:
+        """Return the promoted version
+        Returns:
+            version: str, content of `refs/<name>`
+        """
+        with open(os.path.join(self.directory, 'refs', self.name)) as file:
+            return file.read().strip()
+
+    def artifacts(self, release: str) -> Dict[str, str]:
+        """Return the digest of each artifact of a release, manifests are immutable
+        Args:
+            release: str, version of the release
+        Returns:
+            artifacts: dict, sha256 of each artifact file name
+        """
+        if release not in self._manifests:
+            path = os.path.join(self.directory, 'manifests', self.name, f'{release}.json')
+            with open(path) as file:
+                self._manifests[release] = json.load(file)
+        return self._manifests[release]['artifacts']
+
+    def version(self, filename: str) -> str:
+        """Return the digest of the artifact in the promoted release
+        Args:
+            filename: str, artifact file name
+        Returns:
+            version: str, sha256 of the artifact
+        """
+        return self.snapshot([filename])[filename]
+
+    def fetch(self, filename: str, version: str) -> str:
+        """Return the local path of the artifact
+        Args:
+            filename: str, artifact file name
+            version: str, digest returned by `version`
+        Returns:
+            path: str, path to the blob
+        """
+        return os.path.join(self.directory, 'blobs', version)
+
+    def snapshot(self, filenames: List[str]) -> Dict[str, str]:
+        """Return the version of each artifact, all from the same release"""
+        release = self.release()
+        artifacts = self.artifacts(release)
+        missing = [filename for filename in filenames if filename not in artifacts]
+        if missing:
+            raise FileNotFoundError(f'{missing} not in {self.name} release {release}')
+        return {filename: artifacts[filename] for filename in filenames}
+
+
+class _Entry:
+    """Loaded artifact along with the version and the loader it was loaded with"""
+
+    __slots__ = ('version', 'model', 'loader', 'checked_at')
+
+    def __init__(
+        self, version: str, model: Any, loader: Callable[[str], Any], checked_at: float
+    ) -> None:
+        self.version = version
+        self.model = model
+        self.loader = loader
+        self.checked_at = checked_at
+
+
+class ModelRegistry:
+    """Process-lifetime cache of loaded artifacts
+
+    Each artifact is loaded once per worker. After `revalidate_seconds` the backend
+    is asked for the artifact version and, when a newer one is published, the
+    artifact is reloaded and swapped in place of the previous one.
+
+    With `preload` the newer versions of every loaded artifact are loaded by a
+    background thread while requests keep being served by the current ones, and
+    swapped all at once, so a request never waits for a reload nor sees the new
+    pipeline with the previous model.
+    """
+
+    def __init__(
+        self, backend, revalidate_seconds: float = 30.0, preload: bool = False
+    ) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        backend : LocalBackend | GCSBackend | ManifestBackend : where the artifacts are read from
+        revalidate_seconds : float : seconds before asking the backend for a new version
+        preload : bool : load newer versions in the background
+        hits : int : number of requests served from the cache
+        misses : int : number of requests that loaded the artifact
+        reloads : int : number of misses caused by a newer artifact version
+        preloads : int : number of background swaps to newer versions
+        preload_errors : int : number of background loads that failed
+        """
+        self.backend = backend
+        self.revalidate_seconds = revalidate_seconds
+        self.preload = preload
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.preloads = 0
+        self.preload_errors = 0
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._preloading = False
+
+    def get(self, filename: str, loader: Optional[Callable[[str], Any]] = None) -> Any:
+        """Return the loaded artifact, loading it only when needed
+        Args:
+            filename: str, artifact file name
+            loader: callable, function receiving the local path and returning the
+                artifact, `joblib.load` when None
+        Returns:
+            artifact loaded from the backend
+        """
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(filename)
+            if entry is not None and now - entry.checked_at < self.revalidate_seconds:
+                self.hits += 1
+                return entry.model
+
+            return self._load(filename, loader, self.backend.version(filename), now)
+
+    def get_many(
+        self, loaders: Dict[str, Optional[Callable[[str], Any]]]
+    ) -> Tuple[List[Any], Tuple[str, ...]]:
+        """Return loaded artifacts and their versions, read from one snapshot
+        Args:
+            loaders: dict, loader of each artifact file name, as in `get`
+        Returns:
+            tuple with the artifacts and their versions, in the order of `loaders`
+
+        The artifacts are read under one lock, so a background swap cannot happen
+        between two of them, and when one of them has to be revalidated they all are,
+        from one `backend.snapshot`, so they come from the same release.
+        """
+        filenames = list(loaders)
+        with self._lock:
+            now = time.monotonic()
+            entries = [self._entries.get(filename) for filename in filenames]
+            if all(
+                entry is not None and now - entry.checked_at < self.revalidate_seconds
+                for entry in entries
+            ):
+                self.hits += len(entries)
+                models = [entry.model for entry in entries]
+            else:
+                snapshot = self.backend.snapshot(filenames)
+                models = [
+                    self._load(filename, loaders[filename], snapshot[filename], now)
+                    for filename in filenames
+                ]
+            versions = tuple(self._entries[filename].version for filename in filenames)
+        return models, versions
+
+    def _load(
+        self,
+        filename: str,
+        loader: Optional[Callable[[str], Any]],
+        version: str,
+        now: float,
+    ) -> Any:
+        """Return the artifact for the backend version, the lock must be held"""
+        if loader is None:
+            import joblib
+
+            loader = joblib.load
+
+        entry = self._entries.get(filename)
+        if entry is not None and (entry.version == version or self.preload):
+            if entry.version != version:
+                self._start_preload()
+            entry.checked_at = now
+            self.hits += 1
+            return entry.model
+
+        model = loader(self.backend.fetch(filename, version))
+        self.misses += 1
+        if entry is not None:
+            self.reloads += 1
+        self._entries[filename] = _Entry(version, model, loader, now)
+        return model
+
+    def _start_preload(self) -> None:
+        """Start loading the newer versions in the background, the lock must be held"""
+        if self._preloading:
+            return
+        self._preloading = True
+        threading.Thread(target=self._preload, name='model-preload', daemon=True).start()
+
+    def _preload(self) -> None:
+        """Load the newer version of every loaded artifact and swap them all at once"""
+        try:
+            with self._lock:
+                entries = dict(self._entries)
+            versions = self.backend.snapshot(list(entries))
+            loaded = {
+                filename: _Entry(
+                    versions[filename],
+                    entry.loader(self.backend.fetch(filename, versions[filename])),
+                    entry.loader,
+                    time.monotonic(),
+                )
+                for filename, entry in entries.items()
+                if versions[filename] != entry.version
+            }
+            with self._lock:
+                self._entries.update(loaded)
+                self.misses += len(loaded)
+                self.reloads += len(loaded)
+                self.preloads += 1
+        except Exception as e:
+            logger.error(f"Preloading the new artifact versions failed: {e}")
+            with self._lock:
+                self.preload_errors += 1
+        finally:
+            with self._lock:
+                self._preloading = False
+
+    def versions(self, filenames: Tuple[str, ...]) -> Tuple[Optional[str], ...]:
+        """Return the version of loaded artifacts, None for the ones not loaded
+        Args:
+            filenames: tuple, artifact file names
+        Returns:
+            tuple of versions in the order of `filenames`
+        """
+        with self._lock:
+            return tuple(
+                self._entries[filename].version if filename in self._entries else None
+                for filename in filenames
+            )
+
+    def stats(self) -> dict:
+        """Return the cache counters
+        Returns:
+            dict: hits, misses, reloads and the version of each cached artifact
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "preloads": self.preloads,
+                "preload_errors": self.preload_errors,
+                "versions": {
+                    filename: entry.version for filename, entry in self._entries.items()
+                },
+            }
+
+    def clear(self) -> None:
+        """Drop every cached artifact and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.reloads = 0
+            self.preloads = self.preload_errors = 0
+
+
+_registry: Optional[ModelRegistry] = None
+
+
+def get_registry() -> ModelRegistry:
+    """Return the registry of this worker, creating it on first use
+
+    `MODEL_REGISTRY_DIR` serves the release promoted in a registry directory written
+    by `src/registry.py`, `MODEL_NAME` (default final_model) being the released name,
+    and preloads new releases in the background unless `MODEL_PRELOAD=0`.
+    Otherwise `MODEL_DIR` points the registry to a local directory instead of the
+    bucket, `MODEL_BUCKET` overrides the bucket name. `MODEL_REVALIDATE_SECONDS` sets
+    the revalidation interval.
+    """
+    global _registry
+    if _registry is None:
+        registry_dir = os.environ.get('MODEL_REGISTRY_DIR')
+        model_dir = os.environ.get('MODEL_DIR')
+        preload = False
+        if registry_dir:
+            backend = ManifestBackend(
+                registry_dir, os.environ.get('MODEL_NAME', 'final_model')
+            )
+            preload = os.environ.get('MODEL_PRELOAD', '1') == '1'
+        elif model_dir:
+            backend = LocalBackend(model_dir)
+        else:
+            backend = GCSBackend(
+                os.environ.get('MODEL_BUCKET', BUCKET_NAME), PROJECT_NAME
+            )
+        _registry = ModelRegistry(
+            backend,
+            float(os.environ.get('MODEL_REVALIDATE_SECONDS', 30)),
+            preload=preload,
+        )
+    return _registry
@@ -0,0 +1,158 @@
+"""module responsible for caching the predictions of identical sessions"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+
+def canonical_value(value: Any) -> Any:
+    """Return the value of a feature in the form used by the cache keys
+    Args:
+        value: feature value parsed from the request JSON
+    Returns:
+        numbers as float, so 0 and 0.0 give the same key, bools tagged with their
+        type, so True and 1 do not, other values unchanged
+    """
+    if isinstance(value, bool):
+        return (bool, value)
+    if not isinstance(value, (int, float)):
+        return value
+    return float(value)
+
+
+def row_keys(columns: Dict[str, list], features: Sequence[str]) -> List[Tuple]:
+    """Return the cache key of every row of a columnar payload
+    Args:
+        columns: dict, values of each feature, as returned by `request_to_columns`
+        features: list, input features in training order
+    Returns:
+        list of tuples with the canonical value of every feature, in training order
+    """
+    return [
+        tuple(canonical_value(value) for value in row)
+        for row in zip(*(columns[feature] for feature in features))
+    ]
+
+
+class PredictionCache:
+    """Bounded LRU cache of predictions with a time to live
+
+    Entries belong to one version of the artifacts: when the pipeline or the model
+    version changes every entry is dropped, so a new model never serves stale scores.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float = 300.0) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        max_entries : int : entries kept before the least recently used is evicted
+        ttl_seconds : float : seconds an entry is served after it was stored
+        hits, misses, evictions, expirations, invalidations : int : counters
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._version: Optional[Hashable] = None
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: Hashable) -> None:
+        """Drop every entry when the artifacts changed, the lock must be held"""
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def get_many(self, keys: Sequence[Hashable], version: Hashable) -> List[Any]:
+        """Return the cached value of each key, None for the missing ones
+        Args:
+            keys: list of row keys
+            version: versions of the artifacts used to compute the values
+        Returns:
+            list of values in key order
+        """
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            self._check_version(version)
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] < now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    values.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    values.append(entry[0])
+        return values
+
+    def put_many(
+        self, keys: Sequence[Hashable], values: Sequence[Any], version: Hashable
+    ) -> None:
+        """Store values computed with the given version of the artifacts"""
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            self._check_version(version)
+            for key, value in zip(keys, values):
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Return the cache counters
+        Returns:
+            dict: size, hit rate, hits, misses, evictions, expirations and invalidations
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def clear(self) -> None:
+        """Drop every entry and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+            self.hits = self.misses = self.evictions = 0
+            self.expirations = self.invalidations = 0
+
+
+_cache: Optional[PredictionCache] = None
+
+
+def get_prediction_cache() -> Optional[PredictionCache]:
+    """Return the prediction cache of this worker, None when it is disabled
+
+    `PREDICTION_CACHE_SIZE` sets the number of cached sessions, 0 (the default)
+    disables the cache, and `PREDICTION_CACHE_TTL` the seconds an entry is served.
+    """
+    global _cache
+    max_entries = int(os.environ.get('PREDICTION_CACHE_SIZE', 0))
+    if max_entries <= 0:
+        return None
+    if _cache is None:
+        _cache = PredictionCache(
+            max_entries, ttl_seconds=float(os.environ.get('PREDICTION_CACHE_TTL', 300))
+        )
+    return _cache
@@ -0,0 +1,282 @@
+"""Benchmark of the training and serving hot paths on synthetic data
+
+Every stage runs on a synthetic dataset of `--rows` sessions in a scratch directory
+set through DATA_DIR and MODEL_DIR, so the data, models, mlflow.db and Optuna study
+of the repository are not touched. Stages that are cached in process or on disk are
+timed cold, with the cache cleared before each run, and warm.
+
+    python benchmarks/hot_paths.py [--rows 12330] [--repeat 3] [--output results.json]
+    python benchmarks/hot_paths.py --compare baseline.json
+
+Results are written as JSON with the median and minimum seconds of each stage, and
+`--compare` prints the ratio of the new median to the one of a previous run.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional
+
+import yaml
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BATCH_SIZES = (1, 100, 10_000)
+
+
+def measure(
+    stage: str,
+    function: Callable[[], object],
+    repeat: int,
+    rows: int,
+    setup: Optional[Callable[[], None]] = None,
+) -> dict:
+    """Return the timings of a stage
+    Args:
+        stage: str, name of the stage in the results
+        function: callable run `repeat` times
+        repeat: int, number of timed runs
+        rows: int, rows processed by one run
+        setup: callable run before each run, outside of the timing
+    Returns:
+        dict with the stage, rows, median and minimum seconds and rows per second
+    """
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    median = statistics.median(seconds)
+    result = {
+        'stage': stage,
+        'rows': rows,
+        'repeat': repeat,
+        'median_seconds': median,
+        'min_seconds': min(seconds),
+        'rows_per_second': rows / median if median else None,
+    }
+    print(json.dumps(result), file=sys.stderr)
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    """Return the commit of the benchmarked tree"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class _Request:
+    """Stand-in for the flask request given to the cloud function"""
+
+    def __init__(self, payload: list) -> None:
+        self.payload = payload
+
+    def get_json(self) -> list:
+        return self.payload
+
+
+def run(rows: int, repeat: int, models: List[str], cv: int, workdir: str) -> List[dict]:
+    """Run every stage in `workdir` and return their timings"""
+    os.environ['DATA_DIR'] = os.path.join(workdir, 'data')
+    os.environ['MODEL_DIR'] = os.path.join(workdir, 'models')
+    for directory in ('data/raw', 'data/processed', 'data/final', 'models'):
+        os.makedirs(os.path.join(workdir, directory), exist_ok=True)
+    os.chdir(workdir)
+    sys.path[:0] = [
+        os.path.join(ROOT, 'src'),
+        os.path.join(ROOT, 'api'),
+        os.path.dirname(os.path.abspath(__file__)),
+    ]
+
+    from synthetic_data import generate
+    from storage import data_path, filename, write_table
+
+    write_table(generate(rows), data_path('raw', filename('data')))
+
+    import optuna
+    from omegaconf import OmegaConf
+
+    import main
+    import optimization
+    import train
+    from data_ingest import DataIngest
+    from data_preparation import _prepared_data, data_preparation, transformed_data
+    from final_model import final_model
+    from split_data import SplitData
+    from utils import save_model
+
+    config = OmegaConf.load(os.path.join(ROOT, 'config/process/process.yaml'))
+    config.training.cache = False
+    config.training.cv = cv
+    results = []
+
+    results.append(measure('load_data', DataIngest().load_data, repeat, rows))
+
+    results.append(
+        measure(
+            'split_data',
+            lambda: SplitData().split_data(),
+            repeat,
+            rows,
+            setup=SplitData()._remove_manifest,
+        )
+    )
+    results.append(
+        measure('split_data_cached', lambda: SplitData().split_data(), repeat, rows)
+    )
+
+    X_train, X_test, y_train, _ = data_preparation()
+    results.append(
+        measure(
+            'data_preparation',
+            data_preparation,
+            repeat,
+            len(X_train) + len(X_test),
+            setup=_prepared_data.clear,
+        )
+    )
+    results.append(
+        measure(
+            'data_preparation_cached',
+            data_preparation,
+            repeat,
+            len(X_train) + len(X_test),
+        )
+    )
+
+    pipe = train.build_pipeline(config)
+    results.append(
+        measure(
+            'pipe_fit_transform',
+            lambda: pipe.fit_transform(X_train, y_train),
+            repeat,
+            len(X_train),
+        )
+    )
+    results.append(
+        measure('pipe_transform', lambda: pipe.transform(X_test), repeat, len(X_test))
+    )
+    save_model(pipe, 'pipeline')
+
+    transformed_data()
+    optimization.trial_settings['pruner'] = None
+
+    def optuna_trial() -> None:
+        study = optuna.create_study(direction='maximize', pruner=optuna.pruners.NopPruner())
+        study.optimize(optimization.objective, n_trials=1)
+
+    results.append(measure('optuna_trial', optuna_trial, repeat, len(X_train)))
+
+    for model_name in models:
+        model_config = config.copy()
+        model_config.models = {model_name: config.models[model_name]}
+        results.append(
+            measure(
+                f'train_{model_name}', lambda: train.train(model_config), repeat, len(X_train)
+            )
+        )
+
+    final_model(OmegaConf.load(os.path.join(ROOT, 'config/model/model.yaml')))
+    sessions = generate(max(BATCH_SIZES), seed=7).drop(columns='Revenue')
+    for batch_size in BATCH_SIZES:
+        request = _Request(json.loads(sessions[:batch_size].to_json(orient='records')))
+        main.customer_intention(request)
+        results.append(
+            measure(
+                f'customer_intention_{batch_size}',
+                lambda: main.customer_intention(request),
+                repeat,
+                batch_size,
+            )
+        )
+
+    return results
+
+
+def compare(results: List[dict], baseline_path: str) -> None:
+    """Print the ratio of the median seconds of each stage to a previous run"""
+    with open(baseline_path) as file:
+        baseline = {result['stage']: result for result in json.load(file)['results']}
+
+    for result in results:
+        if result['stage'] in baseline:
+            ratio = result['median_seconds'] / baseline[result['stage']]['median_seconds']
+            print(f"{result['stage']:<40} {ratio:6.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=12330)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cv', type=int, default=10)
+    parser.add_argument('--models', nargs='*', default=None, help='default: every model')
+    parser.add_argument('--workdir', default=None, help='default: a removed temporary dir')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None, help='JSON results of a previous run')
+    args = parser.parse_args()
+
+    output = os.path.abspath(
+        args.output
+        or os.path.join(
+            ROOT, 'benchmarks/results', f'hot_paths-{args.rows}-{int(time.time())}.json'
+        )
+    )
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench-')
+    with open(os.path.join(ROOT, 'config/process/process.yaml')) as file:
+        models = args.models or list(yaml.safe_load(file)['models'])
+
+    started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    try:
+        results = run(args.rows, args.repeat, models, args.cv, workdir)
+    finally:
+        os.chdir(ROOT)
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'metadata': {
+            'started_at': started_at,
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'rows': args.rows,
+            'repeat': args.repeat,
+            'cv': args.cv,
+            'env': {
+                name: os.environ.get(name)
+                for name in (
+                    'DATA_FORMAT',
+                    'COMPILED_PIPELINE',
+                    'NATIVE_BOOSTER',
+                    'MMAP_ARTIFACTS',
+                    'LGBM_NUM_THREADS',
+                )
+            },
+        },
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved in {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
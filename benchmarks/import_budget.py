@@ -0,0 +1,101 @@
+"""Import-time budget of the serving and data modules
+
+Each module is imported in a fresh interpreter with `python -X importtime`. The check
+fails when its cumulative import time is over budget or when it imports one of the
+heavy modules it must leave to the first call that needs them. The check runs with
+the tests, see tests/test_import_budget.py, and this script reports the timings.
+
+    python benchmarks/import_budget.py [--repeat 5] [--scale 1.0]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import List, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+TRAINING_STACK = ['hydra', 'mlflow', 'optuna', 'xgboost', 'lightgbm', 'sklearn.ensemble']
+
+# module: (directory, budget in seconds, modules it must not import)
+BUDGETS = {
+    'main': ('api', 0.2, ['pandas', 'numpy', 'joblib', 'sklearn', *TRAINING_STACK]),
+    'async_server': ('api', 0.2, ['pandas', 'numpy', 'joblib', 'sklearn', *TRAINING_STACK]),
+    'utils': ('src', 1.5, ['sklearn', *TRAINING_STACK]),
+    'data_preparation': ('src', 3.0, TRAINING_STACK),
+}
+
+SCRIPT = 'import json, sys; import {module}; print(json.dumps(sorted(sys.modules)))'
+IMPORT_LINE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| (\S+)$')
+
+
+def import_time(module: str, directory: str) -> Tuple[float, List[str]]:
+    """Return the cumulative import seconds of a module and the modules it loaded
+    Args:
+        module: str, module to import
+        directory: str, directory of the module, relative to the repository
+    Returns:
+        tuple with the seconds and the names in sys.modules after the import
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', SCRIPT.format(module=module)],
+        cwd=os.path.join(ROOT, directory),
+        env={**os.environ, 'PYTHONPATH': os.path.join(ROOT, directory)},
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    seconds = None
+    for line in process.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match and match.group(2) == module:
+            seconds = int(match.group(1)) / 1e6
+    if seconds is None:
+        raise RuntimeError(f"No import time reported for {module}:\n{process.stderr}")
+    return seconds, json.loads(process.stdout)
+
+
+def check(module: str, repeat: int, scale: float) -> dict:
+    """Return the median import time of a module and its budget violations"""
+    directory, budget, forbidden = BUDGETS[module]
+    runs = [import_time(module, directory) for _ in range(repeat)]
+    seconds = statistics.median(run[0] for run in runs)
+    loaded = set(runs[0][1])
+
+    errors = [
+        f"imports {name}"
+        for name in forbidden
+        if name in loaded
+        or any(loaded_module.startswith(f'{name}.') for loaded_module in loaded)
+    ]
+    if seconds > budget * scale:
+        errors.append(f"takes {seconds:.3f}s, over the {budget * scale:.3f}s budget")
+    return {
+        'module': module,
+        'median_seconds': seconds,
+        'budget_seconds': budget * scale,
+        'errors': errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of the budgets')
+    parser.add_argument('modules', nargs='*', default=list(BUDGETS))
+    args = parser.parse_args()
+
+    results = [check(module, args.repeat, args.scale) for module in args.modules]
+    print(json.dumps(results, indent=2))
+
+    failed = [result for result in results if result['errors']]
+    for result in failed:
+        print(f"{result['module']}: {', '.join(result['errors'])}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark of the cold load of the model artifacts
+
+Every variant runs in a fresh interpreter, so the numbers include unpickling and
+page faults but not the imports, which are done before the clock starts.
+
+    python benchmarks/load_models.py [--models-dir models] [--repeat 5]
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODELS_DIR = os.path.join(ROOT, 'models')
+# artifacts such as pipeline_stats.joblib pickle classes of the project modules
+PYTHONPATH = os.pathsep.join(os.path.join(ROOT, directory) for directory in ('src', 'api'))
+
+# the libraries of the pickled estimators are imported before the clock starts, so
+# only unpickling is timed and not the imports the first unpickle would trigger
+JOBLIB_SETUP = (
+    'import joblib, feature_engine.encoding, feature_engine.wrappers, lightgbm, '
+    'sklearn.ensemble, sklearn.linear_model, sklearn.tree, xgboost'
+)
+
+LOADERS = {
+    'joblib': (
+        JOBLIB_SETUP,
+        'joblib.load({path!r})',
+    ),
+    'joblib_mmap': (
+        JOBLIB_SETUP,
+        'joblib.load({path!r}, mmap_mode="r")',
+    ),
+    'lightgbm_native': (
+        'import lightgbm',
+        'lightgbm.Booster(model_file={path!r})',
+    ),
+}
+
+SCRIPT = '''
+import json, resource, time
+{setup}
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+model = {load}
+seconds = time.perf_counter() - start
+rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"seconds": seconds, "peak_rss_kb_delta": rss_after - rss_before}}))
+'''
+
+
+def run_variant(loader: str, path: str, repeat: int) -> dict:
+    """Return the median load time and peak RSS growth of one artifact
+    Args:
+        loader: str, key of LOADERS
+        path: str, artifact path
+        repeat: int, number of fresh interpreters
+    Returns:
+        dict with the artifact, loader, median seconds and peak RSS growth
+    """
+    setup, load = LOADERS[loader]
+    script = SCRIPT.format(setup=setup, load=load.format(path=path))
+    runs = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, '-c', script],
+                env={**os.environ, 'PYTHONPATH': PYTHONPATH},
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+        )
+        for _ in range(repeat)
+    ]
+    return {
+        'artifact': os.path.basename(path),
+        'loader': loader,
+        'median_seconds': statistics.median(run['seconds'] for run in runs),
+        'median_peak_rss_kb_delta': statistics.median(
+            run['peak_rss_kb_delta'] for run in runs
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for path in sorted(glob.glob(os.path.join(args.models_dir, '*.joblib'))):
+        for loader in ('joblib', 'joblib_mmap'):
+            results.append(run_variant(loader, path, args.repeat))
+    for path in sorted(glob.glob(os.path.join(args.models_dir, '*.txt'))):
+        results.append(run_variant('lightgbm_native', path, args.repeat))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
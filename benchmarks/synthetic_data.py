@@ -0,0 +1,101 @@
+"""Synthetic sessions with the columns and dtypes of the raw dataset
+
+The marginals roughly follow the original data (12330 sessions, about 15% with
+revenue) and revenue depends on the page values, bounce and exit rates, so models
+have something to learn. Any number of rows can be generated.
+
+    python benchmarks/synthetic_data.py --rows 1000000 --output data/raw/data.parquet
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
+
+from storage import apply_schema, schema, write_table
+
+MONTHS = {
+    'Feb': 0.02,
+    'Mar': 0.15,
+    'May': 0.27,
+    'June': 0.03,
+    'Jul': 0.04,
+    'Aug': 0.04,
+    'Sep': 0.04,
+    'Oct': 0.04,
+    'Nov': 0.24,
+    'Dec': 0.13,
+}
+REGIONS = [0.39, 0.09, 0.2, 0.1, 0.03, 0.07, 0.06, 0.03, 0.03]
+VISITOR_TYPES = {'Returning_Visitor': 0.85, 'New_Visitor': 0.14, 'Other': 0.01}
+
+
+def _durations(rng: np.random.Generator, pages: np.ndarray, mean: float) -> np.ndarray:
+    """Return the time spent on `pages` pages, zero when no page was visited"""
+    return np.where(pages > 0, rng.gamma(1.0, mean, len(pages)) * pages, 0.0)
+
+
+def generate(rows: int, seed: int = 42) -> pd.DataFrame:
+    """Return synthetic raw sessions
+    Args:
+        rows: int, number of sessions
+        seed: int, seed of the generator, the same seed gives the same data
+    Returns:
+        pd.DataFrame with the columns and dtypes of `storage.schema`
+    """
+    rng = np.random.default_rng(seed)
+
+    administrative = rng.poisson(2.3, rows)
+    informational = rng.poisson(0.5, rows)
+    product_related = rng.negative_binomial(1, 1 / 32, rows)
+    bounce_rates = np.clip(rng.beta(0.5, 20, rows), 0, 0.2)
+    exit_rates = np.clip(bounce_rates + rng.beta(1.5, 30, rows), 0, 0.2)
+    page_values = np.where(rng.random(rows) < 0.22, rng.gamma(1.0, 27, rows), 0.0)
+
+    logit = -2.6 + 0.08 * page_values - 25 * exit_rates + rng.normal(0, 0.5, rows)
+    revenue = rng.random(rows) < 1 / (1 + np.exp(-logit))
+
+    data = pd.DataFrame(
+        {
+            'Administrative': administrative,
+            'Administrative_Duration': _durations(rng, administrative, 35),
+            'Informational': informational,
+            'Informational_Duration': _durations(rng, informational, 70),
+            'ProductRelated': product_related,
+            'ProductRelated_Duration': _durations(rng, product_related, 37),
+            'BounceRates': bounce_rates,
+            'ExitRates': exit_rates,
+            'PageValues': page_values,
+            'SpecialDay': rng.choice(
+                [0.0, 0.2, 0.4, 0.6, 0.8, 1.0], rows, p=[0.9, 0.02, 0.02, 0.03, 0.02, 0.01]
+            ),
+            'Month': rng.choice(list(MONTHS), rows, p=list(MONTHS.values())),
+            'OperatingSystems': rng.choice(4, rows, p=[0.21, 0.54, 0.21, 0.04]) + 1,
+            'Browser': rng.choice(7, rows, p=[0.2, 0.65, 0.01, 0.06, 0.04, 0.01, 0.03]) + 1,
+            'Region': rng.choice(9, rows, p=REGIONS) + 1,
+            'TrafficType': np.minimum(rng.geometric(0.35, rows), 20),
+            'VisitorType': rng.choice(
+                list(VISITOR_TYPES), rows, p=list(VISITOR_TYPES.values())
+            ),
+            'Weekend': rng.random(rows) < 0.23,
+            'Revenue': revenue,
+        }
+    )
+    return apply_schema(data[list(schema)])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=12330)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', required=True, help='.parquet, .feather or .csv file')
+    args = parser.parse_args()
+
+    write_table(generate(args.rows, args.seed), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,13 @@
 """ module responsible for loading data from raw directory"""
 import os
+from typing import Iterator, List, Optional
 
 import pandas as pd
 import structlog
 
+from instrumentation import stage
+from storage import data_path, filename, iter_table, read_table, write_table
+
 logger = structlog.getLogger()
 
 
@@ -16,26 +20,58 @@ class DataIngest:
         
         This function sets the following attributes:
         data_raw_path : str : the directory where the raw data csv file is located.
-        data_raw_name : str : the name of the raw data csv file
+        data_raw_name : str : the name of the raw data file, the columnar copy when it
+        exists and the csv file otherwise
         """
-        self.data_raw_path = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), "../data/raw"
-        )
-        self.data_raw_name = "data.csv"
+        self.data_raw_path = data_path("raw")
+        self.data_raw_name = filename("data")
+        if not os.path.exists(self._path_raw_data()):
+            self.data_raw_name = "data.csv"
 
-    def load_data(self) -> pd.DataFrame:
+    def load_data(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
         """Function for loading data from raw directory
 
+        args:
+        columns: columns to be read, all of them when None
+
         return:
         data from raw directory: pandas Dataframe
         """
         logger.info("Starting loading data...")
 
-        loaded_data = pd.read_csv(self._path_raw_data())
+        with stage("load_data") as current:
+            loaded_data = read_table(self._path_raw_data(), columns=columns)
+            current.rows = len(loaded_data)
 
         logger.info("Success loading data...")
         return loaded_data
 
+    def iter_data(
+        self, chunksize: int, columns: Optional[List[str]] = None
+    ) -> Iterator[pd.DataFrame]:
+        """Function for streaming data from raw directory in chunks
+
+        args:
+        chunksize: rows per chunk
+        columns: columns to be read, all of them when None
+
+        return:
+        chunks of the data from raw directory: iterator of pandas Dataframe
+        """
+        logger.info(f"Starting streaming data in chunks of {chunksize} rows...")
+        return iter_table(self._path_raw_data(), chunksize, columns=columns)
+
+    def to_columnar(self) -> None:
+        """Function writing a columnar copy of the raw csv file
+
+        Later loads read the copy, which keeps the dtypes of the schema and
+        supports reading only some columns.
+        """
+        data = read_table(os.path.join(self.data_raw_path, "data.csv"))
+        self.data_raw_name = filename("data")
+        write_table(data, self._path_raw_data())
+        logger.info(f"Raw data saved as {self.data_raw_name}")
+
     def _path_raw_data(self) -> str:
         """Function create raw data path
 
@@ -45,3 +81,7 @@ class DataIngest:
         path_raw_data = os.path.join(self.data_raw_path, self.data_raw_name)
 
         return path_raw_data
+
+
+if __name__ == "__main__":
+    DataIngest().to_columnar()
@@ -0,0 +1,123 @@
+"""module responsible for preparing the train and test data in process
+
+It only depends on the data and pipeline modules, so the workers and the final model
+can get the prepared data without importing mlflow, optuna, hydra or the model zoo.
+"""
+import os
+from typing import Tuple
+
+import pandas as pd
+import structlog
+from sklearn.model_selection import train_test_split
+
+from feature_store import attach, feature_store_enabled, materialize
+from instrumentation import instrumented, stage
+from split_data import SplitData
+from storage import FEATURES, TARGET
+from utils import _model_dir, file_digest, load_model, load_train_data, to_category_features
+
+logger = structlog.getLogger()
+
+_prepared_data = {}
+_transformed_data = {}
+
+
+def spliting_data() -> str:
+    chunksize = os.environ.get('SPLIT_CHUNKSIZE')
+    return SplitData(chunksize=int(chunksize) if chunksize else None).split_data()
+
+
+@instrumented('data_preparation', rows=lambda data: len(data[0]) + len(data[1]))
+def data_preparation() -> pd.DataFrame:
+    """
+    Prepare the data for modeling.
+    
+    Returns:
+    Tuple: containing 4 dataframes (X_train, X_test, y_train, y_test) 
+    that are splitted and prepared for modeling
+    
+    This function loads the train data, converts specified columns to categorical data type, 
+    splits the data into training and testing sets, drops the 'to_split' column and returns the 
+    data in 4 dataframes (X_train, X_test, y_train, y_test)
+
+    The split is keyed on the raw data and split parameters, so later calls in the
+    same process reuse the prepared data without reading or writing any file.
+    """
+    split_key = spliting_data()
+    if split_key in _prepared_data:
+        return tuple(data.copy() for data in _prepared_data[split_key])
+
+    df = load_train_data(columns=FEATURES + [TARGET, 'to_split'])
+    df = to_category_features(df)
+
+    X = df.drop('Revenue', axis=1)
+    y = df['Revenue'].ravel()
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X,
+        y,
+        test_size=0.3,
+        random_state=42,
+        stratify=df[['to_split']],
+    )
+    X_train.drop('to_split', axis=1, inplace=True)
+    X_test.drop('to_split', axis=1, inplace=True)
+
+    _prepared_data[split_key] = (X_train, X_test, y_train, y_test)
+    return tuple(data.copy() for data in _prepared_data[split_key])
+
+
+def _data_key() -> Tuple[str, str]:
+    """
+    Returns the key of the transformed data: the split key and the pipeline digest.
+    """
+    return spliting_data(), file_digest(os.path.join(_model_dir(), 'pipeline.joblib'))
+
+
+def transformed_data() -> Tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]:
+    """
+    This function applies data transformation to the training and testing datasets.
+    The transformation is performed using a pipeline model that is loaded from a file.
+
+    Returns:
+    A tuple containing the transformed training and testing datasets, as well as the training and testing target variables.
+
+    Example:
+    X_train_transformed, X_test_transformed, y_train, y_test = transformed_data()
+
+    The result is kept in process for the current split and pipeline, so the trials
+    of a study share it, and in the feature store, so other processes attach it
+    memory-mapped instead of transforming the data again, see `feature_store.py`.
+    Callers must not modify the returned data in place.
+    """
+    try:
+        key = _data_key()
+        if key in _transformed_data:
+            return _transformed_data[key]
+        if feature_store_enabled():
+            attached = attach(key)
+            if attached is not None:
+                _transformed_data[key] = attached
+                return attached
+        pipe = load_model('pipeline')
+    except FileNotFoundError as e:
+        logger.error(f"The pipeline model file does not exist: {e}")
+        raise e
+
+    try:
+        X_train, X_test, y_train, y_test = data_preparation()
+
+        with stage('pipeline_transform', rows=len(X_train) + len(X_test)):
+            X_train_transformed = pipe.transform(X_train)
+            X_test_transformed = pipe.transform(X_test)
+
+        logger.info("Data transformation completed successfully")
+
+        data = X_train_transformed, X_test_transformed, y_train, y_test
+        if feature_store_enabled():
+            data = materialize(key, *data)
+        _transformed_data[key] = data
+        return data
+    except Exception as e:
+        logger.error(f"Data transformation failed: {e}")
+        raise e
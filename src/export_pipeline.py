@@ -0,0 +1,61 @@
+"""module responsible for compiling the fitted pipeline for serving"""
+import os
+import sys
+
+import numpy as np
+import structlog
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../api'))
+
+from compiled_pipeline import CompiledPipeline, check_parity
+from data_preparation import data_preparation
+from registry import release_serving
+from utils import _model_dir, file_digest, load_model, save_model
+
+logger = structlog.getLogger()
+
+
+def compile_pipeline(pipe, datasets) -> CompiledPipeline:
+    """
+    Returns the compiled plan of a fitted pipeline, checked against it.
+
+    Parameters:
+    pipe (Pipeline): fitted pipeline
+    datasets (list): raw DataFrames the plan must transform bit-identically to
+    `pipe.transform`, in float64 and float32
+
+    Nothing is saved, so callers can check the plan before replacing any artifact.
+    """
+    compiled = CompiledPipeline.from_pipeline(pipe)
+    for data in datasets:
+        for dtype in (np.float64, np.float32):
+            check_parity(pipe, compiled, data, dtype=dtype)
+    return compiled
+
+
+def export_pipeline() -> None:
+    """
+    Compile `pipeline.joblib` into `pipeline_plan.joblib`.
+
+    The compiled plan is checked against the saved pipeline on the train and test
+    splits, both in float64 and float32, and is only saved when every value is
+    bit-identical to `pipe.transform`. The plan is then released in the registry
+    along with the pipeline it was compiled from, once a final model exists.
+    """
+    try:
+        pipe = load_model('pipeline')
+    except FileNotFoundError as e:
+        logger.error(f"The pipeline model file does not exist: {e}")
+        raise e
+
+    X_train, X_test, _, _ = data_preparation()
+    compiled = compile_pipeline(pipe, [X_train, X_test])
+
+    save_model(model=compiled.plan, name_file='pipeline_plan')
+    logger.info("Compiled pipeline exported successfully")
+    pipeline_digest = file_digest(os.path.join(_model_dir(), 'pipeline.joblib'))
+    release_serving(plan_source=pipeline_digest)
+
+
+if __name__ == "__main__":
+    export_pipeline()
@@ -0,0 +1,165 @@
+"""module responsible for sharing the transformed matrices between processes
+
+The transformed train and test matrices are written once as .npy files with a
+manifest of their columns and dtypes, keyed by the split key and the pipeline
+digest. Processes attach them memory-mapped: training and trial workers share one
+copy of the pages instead of reading the data and running the pipeline each, and
+joblib passes the mapped arrays to its workers by file name instead of pickling them.
+
+    <FEATURE_STORE_DIR>/<entry>/manifest.json
+    <FEATURE_STORE_DIR>/<entry>/{X_train,X_test,y_train,y_test}.npy
+
+An entry is written to a temporary directory renamed into place, and the entries of
+another split or pipeline are removed when a new one is written, once they were not
+attached for `FEATURE_STORE_GRACE_SECONDS` (one hour by default), so a process still
+attaching an older entry does not see its files disappear. `FEATURE_STORE=0`
+disables the store.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import structlog
+
+from storage import data_path
+
+logger = structlog.getLogger()
+
+ARRAYS = ('X_train', 'X_test', 'y_train', 'y_test')
+GRACE_SECONDS = float(os.environ.get('FEATURE_STORE_GRACE_SECONDS', 3600))
+
+
+def feature_store_enabled() -> bool:
+    """Returns whether the feature store is enabled, with FEATURE_STORE=0 it is not"""
+    return os.environ.get('FEATURE_STORE', '1') == '1'
+
+
+def store_dir() -> str:
+    """Returns the feature store directory, FEATURE_STORE_DIR when it is set"""
+    return os.environ.get('FEATURE_STORE_DIR', data_path('processed', 'features'))
+
+
+def entry_name(key: Tuple[str, str]) -> str:
+    """Returns the directory name of the entry of a split key and pipeline digest"""
+    return hashlib.sha256(json.dumps(list(key)).encode()).hexdigest()[:16]
+
+
+def attach(key: Tuple[str, str]) -> Optional[tuple]:
+    """
+    Returns the matrices stored for a key, memory-mapped read-only.
+
+    Parameters:
+    key (tuple): split key and pipeline digest, see `data_preparation._data_key`
+
+    Returns:
+    tuple : X_train and X_test as DataFrames over the mapped float64 matrices, y_train
+    and y_test as mapped arrays, or None when no entry matches the key
+    """
+    directory = os.path.join(store_dir(), entry_name(key))
+    manifest_path = os.path.join(directory, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    if manifest['key'] != list(key):
+        return None
+
+    # the modification time of the entry is the last time it was attached
+    try:
+        os.utime(directory)
+    except OSError:  # read-only store
+        pass
+    arrays = {
+        name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+        for name in ARRAYS
+    }
+    columns = manifest['columns']
+    return (
+        pd.DataFrame(arrays['X_train'], columns=columns, copy=False),
+        pd.DataFrame(arrays['X_test'], columns=columns, copy=False),
+        arrays['y_train'],
+        arrays['y_test'],
+    )
+
+
+def materialize(
+    key: Tuple[str, str],
+    X_train: pd.DataFrame,
+    X_test: pd.DataFrame,
+    y_train: np.ndarray,
+    y_test: np.ndarray,
+) -> tuple:
+    """
+    Writes the transformed matrices for a key and returns them attached.
+
+    Parameters:
+    key (tuple): split key and pipeline digest, see `data_preparation._data_key`
+    X_train, X_test (pd.DataFrame): transformed features
+    y_train, y_test (np.ndarray): targets
+
+    Returns:
+    tuple : the matrices memory-mapped, as returned by `attach`
+
+    The features are stored as float64, the dtype the models convert them to, so the
+    mapped matrices are used without conversion. Entries of other keys are removed.
+    """
+    attached = attach(key)
+    if attached is not None:
+        return attached
+
+    name = entry_name(key)
+    directory = os.path.join(store_dir(), name)
+    partial_directory = f'{directory}.{os.getpid()}.tmp'
+    os.makedirs(partial_directory, exist_ok=True)
+    try:
+        arrays = {
+            'X_train': np.ascontiguousarray(X_train, dtype=np.float64),
+            'X_test': np.ascontiguousarray(X_test, dtype=np.float64),
+            'y_train': np.ascontiguousarray(y_train),
+            'y_test': np.ascontiguousarray(y_test),
+        }
+        for array_name, array in arrays.items():
+            np.save(os.path.join(partial_directory, f'{array_name}.npy'), array)
+        manifest = {
+            'key': list(key),
+            'columns': [str(column) for column in X_train.columns],
+            'dtypes': {array_name: str(array.dtype) for array_name, array in arrays.items()},
+            'shapes': {array_name: list(array.shape) for array_name, array in arrays.items()},
+        }
+        with open(os.path.join(partial_directory, 'manifest.json'), 'w') as file:
+            json.dump(manifest, file, indent=2)
+        try:
+            os.rename(partial_directory, directory)
+        except OSError:
+            # another process stored the same entry first
+            pass
+    finally:
+        shutil.rmtree(partial_directory, ignore_errors=True)
+
+    _remove_stale(keep=name)
+    logger.info(
+        "Stored the transformed matrices in the feature store",
+        entry=name,
+        rows=len(X_train) + len(X_test),
+    )
+    return attach(key)
+
+
+def _remove_stale(keep: str) -> None:
+    """Removes the entries of other split keys or pipelines not attached recently"""
+    now = time.time()
+    for name in os.listdir(store_dir()):
+        if name == keep or name.endswith('.tmp'):
+            continue
+        path = os.path.join(store_dir(), name)
+        try:
+            idle_seconds = now - os.stat(path).st_mtime
+        except FileNotFoundError:
+            continue
+        if idle_seconds >= GRACE_SECONDS:
+            shutil.rmtree(path, ignore_errors=True)
@@ -1,19 +1,41 @@
 """Module responsible for training the final model.
 
-This module uses the `transformed_data` module to retrieve the preprocessed training data,
+This module uses the `transformed_data` function to retrieve the preprocessed training data,
 trains a LightGBM model using the provided configuration parameters, and saves the trained
-model using the `save_model` utility.
+model using the `save_model` utility. The booster is also exported as a native LightGBM
+model file for the serving fast path, once it is checked to predict exactly like the model.
+The operating threshold maximizing the F1 on out-of-fold probabilities of the training
+split is saved next to it, so the test split is only used to report its metrics.
+The statistics of the training rows are saved for the incremental retraining in `retrain.py`,
+the compiled plan, when one is served, is exported again from the current pipeline,
+and the artifacts are released and promoted as a version of 'final_model' in the registry.
 """
+import os
+import sys
+
 import hydra
 import lightgbm
+import numpy as np
 import structlog
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
+from sklearn.model_selection import cross_val_predict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../api'))
 
-from optimization import transformed_data
-from utils import save_model
+from booster import BoosterModel
+from data_preparation import data_preparation, transformed_data
+from export_pipeline import compile_pipeline
+from incremental import PipelineStats, mark_applied
+from instrumentation import stage
+from metrics import best_threshold, classification_metrics
+from registry import PLAN, release_serving
+from utils import _model_dir, file_digest, load_model, save_booster, save_model
 
 logger = structlog.getLogger()
 
+# folds of the out-of-fold probabilities the operating threshold is picked on
+THRESHOLD_CV = 5
+
 
 @hydra.main(config_path='../config/model', config_name='model')
 def final_model(config: DictConfig):
@@ -25,19 +47,149 @@ def final_model(config: DictConfig):
     Returns:
         None
     """
-    X_train_transformed, _, y_train, _ = transformed_data()
-
-    lgbm = lightgbm.LGBMClassifier(
-        bagging_fraction=config.params.bagging_fraction,
-        bagging_freq=config.params.bagging_freq,
-        feature_fraction=config.params.feature_fraction,
-        lambda_l1=config.params.lambda_l1,
-        lambda_l2=config.params.lambda_l2,
-        min_child_samples=config.params.min_child_samples,
-        num_leaves=config.params.num_leaves,
-    )
+    pipeline_digest = file_digest(os.path.join(_model_dir(), 'pipeline.joblib'))
+    X_train_transformed, X_test_transformed, y_train, y_test = transformed_data()
+    X_train, X_test, _, _ = data_preparation()
+
+    lgbm = build_final_model(config.params)
     lgbm.fit(X_train_transformed, y_train)
+    proba_oof = out_of_fold_proba(config.params, X_train_transformed, y_train)
+    check_booster_parity(lgbm, X_test_transformed)
+    compiled = None
+    if os.path.exists(os.path.join(_model_dir(), PLAN)):
+        # the plan may come from the pipeline of a previous training
+        compiled = compile_pipeline(load_model('pipeline'), [X_train, X_test])
+
+    if compiled is not None:
+        save_model(compiled.plan, 'pipeline_plan')
     save_model(lgbm, 'final_model')
+    save_booster(lgbm, 'final_model')
+    operating_threshold = save_operating_threshold(
+        y_train, proba_oof, y_test, lgbm.predict_proba(X_test_transformed)[:, 1]
+    )
+    save_retrain_state(X_train)
+    release_serving(
+        metadata={
+            'params': OmegaConf.to_container(config.params),
+            'operating_threshold': operating_threshold,
+        },
+        plan_source=pipeline_digest if compiled is not None else None,
+        model_source=pipeline_digest,
+    )
+
+
+def out_of_fold_proba(params: DictConfig, X, y, cv: int = THRESHOLD_CV) -> np.ndarray:
+    """Returns the out-of-fold probabilities of the final model on the training split.
+
+    Args:
+        params (DictConfig): params of the final model
+        X: transformed training rows
+        y: actual labels of the rows
+        cv (int): number of stratified folds
+
+    Returns:
+        np.ndarray: probability of the positive class of each row, predicted by the
+        model fitted on the other folds
+    """
+    with stage('threshold_folds', rows=len(X)):
+        return cross_val_predict(
+            build_final_model(params), X, y, cv=cv, method='predict_proba'
+        )[:, 1]
+
+
+def save_operating_threshold(
+    y, proba, y_test=None, proba_test=None, metric: str = 'F1'
+) -> dict:
+    """Saves the threshold of the predicted probability maximizing a metric.
+
+    Every threshold is evaluated from one sort of the probabilities, see
+    `metrics.threshold_sweep`, so the rows are scored once. The threshold is picked
+    on held-out probabilities of the training rows, never on the test rows, whose
+    metrics at that threshold are only reported.
+
+    Args:
+        y: actual labels of the rows to pick the threshold on
+        proba: out-of-fold probabilities of the positive class of those rows
+        y_test: actual labels of the test rows, None to skip the test metrics
+        proba_test: probabilities of the positive class of the test rows
+        metric (str): metric to maximize
+
+    Returns:
+        dict: the threshold, the metric it maximizes, the out-of-fold metrics at that
+        threshold and, with the test rows, the test metrics prefixed with 'test_'
+    """
+    threshold, metrics = best_threshold(y, proba, metric=metric)
+    operating_threshold = {'threshold': threshold, 'metric': metric, **metrics}
+    if y_test is not None:
+        test_metrics = classification_metrics(y_test, np.asarray(proba_test) >= threshold)
+        operating_threshold.update(
+            {f'test_{name}': value for name, value in test_metrics.items()}
+        )
+    save_model(operating_threshold, 'operating_threshold')
+    logger.info("Operating threshold of the final model", **operating_threshold)
+    return operating_threshold
+
+
+def save_retrain_state(X_train) -> None:
+    """Saves the statistics incremental retraining starts from.
+
+    The model is fitted without any delta file, so they are all pending again.
+
+    Args:
+        X_train (pd.DataFrame): raw rows the pipeline and the model were fitted on
+
+    Returns:
+        None
+    """
+    stats = PipelineStats.from_data(load_model('pipeline'), X_train)
+    save_model(stats, 'pipeline_stats')
+    mark_applied([], reset=True)
+
+
+def build_final_model(params: DictConfig) -> lightgbm.LGBMClassifier:
+    """Returns the final model, not fitted.
+
+    Args:
+        params (DictConfig): best params found by the optimization.
+
+    Returns:
+        LGBMClassifier
+    """
+    return lightgbm.LGBMClassifier(
+        bagging_fraction=params.bagging_fraction,
+        bagging_freq=params.bagging_freq,
+        feature_fraction=params.feature_fraction,
+        lambda_l1=params.lambda_l1,
+        lambda_l2=params.lambda_l2,
+        min_child_samples=params.min_child_samples,
+        num_leaves=params.num_leaves,
+        n_estimators=params.get('n_estimators', 100),
+    )
+
+
+def check_booster_parity(lgbm: lightgbm.LGBMClassifier, X) -> None:
+    """Raises when the native booster does not predict exactly like the model.
+
+    The booster is parsed from the text `save_booster` writes, in memory, so the
+    check runs before any saved artifact is replaced.
+
+    Args:
+        lgbm (LGBMClassifier): fitted model
+        X: transformed rows to compare the predictions on
+
+    Returns:
+        None
+    """
+    native = BoosterModel(lightgbm.Booster(model_str=lgbm.booster_.model_to_string()))
+    expected = lgbm.predict_proba(X)
+    X = np.ascontiguousarray(X, dtype=np.float64)
+
+    if not np.array_equal(native.predict_proba(X), expected):
+        raise ValueError("Native booster batch predictions differ from the model")
+    for i in range(min(100, len(X))):
+        if not np.array_equal(native.predict_proba(X[i : i + 1]), expected[i : i + 1]):
+            raise ValueError("Native booster single-row predictions differ from the model")
+    logger.info("Native booster predictions match the model")
 
 
 if __name__ == "__main__":
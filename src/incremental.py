@@ -0,0 +1,205 @@
+"""module responsible for the running statistics and delta files of incremental retraining"""
+import json
+import os
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from storage import data_path, read_table
+from utils import file_digest
+
+
+class PipelineStats:
+    """Running statistics of the data encoded by a fitted pipeline
+
+    The counts of every category and the min/max of every scaled feature are
+    updated with each batch of new rows, so the encodings a refit of the pipeline
+    would learn can be compared to the frozen ones without reading the old rows.
+    """
+
+    def __init__(self, pipe) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        tol : float : frequency under which the rare label encoder groups a category
+        n_categories : int : categories under which the rare label encoder keeps all of them
+        rare_variables : list : features of the rare label encoder
+        onehot_variables : list : features of the one-hot encoder
+        minmax_variables : list : features of the min-max scaler
+        counts : dict : count of each category of each encoded feature
+        data_min : np.ndarray : running minimum of each scaled feature
+        data_max : np.ndarray : running maximum of each scaled feature
+        rows : int : number of rows seen
+        """
+        rare_enc = pipe.named_steps['rare_enc']
+        onehot = pipe.named_steps['onehot']
+        minmax = pipe.named_steps['minmax']
+
+        self.tol = rare_enc.tol
+        self.n_categories = rare_enc.n_categories
+        self.rare_variables = list(rare_enc.variables_)
+        self.onehot_variables = list(onehot.variables_)
+        self.minmax_variables = list(minmax.variables_)
+        self.counts: Dict[str, Counter] = {
+            feature: Counter() for feature in self.rare_variables + self.onehot_variables
+        }
+        self.data_min = np.full(len(self.minmax_variables), np.inf)
+        self.data_max = np.full(len(self.minmax_variables), -np.inf)
+        self.rows = 0
+
+    @classmethod
+    def from_data(cls, pipe, X: pd.DataFrame) -> 'PipelineStats':
+        """
+        Returns the statistics of the rows the pipeline was fitted on.
+
+        Parameters:
+        pipe: fitted pipeline
+        X (pd.DataFrame): raw rows the pipeline was fitted on
+        """
+        stats = cls(pipe)
+        stats.update(X)
+        return stats
+
+    def update(self, X: pd.DataFrame) -> None:
+        """
+        Adds a batch of raw rows to the statistics.
+
+        Parameters:
+        X (pd.DataFrame): raw rows with the features of the pipeline
+        """
+        for feature, counts in self.counts.items():
+            counts.update(X[feature].value_counts().to_dict())
+        if len(X):
+            values = X[self.minmax_variables].to_numpy(dtype=np.float64)
+            np.minimum(self.data_min, values.min(axis=0), out=self.data_min)
+            np.maximum(self.data_max, values.max(axis=0), out=self.data_max)
+        self.rows += len(X)
+
+    def frequent_categories(self, feature: str) -> set:
+        """
+        Returns the categories a refit of the rare label encoder would keep.
+
+        Same rule as `RareLabelEncoder.fit`: every category when the feature has up to
+        `n_categories` of them, otherwise those with a frequency of at least `tol`.
+        """
+        counts = self.counts[feature]
+        if len(counts) <= self.n_categories:
+            return set(counts)
+        return {
+            category for category, count in counts.items() if count / self.rows >= self.tol
+        }
+
+    def drift(self, pipe) -> dict:
+        """
+        Compares the statistics to the encodings of the fitted pipeline.
+
+        Parameters:
+        pipe: fitted pipeline the statistics were started from
+
+        Returns:
+        dict : 'range_drift', the largest share of its fitted range by which a scaled
+        feature went out of it, and 'categories', per feature, the categories a refit
+        would add to or remove from the encoding
+        """
+        rare_enc = pipe.named_steps['rare_enc']
+        onehot = pipe.named_steps['onehot']
+        scaler = pipe.named_steps['minmax'].transformer_
+
+        categories = {}
+        for feature in self.rare_variables:
+            fitted = set(rare_enc.encoder_dict_[feature])
+            changed = self.frequent_categories(feature) ^ fitted
+            if changed:
+                categories[feature] = sorted(map(str, changed))
+        for feature in self.onehot_variables:
+            if feature in self.rare_variables:
+                continue
+            unseen = set(self.counts[feature]) - set(onehot.encoder_dict_[feature])
+            if unseen:
+                categories[feature] = sorted(map(str, unseen))
+
+        fitted_range = np.where(scaler.data_range_ > 0, scaler.data_range_, 1.0)
+        outside = np.maximum(scaler.data_min_ - self.data_min, 0) + np.maximum(
+            self.data_max - scaler.data_max_, 0
+        )
+        range_drift = float((outside / fitted_range).max()) if len(outside) else 0.0
+        return {'range_drift': range_drift, 'categories': categories}
+
+
+def deltas_dir() -> str:
+    """Returns the directory where the daily batches of new rows are dropped"""
+    return data_path('processed', 'deltas')
+
+
+def _applied_path() -> str:
+    return os.path.join(deltas_dir(), 'applied.json')
+
+
+def applied_deltas() -> Dict[str, str]:
+    """
+    Returns the delta files already boosted into the final model, by digest.
+    """
+    if not os.path.exists(_applied_path()):
+        return {}
+    with open(_applied_path()) as file:
+        return json.load(file)
+
+
+def all_deltas() -> List[str]:
+    """Returns the paths of every delta file, applied or not, in name order"""
+    if not os.path.isdir(deltas_dir()):
+        return []
+    return [
+        os.path.join(deltas_dir(), name)
+        for name in sorted(os.listdir(deltas_dir()))
+        if os.path.splitext(name)[1] in ('.parquet', '.feather', '.csv')
+    ]
+
+
+def pending_deltas() -> List[str]:
+    """
+    Returns the paths of the delta files not yet boosted into the final model.
+
+    A file counts as applied only when its content did not change since, so a delta
+    rewritten in place is applied again.
+    """
+    applied = applied_deltas()
+    return [
+        path
+        for path in all_deltas()
+        if applied.get(os.path.basename(path)) != file_digest(path)
+    ]
+
+
+def read_deltas(paths: List[str], columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads and concatenates delta files.
+
+    Parameters:
+    paths (list): .parquet, .feather or .csv files with the raw columns and 'Revenue'
+    columns (list): columns to be read, all of them when None
+    """
+    return pd.concat(
+        [read_table(path, columns=columns) for path in paths], ignore_index=True
+    )
+
+
+def mark_applied(paths: List[str], reset: bool = False) -> None:
+    """
+    Records delta files as boosted into the final model.
+
+    Parameters:
+    paths (list): delta files to record
+    reset (bool): forget the files recorded before, after a retrain from scratch
+
+    The record is renamed into place, so an interrupted run leaves the previous one.
+    """
+    applied = {} if reset else applied_deltas()
+    applied.update({os.path.basename(path): file_digest(path) for path in paths})
+    os.makedirs(deltas_dir(), exist_ok=True)
+    with open(f'{_applied_path()}.tmp', 'w') as file:
+        json.dump(applied, file, indent=2, sort_keys=True)
+    os.replace(f'{_applied_path()}.tmp', _applied_path())
@@ -0,0 +1,242 @@
+"""module responsible for timing and profiling the pipeline stages"""
+import collections
+import contextlib
+import cProfile
+import functools
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional
+
+import structlog
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = structlog.getLogger()
+
+PROFILE_STAGES = os.environ.get('PROFILE_STAGES', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+MAX_PENDING_RECORDS = int(os.environ.get('MAX_PENDING_RECORDS', 1000))
+
+# records kept by the open `collect_records` blocks for the run opened next
+_collectors: List[Deque[dict]] = []
+_collectors_lock = threading.Lock()
+_profiling = threading.local()
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Returns the peak resident set size of this process in MB, None when unknown.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return max_rss / 1024 / 1024
+    return max_rss / 1024
+
+
+class Stage:
+    """Measurements of a running stage, `rows` can be set once they are known"""
+
+    def __init__(self, name: str, rows: Optional[int] = None, **fields) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        name : str : name of the stage, used as prefix of its mlflow metrics
+        rows : int : rows processed by the stage, None when it does not apply
+        fields : dict : extra fields logged with the measurements
+        record : dict : measurements of the stage, set when it ends
+        """
+        self.name = name
+        self.rows = rows
+        self.fields = fields
+        self.record: Optional[dict] = None
+
+
+def _should_profile(name: str) -> bool:
+    """Returns whether PROFILE_STAGES asks for a profile of the stage"""
+    stages = {stage.strip() for stage in PROFILE_STAGES.split(',') if stage.strip()}
+    return bool(stages) and ('all' in stages or name in stages)
+
+
+@contextlib.contextmanager
+def stage(
+    name: str,
+    rows: Optional[int] = None,
+    emit: bool = True,
+    **fields,
+) -> Iterator[Stage]:
+    """
+    Measures the wall time, CPU time and peak RSS of the block.
+
+    Parameters:
+    name (str): name of the stage, such as 'load_data'
+    rows (int): rows processed by the stage, can also be set on the yielded Stage
+    emit (bool): log the measurements to structlog and mlflow when the stage ends, False
+    to only fill `Stage.record`, for stages run in worker processes
+    fields: extra fields logged with the measurements
+
+    Returns:
+    Iterator[Stage] : the running stage
+
+    CPU time is the one of the whole process, so it includes the threads running
+    concurrently. The peak RSS is the one of the process since it started, reported
+    with its growth during the stage. The metrics go to the active mlflow run, see
+    `collect_records` for stages run before the run is opened.
+
+    With PROFILE_STAGES set to a comma separated list of stage names, or 'all', the
+    stage is run under cProfile and the stats are dumped to PROFILE_DIR. Nested stages
+    are included in the profile of the outermost profiled stage.
+    """
+    current = Stage(name, rows, **fields)
+    profiler = None
+    if _should_profile(name) and not getattr(_profiling, 'active', False):
+        profiler = cProfile.Profile()
+        _profiling.active = True
+        profiler.enable()
+
+    rss_before = peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield current
+    finally:
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.process_time() - cpu_start
+        if profiler is not None:
+            profiler.disable()
+            _profiling.active = False
+            _dump_profile(profiler, name)
+
+        rss_after = peak_rss_mb()
+        current.record = {
+            'stage': name,
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': cpu_seconds,
+            'peak_rss_mb': rss_after,
+            'peak_rss_growth_mb': (
+                rss_after - rss_before if rss_after is not None else None
+            ),
+            'rows': current.rows,
+            **current.fields,
+        }
+        if emit:
+            emit_record(current.record)
+
+
+def instrumented(
+    name: Optional[str] = None, rows: Optional[Callable[[Any], int]] = None
+) -> Callable:
+    """
+    Decorator running the function in a `stage`.
+
+    Parameters:
+    name (str): name of the stage, the function name when None
+    rows (callable): function of the returned value giving the rows processed
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name or function.__name__) as current:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    current.rows = rows(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def merge_records(name: str, records: Iterable[dict], **fields) -> dict:
+    """
+    Returns a single record for stages run as parts, such as the folds of a model.
+
+    Wall and CPU seconds and rows are summed, so they are the total work of the parts
+    and not the elapsed time when they ran in parallel, and the peak RSS is the largest.
+    """
+    records = list(records)
+    peaks = [
+        record['peak_rss_mb'] for record in records if record['peak_rss_mb'] is not None
+    ]
+    return {
+        'stage': name,
+        'wall_seconds': sum(record['wall_seconds'] for record in records),
+        'cpu_seconds': sum(record['cpu_seconds'] for record in records),
+        'peak_rss_mb': max(peaks) if peaks else None,
+        'peak_rss_growth_mb': None,
+        'rows': sum(record['rows'] or 0 for record in records),
+        'parts': len(records),
+        **fields,
+    }
+
+
+def emit_record(record: dict) -> None:
+    """
+    Logs the measurements of a stage as structured fields and as mlflow metrics.
+
+    The metrics go to the active mlflow run. Without one, the record is kept by the
+    open `collect_records` blocks, and only logged as structured fields otherwise.
+    mlflow is only used when the process already imported it, so serving and scoring
+    do not pay for it.
+    """
+    logger.info("Stage finished", **record)
+    if 'mlflow' in sys.modules and sys.modules['mlflow'].active_run() is not None:
+        log_records([record])
+        return
+    with _collectors_lock:
+        for records in _collectors:
+            records.append(record)
+
+
+@contextlib.contextmanager
+def collect_records() -> Iterator[Deque[dict]]:
+    """
+    Keeps the records of the stages finished in the block while no mlflow run is active.
+
+    Returns:
+    Iterator[Deque[dict]] : the records, for `log_records` in the run opened next
+
+    Only the last MAX_PENDING_RECORDS records are kept. Records finished outside of
+    such a block are never logged to a run opened later, so they cannot end up in an
+    unrelated run.
+    """
+    records: Deque[dict] = collections.deque(maxlen=MAX_PENDING_RECORDS)
+    with _collectors_lock:
+        _collectors.append(records)
+    try:
+        yield records
+    finally:
+        with _collectors_lock:
+            _collectors.remove(records)
+
+
+def log_records(records: Iterable[dict]) -> None:
+    """
+    Logs the measurements of stages as metrics of the active mlflow run.
+    """
+    import mlflow
+
+    metrics: Dict[str, float] = {}
+    for record in records:
+        for field in ('wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'rows'):
+            if record.get(field) is not None:
+                metrics[f"{record['stage']}.{field}"] = record[field]
+    if metrics:
+        mlflow.log_metrics(metrics)
+
+
+def _dump_profile(profiler: cProfile.Profile, name: str) -> None:
+    """Writes the cProfile stats of a stage to PROFILE_DIR"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f'{name}-{os.getpid()}-{time.time_ns()}.prof')
+    profiler.dump_stats(path)
+    logger.info(f"Profile of stage {name} saved in {path}")
@@ -0,0 +1,140 @@
+"""module responsible for the binary classification metrics
+
+The confusion counts are built once with NumPy and every metric is derived from
+them, and the metrics of every threshold come from a single sort of the predicted
+probabilities, so the operating threshold is picked without scoring the rows again.
+"""
+from typing import Dict, NamedTuple, Tuple
+
+import numpy as np
+
+
+class ConfusionCounts(NamedTuple):
+    """True/false positives and negatives of binary predictions"""
+
+    tp: int
+    fp: int
+    fn: int
+    tn: int
+
+
+def confusion_counts(actual, pred) -> ConfusionCounts:
+    """
+    Returns the confusion counts of binary predictions.
+
+    Parameters:
+    actual (array-like): actual labels, 0 or 1
+    pred (array-like): predicted labels, 0 or 1
+
+    Returns:
+    ConfusionCounts : counts in one pass over the labels
+    """
+    actual = np.asarray(actual).astype(bool, copy=False).ravel()
+    pred = np.asarray(pred).astype(bool, copy=False).ravel()
+    if len(actual) != len(pred):
+        raise ValueError(f"Found {len(actual)} actual labels and {len(pred)} predictions")
+
+    # 0: tn, 1: fn, 2: fp, 3: tp
+    tn, fn, fp, tp = np.bincount(actual.astype(np.int8) + 2 * pred, minlength=4)
+    return ConfusionCounts(int(tp), int(fp), int(fn), int(tn))
+
+
+def _ratio(numerator, denominator):
+    """Element-wise numerator / denominator, 0 where the denominator is 0"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(
+        numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0
+    )
+
+
+def metrics_from_counts(counts: ConfusionCounts) -> Dict[str, float]:
+    """
+    Returns recall, precision, F1 and accuracy from confusion counts.
+
+    Undefined ratios are 0, as with the `zero_division` default of scikit-learn.
+    """
+    tp, fp, fn, tn = counts
+    return {
+        "Recall": float(_ratio(tp, tp + fn)),
+        "Precision": float(_ratio(tp, tp + fp)),
+        "F1": float(_ratio(2 * tp, 2 * tp + fp + fn)),
+        "Accuracy": float(_ratio(tp + tn, tp + fp + fn + tn)),
+    }
+
+
+def classification_metrics(actual, pred) -> Dict[str, float]:
+    """
+    Returns recall, precision, F1 and accuracy of binary predictions.
+
+    Parameters:
+    actual (array-like): actual labels, 0 or 1
+    pred (array-like): predicted labels, 0 or 1
+    """
+    return metrics_from_counts(confusion_counts(actual, pred))
+
+
+def f1(actual, pred) -> float:
+    """Returns the F1 score of binary predictions"""
+    return metrics_from_counts(confusion_counts(actual, pred))["F1"]
+
+
+def threshold_sweep(actual, proba) -> Dict[str, np.ndarray]:
+    """
+    Returns the metrics of every threshold of the predicted probabilities.
+
+    Parameters:
+    actual (array-like): actual labels, 0 or 1
+    proba (array-like): predicted probabilities of the positive class
+
+    Returns:
+    dict : 'threshold', the distinct probabilities in decreasing order, and for each of
+    them the 'Recall', 'Precision', 'F1' and 'Accuracy' of predicting positive the rows
+    with a probability of at least the threshold
+
+    The probabilities are sorted once and the positives above each threshold are a
+    cumulative sum over the sorted labels, so the sweep costs one sort.
+    """
+    actual = np.asarray(actual).astype(bool, copy=False).ravel()
+    proba = np.asarray(proba, dtype=np.float64).ravel()
+    if len(actual) != len(proba):
+        raise ValueError(
+            f"Found {len(actual)} actual labels and {len(proba)} probabilities"
+        )
+
+    order = np.argsort(-proba, kind='mergesort')
+    proba = proba[order]
+    tp = np.cumsum(actual[order], dtype=np.int64)
+    # last row of each run of equal probabilities, rows tied with it are positive too
+    last = np.flatnonzero(np.diff(proba, append=-np.inf))
+    tp = tp[last]
+    fp = last + 1 - tp
+    fn = int(actual.sum()) - tp
+    tn = len(proba) - tp - fp - fn
+    return {
+        "threshold": proba[last],
+        "Recall": _ratio(tp, tp + fn),
+        "Precision": _ratio(tp, tp + fp),
+        "F1": _ratio(2 * tp, 2 * tp + fp + fn),
+        "Accuracy": _ratio(tp + tn, len(proba)),
+    }
+
+
+def best_threshold(actual, proba, metric: str = "F1") -> Tuple[float, Dict[str, float]]:
+    """
+    Returns the threshold maximizing a metric and the metrics at that threshold.
+
+    Parameters:
+    actual (array-like): actual labels, 0 or 1
+    proba (array-like): predicted probabilities of the positive class
+    metric (str): 'Recall', 'Precision', 'F1' or 'Accuracy'
+
+    Ties go to the highest threshold.
+    """
+    sweep = threshold_sweep(actual, proba)
+    if not len(sweep["threshold"]):
+        raise ValueError("Cannot pick a threshold without predictions")
+    best = int(np.argmax(sweep[metric]))
+    return float(sweep["threshold"][best]), {
+        name: float(values[best]) for name, values in sweep.items() if name != "threshold"
+    }
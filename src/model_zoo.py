@@ -0,0 +1,392 @@
+"""module responsible for scheduling the model zoo fits on a process pool"""
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+import structlog
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, clone
+from sklearn.model_selection import StratifiedKFold
+
+from instrumentation import stage
+from metrics import classification_metrics
+
+logger = structlog.getLogger()
+
+
+class ModelResult(NamedTuple):
+    """Out-of-fold predictions and probabilities of a model and its full fit
+
+    `stages` holds the measurements of the fold and full fits, empty when the
+    result was read from the cache.
+    """
+
+    oof_pred: np.ndarray
+    oof_proba: np.ndarray
+    estimator: BaseEstimator
+    stages: tuple = ()
+
+
+class Selection(NamedTuple):
+    """Outcome of the successive halving of the model zoo
+
+    `promoted` lists the models kept for the full cross validation, best first, and
+    `pruned` one dict per dropped model with its name, the rung it was dropped at,
+    the folds it was scored on, its score, the seconds of its fits and the reason,
+    'rung' when it ranked below the cut or 'budget' when its full cross validation
+    did not fit in the time left. `folds` holds the outputs of `_fit_fold` of the
+    promoted models by fold number, for `fit_models` to reuse.
+    """
+
+    promoted: List[str]
+    pruned: List[dict]
+    folds: Dict[str, Dict[int, tuple]]
+
+
+def limit_threads(model: BaseEstimator, threads: int) -> BaseEstimator:
+    """
+    Caps the threads used by a model.
+
+    Parameters:
+    model (BaseEstimator): estimator to configure
+    threads (int): threads the estimator may use
+
+    Returns:
+    BaseEstimator : the same estimator, with `n_jobs` set when it supports it
+
+    XGBoost, LightGBM and RandomForest start one thread per core by default, which
+    oversubscribes the machine when several fits run in parallel processes.
+    """
+    if 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=threads)
+    return model
+
+
+def data_digest(X: pd.DataFrame, y: np.ndarray) -> str:
+    """
+    Returns a sha256 digest of the training data and target.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(column) for column in X.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(X, index=False).values.tobytes())
+    digest.update(np.ascontiguousarray(y).tobytes())
+    return digest.hexdigest()
+
+
+def fold_ids(y: np.ndarray, cv: int, cache_dir: Optional[str] = None) -> np.ndarray:
+    """
+    Returns the fold of each row for a stratified `cv`-fold split.
+
+    Parameters:
+    y (np.ndarray): training target
+    cv (int): number of folds
+    cache_dir (str): directory where the folds are persisted, None to always compute them
+
+    Returns:
+    np.ndarray : fold number of every row, the folds `cross_val_predict(cv=cv)` uses
+
+    The folds only depend on the target, so they are computed once per target and
+    number of folds and read back on later runs.
+    """
+    key = hashlib.sha256(np.ascontiguousarray(y).tobytes() + str(cv).encode()).hexdigest()
+    path = os.path.join(cache_dir, f'folds-{key[:16]}.npy') if cache_dir else None
+    if path and os.path.exists(path):
+        return np.load(path)
+
+    ids = np.empty(len(y), dtype=np.int16)
+    for fold, (_, test_index) in enumerate(StratifiedKFold(n_splits=cv).split(y, y)):
+        ids[test_index] = fold
+    if path:
+        np.save(path, ids)
+    return ids
+
+
+def model_key(name: str, model: BaseEstimator, data_key: str) -> str:
+    """
+    Returns the cache key of a model: its name, params and the data it is fitted on.
+
+    `n_jobs` is left out of the key because it does not change the fitted model.
+    """
+    params = {
+        param: value for param, value in model.get_params().items() if param != 'n_jobs'
+    }
+    payload = json.dumps([name, params, data_key], sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _fit_fold(
+    model: BaseEstimator,
+    X: pd.DataFrame,
+    y: np.ndarray,
+    train_index: np.ndarray,
+    test_index: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, dict]:
+    """Fits a clone of the model on one fold and predicts the held-out rows"""
+    with stage('fit_fold', rows=len(train_index), emit=False) as current:
+        estimator = clone(model).fit(X.iloc[train_index], y[train_index])
+        X_fold = X.iloc[test_index]
+        pred, proba = estimator.predict(X_fold), estimator.predict_proba(X_fold)[:, 1]
+    return pred, proba, current.record
+
+
+def _fit_full(
+    model: BaseEstimator, X: pd.DataFrame, y: np.ndarray
+) -> Tuple[BaseEstimator, dict]:
+    """Fits a clone of the model on every row"""
+    with stage('fit_full', rows=len(X), emit=False) as current:
+        estimator = clone(model).fit(X, y)
+    return estimator, current.record
+
+
+def fit_models(
+    models: Dict[str, BaseEstimator],
+    X: pd.DataFrame,
+    y: np.ndarray,
+    cv: int = 10,
+    n_jobs: int = -1,
+    model_threads: int = 1,
+    cache_dir: Optional[str] = None,
+    fitted_folds: Optional[Dict[str, Dict[int, tuple]]] = None,
+) -> Dict[str, ModelResult]:
+    """
+    Runs the cross validation folds and the full fit of every model concurrently.
+
+    Parameters:
+    models (dict): model name to unfitted estimator
+    X (pd.DataFrame): transformed training data
+    y (np.ndarray): training target
+    cv (int): number of stratified folds, as in `cross_val_predict(cv=cv)`
+    n_jobs (int): cores shared by all the fits, -1 uses every core
+    model_threads (int): threads of each multi-threaded model
+    cache_dir (str): directory of the fold and model cache, None to disable it
+    fitted_folds (dict): outputs of `_fit_fold` already computed for a model, by fold
+    number, such as `Selection.folds`, only the other folds are fitted
+
+    Returns:
+    dict : model name to its ModelResult
+
+    Every (model, fold) pair and every full fit is an independent task of one process
+    pool, so slow models do not hold the cores idle while the fast ones are done.
+    The folds are the ones `cross_val_predict` uses, so the predictions are the same.
+
+    With a cache directory, each result is stored under a key made of the model name,
+    its params and the data digest, and only the models whose key changed are fitted.
+    The measurements of the fits are returned in `ModelResult.stages` rather than
+    logged, so the caller logs them in the mlflow run of their model.
+    """
+    cores = (os.cpu_count() or 1) if n_jobs == -1 else n_jobs
+    processes = max(1, cores // model_threads)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    ids = fold_ids(y, cv, cache_dir)
+    folds = [
+        (np.flatnonzero(ids != fold), np.flatnonzero(ids == fold)) for fold in range(cv)
+    ]
+    data_key = data_digest(X, y) + str(cv)
+
+    names = list(models)
+    results, paths = {}, {}
+    for name, model in models.items():
+        path = None
+        if cache_dir:
+            key = model_key(name, model, data_key)
+            path = os.path.join(cache_dir, f'{name}-{key[:16]}.joblib')
+        if path and os.path.exists(path):
+            logger.info(f"Reusing cached fits of model: {name}")
+            results[name] = ModelResult(*joblib.load(path))
+        else:
+            paths[name] = path
+
+    models = {
+        name: limit_threads(clone(model), model_threads)
+        for name, model in models.items()
+        if name in paths
+    }
+    fitted_folds = fitted_folds or {}
+    reused, tasks = [], []
+    for name, model in models.items():
+        tasks.append((name, None, delayed(_fit_full)(model, X, y)))
+        for fold, (train_index, test_index) in enumerate(folds):
+            if fold in fitted_folds.get(name, {}):
+                reused.append((name, test_index, fitted_folds[name][fold]))
+            else:
+                tasks.append(
+                    (
+                        name,
+                        test_index,
+                        delayed(_fit_fold)(model, X, y, train_index, test_index),
+                    )
+                )
+
+    logger.info(
+        f"Scheduling {len(tasks)} fits on {processes} processes, "
+        f"reusing {len(reused)} fold fits"
+    )
+    outputs = Parallel(n_jobs=processes, backend='loky')(task for _, _, task in tasks)
+
+    fitted = {
+        name: [np.empty(len(y), dtype=y.dtype), np.empty(len(y), dtype=np.float64), None, []]
+        for name in models
+    }
+    computed = [(name, index, out) for (name, index, _), out in zip(tasks, outputs)]
+    for name, test_index, output in reused + computed:
+        if test_index is None:
+            fitted[name][2], record = output
+        else:
+            fitted[name][0][test_index], fitted[name][1][test_index], record = output
+        fitted[name][3].append(record)
+
+    for name, (oof_pred, oof_proba, estimator, records) in fitted.items():
+        stages = tuple(records)
+        results[name] = ModelResult(oof_pred, oof_proba, estimator, stages)
+        if paths[name]:
+            joblib.dump(tuple(results[name])[:3], paths[name])
+
+    return {name: results[name] for name in names}
+
+
+def successive_halving(
+    models: Dict[str, BaseEstimator],
+    X: pd.DataFrame,
+    y: np.ndarray,
+    cv: int = 10,
+    min_folds: int = 2,
+    eta: int = 3,
+    metric: str = 'F1',
+    time_budget: Optional[float] = None,
+    n_jobs: int = -1,
+    model_threads: int = 1,
+    cache_dir: Optional[str] = None,
+) -> Selection:
+    """
+    Selects the models worth the full cross validation by successive halving.
+
+    Parameters:
+    models (dict): model name to unfitted estimator
+    X (pd.DataFrame): transformed training data
+    y (np.ndarray): training target
+    cv (int): number of stratified folds of the full cross validation
+    min_folds (int): folds every model is scored on in the first rung
+    eta (int): each rung keeps the best 1/eta of the models on eta times the folds
+    metric (str): metric of `metrics.classification_metrics` ranking the models
+    time_budget (float): seconds for the selection and the full cross validation of
+    the promoted models, None for no limit
+    n_jobs (int): cores shared by all the fits, -1 uses every core
+    model_threads (int): threads of each multi-threaded model
+    cache_dir (str): directory of the fold cache, None to disable it
+
+    Returns:
+    Selection : the promoted and the pruned models, with their fold outputs
+
+    The rungs use the first folds of the split `fit_models` uses, each rung only
+    fitting the folds the previous one did not, and stop once a single model is
+    left or the next rung would need every fold. The folds of the promoted models
+    are returned in `Selection.folds`, so `fit_models` only fits the others.
+
+    Costs are estimated from the fold times of each model. A rung only starts when
+    it and the remaining cross validation of the models it would promote fit in the
+    time left, otherwise the halving stops. The lowest ranked models are then
+    pruned until the remaining cross validation of the others fits in the time left.
+    """
+    start = time.monotonic()
+    cores = (os.cpu_count() or 1) if n_jobs == -1 else n_jobs
+    processes = max(1, cores // model_threads)
+
+    ids = fold_ids(y, cv, cache_dir)
+    candidates = {
+        name: limit_threads(clone(model), model_threads)
+        for name, model in models.items()
+    }
+    ranked = list(candidates)
+    pred = {name: np.empty(len(y), dtype=y.dtype) for name in candidates}
+    seconds = {name: [] for name in candidates}
+    fold_outputs = {name: {} for name in candidates}
+    pruned = []
+
+    def cost(name: str, fits: int) -> float:
+        """Returns the estimated seconds of `fits` fits of a model on every process"""
+        if not seconds[name]:
+            return 0.0
+        return float(np.mean(seconds[name])) * fits / processes
+
+    rung, done, folds = 0, 0, min(min_folds, cv)
+    while len(ranked) > 1 and folds < cv:
+        if rung and time_budget is not None:
+            keep = max(1, math.ceil(len(ranked) / eta))
+            # the rung fits the new folds of every model, the promoted ones then need
+            # the remaining folds and a full fit
+            needed = sum(cost(name, folds - done) for name in ranked) + sum(
+                cost(name, cv - folds + 1) for name in ranked[:keep]
+            )
+            if time.monotonic() - start + needed > time_budget:
+                logger.info(
+                    f"Rung {rung} does not fit in the time budget, stopping the "
+                    "successive halving"
+                )
+                break
+        tasks = [(name, fold) for name in ranked for fold in range(done, folds)]
+        logger.info(f"Rung {rung}: scoring {len(ranked)} models on {folds}/{cv} folds")
+        outputs = Parallel(n_jobs=processes, backend='loky')(
+            delayed(_fit_fold)(
+                candidates[name],
+                X,
+                y,
+                np.flatnonzero(ids != fold),
+                np.flatnonzero(ids == fold),
+            )
+            for name, fold in tasks
+        )
+        for (name, fold), output in zip(tasks, outputs):
+            pred[name][ids == fold] = output[0]
+            seconds[name].append(output[2]['wall_seconds'])
+            fold_outputs[name][fold] = output
+
+        rows = ids < folds
+        scores = {
+            name: classification_metrics(y[rows], pred[name][rows])[metric]
+            for name in ranked
+        }
+        ranked.sort(key=lambda name: scores[name], reverse=True)
+        keep = max(1, math.ceil(len(ranked) / eta))
+        for name in ranked[keep:]:
+            score = scores[name]
+            pruned.append(_pruned(name, rung, folds, score, seconds[name], 'rung'))
+        logger.info(f"Rung {rung}: promoting {ranked[:keep]}", scores=scores)
+        ranked = ranked[:keep]
+
+        rung, done, folds = rung + 1, folds, min(folds * eta, cv)
+        if time_budget is not None and time.monotonic() - start >= time_budget:
+            logger.info("Time budget spent, stopping the successive halving")
+            break
+
+    if time_budget is not None:
+        left = time_budget - (time.monotonic() - start)
+        # the folds fitted by the rungs are reused, the rest and a full fit are not
+        remaining = cv - done + 1
+        while len(ranked) > 1 and sum(cost(name, remaining) for name in ranked) > left:
+            name = ranked.pop()
+            score = scores[name] if rung else None
+            pruned.append(_pruned(name, rung, done, score, seconds[name], 'budget'))
+
+    return Selection(ranked, pruned, {name: fold_outputs[name] for name in ranked})
+
+
+def _pruned(
+    name: str, rung: int, folds: int, score: Optional[float], seconds: list, reason: str
+) -> dict:
+    """Returns the record of a model pruned by the successive halving"""
+    return {
+        'model': name,
+        'rung': rung,
+        'folds': folds,
+        'score': score,
+        'seconds': float(sum(seconds)),
+        'reason': reason,
+    }
@@ -1,59 +1,93 @@
 """module responsible for optimize training model"""
+import contextlib
+import multiprocessing
 import os
-from typing import Tuple
+import threading
+import time
+from typing import Iterator, Optional, Tuple
 
+import hydra
 import lightgbm
-import mlflow
 import numpy as np
 import optuna
-import pandas as pd
 import structlog
 import yaml
-from optuna.integration.mlflow import MLflowCallback
-from sklearn.metrics import f1_score
+from omegaconf import DictConfig
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
+from sklearn.model_selection import train_test_split
 
-from train import data_preparation
-from utils import load_model
+from data_preparation import _data_key, transformed_data
+from instrumentation import Stage, emit_record, stage
+from metrics import best_threshold, f1
 
 logger = structlog.getLogger()
-mlflow.set_tracking_uri('sqlite:///mlflow.db')
-mlflow_callback = MLflowCallback(
-    tracking_uri=mlflow.get_tracking_uri(), metric_name="f1"
-)
+dataset_params = {"feature_pre_filter": False, "verbosity": -1}
+trial_settings = {
+    "num_threads": 0,
+    "num_boost_round": 1000,
+    "early_stopping_rounds": 50,
+    "validation_size": 0.2,
+    "pruning_metric": "f1",
+    "pruner": "median",
+    "pruner_warmup_steps": 10,
+}
+_study_data = {}
+TRIAL_STAGE_ATTRIBUTE = "trial_stage"
 
 
-def transformed_data() -> Tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]:
+def study_data() -> Tuple[lightgbm.Dataset, lightgbm.Dataset, np.ndarray, np.ndarray]:
     """
-    This function applies data transformation to the training and testing datasets.
-    The transformation is performed using a pipeline model that is loaded from a file.
+    Returns the data shared by every trial of a study.
 
     Returns:
-    A tuple containing the transformed training and testing datasets, as well as the training and testing target variables.
+    A tuple containing the constructed LightGBM training and validation Datasets, the
+    transformed testing matrix and the testing target variable.
 
-    Example:
-    X_train_transformed, X_test_transformed, y_train, y_test = transformed_data()
+    The validation fold is a stratified `validation_size` share of the training data used
+    for early stopping and pruning. The training Dataset is binned once with
+    `free_raw_data` and `feature_pre_filter` disabled, so trials with different
+    `min_child_samples` reuse the same bins and only pay for boosting.
     """
-    try:
-        pipe = load_model('pipeline')
-    except FileNotFoundError as e:
-        logger.error(f"The pipeline model file does not exist: {e}")
-        raise e
-
-    try:
-        X_train, X_test, y_train, y_test = data_preparation()
+    key = (*_data_key(), trial_settings["validation_size"])
+    if key not in _study_data:
+        X_train_transformed, X_test_transformed, y_train, y_test = transformed_data()
+        X_fit, X_valid, y_fit, y_valid = train_test_split(
+            X_train_transformed,
+            y_train,
+            test_size=trial_settings["validation_size"],
+            random_state=42,
+            stratify=y_train,
+        )
+        train_data = lightgbm.Dataset(
+            X_fit,
+            label=y_fit,
+            params=dataset_params,
+            free_raw_data=True,
+        ).construct()
+        valid_data = lightgbm.Dataset(
+            X_valid,
+            label=y_valid,
+            reference=train_data,
+            params=dataset_params,
+            free_raw_data=True,
+        ).construct()
+        _study_data[key] = (
+            train_data,
+            valid_data,
+            np.ascontiguousarray(X_test_transformed, dtype=np.float64),
+            np.asarray(y_test),
+        )
+    return _study_data[key]
 
-        X_train_transformed = pipe.transform(X_train)
-        X_test_transformed = pipe.transform(X_test)
 
-        logger.info("Data transformation completed successfully")
-
-        return X_train_transformed, X_test_transformed, y_train, y_test
-    except Exception as e:
-        logger.error(f"Data transformation failed: {e}")
-        raise e
+def _f1_eval(preds: np.ndarray, eval_data: lightgbm.Dataset) -> Tuple[str, float, bool]:
+    """
+    LightGBM evaluation function reporting the F1 score at the 0.5 threshold.
+    """
+    return "f1", f1(eval_data.get_label(), np.rint(preds)), True
 
 
-@mlflow_callback.track_in_mlflow()
 def objective(trial):
     """
     Function to optimize the hyperparameters of a LightGBM classifier using Optuna optimization library.
@@ -68,6 +102,14 @@ def objective(trial):
     This function is expected to be used as the objective function in Optuna optimization. The Optuna library will
     repeatedly call this function to sample hyperparameters and evaluate the LightGBM classifier with these
     hyperparameters. The F1 score is used as the objective function to be minimized.
+
+    Boosting stops early when the validation logloss stops improving and the trial is
+    pruned when its intermediate `pruning_metric` is worse than the pruner allows, so
+    losing trials stop after a few rounds. The time spent getting the data, boosting and
+    predicting, the best iteration, and the threshold maximizing the test F1 with that F1,
+    taken from one sweep over the test probabilities, are stored in the trial user
+    attributes, and the trial is timed as the 'trial' stage in its mlflow run when it
+    runs through `run_worker`, which tracks it in mlflow.
     """
 
     param = {
@@ -83,36 +125,308 @@ def objective(trial):
         'bagging_freq': trial.suggest_int('bagging_freq', 1, 7),
         'min_child_samples': trial.suggest_int('min_child_samples', 5, 100),
     }
+    if trial_settings["num_threads"] > 0:
+        param['num_threads'] = trial_settings["num_threads"]
+
+    with _trial_stage(trial) as current:
+        start = time.perf_counter()
+        train_data, valid_data, X_test_transformed, y_test = study_data()
+        data_seconds = time.perf_counter() - start
+        current.rows = train_data.num_data()
+
+        start = time.perf_counter()
+        try:
+            lgbm = lightgbm.train(
+                params=param,
+                train_set=train_data,
+                num_boost_round=trial_settings["num_boost_round"],
+                valid_sets=[valid_data],
+                valid_names=["valid"],
+                feval=_f1_eval,
+                callbacks=[
+                    lightgbm.early_stopping(
+                        trial_settings["early_stopping_rounds"],
+                        first_metric_only=True,
+                        verbose=False,
+                    ),
+                    optuna.integration.LightGBMPruningCallback(
+                        trial, trial_settings["pruning_metric"], valid_name="valid"
+                    ),
+                ],
+            )
+        finally:
+            boosting_seconds = time.perf_counter() - start
+            trial.set_user_attr("data_seconds", data_seconds)
+            trial.set_user_attr("boosting_seconds", boosting_seconds)
 
-    X_train_transformed, X_test_transformed, y_train, y_test = transformed_data()
+        start = time.perf_counter()
+        y_proba_test = lgbm.predict(X_test_transformed, num_iteration=lgbm.best_iteration)
+        score = round(f1(y_test, np.rint(y_proba_test)), 4)
+        threshold, best = best_threshold(y_test, y_proba_test)
+        predict_seconds = time.perf_counter() - start
 
-    train_data = lightgbm.Dataset(X_train_transformed, label=y_train)
-    lgbm = lightgbm.train(params=param, train_set=train_data)
-    y_pred_test = np.rint(
-        lgbm.predict(X_test_transformed, num_iteration=lgbm.best_iteration)
+    trial.set_user_attr("predict_seconds", predict_seconds)
+    trial.set_user_attr("best_iteration", lgbm.best_iteration)
+    trial.set_user_attr("best_threshold", threshold)
+    trial.set_user_attr("best_threshold_f1", round(best["F1"], 4))
+    logger.info(
+        f"Trial {trial.number} time: data {data_seconds:.3f}s, "
+        f"boosting {boosting_seconds:.3f}s ({lgbm.best_iteration} rounds), "
+        f"predict {predict_seconds:.3f}s"
     )
-    f1 = round(f1_score(y_test, y_pred_test), 4)
 
-    return f1
+    return score
 
 
-if __name__ == "__main__":
-    study_name = "optimization_LGBM"
-    direction = "maximize"
-    n_trials = 2
-    timeout = 600
-    model_best_params_yaml_name = "model.yaml"
+@contextlib.contextmanager
+def _trial_stage(trial: optuna.Trial) -> Iterator[Stage]:
+    """
+    Measures the trial as the 'trial' stage and keeps its record in the trial.
+
+    The record is stored as a user attribute of the trial, including when the trial
+    is pruned or fails, and logged to the mlflow run of the trial by
+    `TrialMLflowCallback`, so it is not logged from the thread running the trial.
+    """
+    current = None
+    try:
+        with stage('trial', emit=False, trial=trial.number) as current:
+            yield current
+    finally:
+        if current is not None and current.record is not None:
+            trial.set_user_attr(TRIAL_STAGE_ATTRIBUTE, current.record)
+
+
+class TrialMLflowCallback:
+    """
+    Optuna callback logging each finished trial as an mlflow run.
+
+    The run is named after the trial number in the experiment named after the study,
+    and holds the objective value, the params, the state of the trial and its 'trial'
+    stage. The active mlflow run is global to the process, so the `n_jobs` threads of
+    a worker cannot each run their trial in its own run. The objective runs outside
+    of mlflow instead and the run of each trial is only opened here, under a lock,
+    once the trial finished. Only the public APIs of Optuna and mlflow are used.
+    """
+
+    def __init__(self, tracking_uri: str, metric_name: str = "f1") -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        tracking_uri : str : mlflow tracking uri the runs are logged to
+        metric_name : str : name of the objective value in mlflow
+        """
+        self.tracking_uri = tracking_uri
+        self.metric_name = metric_name
+        self._lock = threading.Lock()
+
+    def __call__(self, study: optuna.Study, trial: optuna.trial.FrozenTrial) -> None:
+        import mlflow
+
+        with self._lock:
+            mlflow.set_tracking_uri(self.tracking_uri)
+            mlflow.set_experiment(study.study_name)
+            with mlflow.start_run(run_name=str(trial.number)):
+                if trial.value is not None:
+                    mlflow.log_metric(self.metric_name, trial.value)
+                mlflow.log_params(trial.params)
+                mlflow.set_tags(
+                    {
+                        "number": str(trial.number),
+                        "state": trial.state.name,
+                        "datetime_start": str(trial.datetime_start),
+                        "datetime_complete": str(trial.datetime_complete),
+                        "direction": study.direction.name,
+                    }
+                )
+                record = trial.user_attrs.get(TRIAL_STAGE_ATTRIBUTE)
+                if record is not None:
+                    emit_record(record)
+
+
+def create_mlflow_callback() -> TrialMLflowCallback:
+    """
+    Returns the Optuna callback logging each trial as an mlflow run.
+
+    The tracking uri is only set when a trial is logged, so importing this module, for
+    instance in a worker process, does not set up tracking.
+    """
+    return TrialMLflowCallback(tracking_uri='sqlite:///mlflow.db', metric_name="f1")
+
+
+def create_storage(storage_url: Optional[str]):
+    """
+    Returns the Optuna storage for the given url.
+
+    Parameters:
+    storage_url (str): RDB url such as 'sqlite:///optuna.db', 'journal:<path>' for a
+    journal file or None to keep the study in memory
+    """
+    if storage_url is None:
+        return None
+    if storage_url.startswith('journal:'):
+        return optuna.storages.JournalStorage(
+            optuna.storages.JournalFileStorage(storage_url[len('journal:') :])
+        )
+    return optuna.storages.RDBStorage(storage_url)
 
-    study = optuna.create_study(study_name=study_name, direction=direction)
+
+def create_pruner(settings: dict) -> optuna.pruners.BasePruner:
+    """
+    Returns the Optuna pruner named in `settings["pruner"]`.
+
+    Parameters:
+    settings (dict): trial settings with 'pruner' ('median', 'hyperband' or None),
+    'pruner_warmup_steps' and 'num_boost_round'
+    """
+    if settings["pruner"] == "median":
+        return optuna.pruners.MedianPruner(n_warmup_steps=settings["pruner_warmup_steps"])
+    if settings["pruner"] == "hyperband":
+        return optuna.pruners.HyperbandPruner(
+            min_resource=settings["pruner_warmup_steps"],
+            max_resource=settings["num_boost_round"],
+        )
+    if settings["pruner"] is None:
+        return optuna.pruners.NopPruner()
+    raise ValueError(f"Unknown pruner: {settings['pruner']}")
+
+
+def run_worker(
+    study: optuna.Study, n_trials: int, timeout: float, n_jobs: int, settings: dict
+) -> None:
+    """
+    Runs trials of the study until it holds `n_trials` finished trials.
+
+    Parameters:
+    study (optuna.Study): study to optimize
+    n_trials (int): number of finished trials of the whole study, across workers and resumes
+    timeout (float): seconds before this worker stops
+    n_jobs (int): trials run in parallel threads by this worker
+    settings (dict): values for `trial_settings` in this process
+    """
+    trial_settings.update(settings)
+
+    finished_states = (TrialState.COMPLETE, TrialState.PRUNED)
+    finished = len(study.get_trials(deepcopy=False, states=finished_states))
+    if finished >= n_trials:
+        logger.warning(
+            f"Study {study.study_name} already has {finished} finished trials, no trial "
+            f"is run: n_trials ({n_trials}) counts the trials of every run of the study, "
+            "raise it to resume the search"
+        )
+        return
+
+    # built before the threads start, so they do not all prepare the data at once
+    study_data()
+    mlflow_callback = create_mlflow_callback()
     study.optimize(
-        objective, n_trials=n_trials, timeout=timeout, callbacks=[mlflow_callback]
+        objective,
+        timeout=timeout,
+        n_jobs=n_jobs,
+        callbacks=[mlflow_callback, MaxTrialsCallback(n_trials, states=finished_states)],
     )
 
-    best_params = {"params": {**study.best_trial.params}}
+
+def _worker_process(
+    study_name: str,
+    storage_url: str,
+    n_trials: int,
+    timeout: float,
+    n_jobs: int,
+    settings: dict,
+) -> None:
+    """Attaches a new process to the study stored in `storage_url` and runs trials"""
+    study = optuna.load_study(
+        study_name=study_name,
+        storage=create_storage(storage_url),
+        pruner=create_pruner(settings),
+    )
+    run_worker(study, n_trials, timeout, n_jobs, settings)
+
+
+@hydra.main(config_path='../config/optimization', config_name='optimization')
+def optimize(config: DictConfig) -> None:
+    """
+    Runs the hyperparameter search and saves the best params in config/model/model.yaml.
+
+    Parameters:
+    config : DictConfig : study settings, see config/optimization/optimization.yaml
+
+    The study is created in the configured storage, or resumed when a study with the
+    same name exists. `n_workers` processes attach to the same study and each one runs
+    `n_jobs` trials in parallel threads, with LightGBM capped at `lgbm_num_threads`
+    threads per trial so the workers do not oversubscribe the cores.
+    """
+    study_config = config.study
+    model_best_params_yaml_name = "model.yaml"
+
+    if study_config.n_workers > 1 and study_config.storage is None:
+        raise ValueError("Multiple workers need a storage shared between processes")
+
+    settings = {
+        "num_threads": study_config.lgbm_num_threads
+        or max(1, (os.cpu_count() or 1) // (study_config.n_workers * study_config.n_jobs)),
+        "num_boost_round": study_config.num_boost_round,
+        "early_stopping_rounds": study_config.early_stopping_rounds,
+        "validation_size": study_config.validation_size,
+        "pruning_metric": study_config.pruning_metric,
+        "pruner": study_config.pruner,
+        "pruner_warmup_steps": study_config.pruner_warmup_steps,
+    }
+    study = optuna.create_study(
+        study_name=study_config.name,
+        direction=study_config.direction,
+        storage=create_storage(study_config.storage),
+        load_if_exists=study_config.load_if_exists,
+        pruner=create_pruner(settings),
+    )
+
+    # the workers attach the matrices from the feature store instead of each one
+    # reading the data and running the pipeline
+    transformed_data()
+
+    context = multiprocessing.get_context('spawn')
+    workers = [
+        context.Process(
+            target=_worker_process,
+            args=(
+                study_config.name,
+                study_config.storage,
+                study_config.n_trials,
+                study_config.timeout,
+                study_config.n_jobs,
+                settings,
+            ),
+        )
+        for _ in range(study_config.n_workers - 1)
+    ]
+    for worker in workers:
+        worker.start()
+    run_worker(
+        study,
+        study_config.n_trials,
+        study_config.timeout,
+        study_config.n_jobs,
+        settings,
+    )
+    for worker in workers:
+        worker.join()
+
+    best_trial = study.best_trial
+    params = dict(best_trial.params)
+    # trials recorded before early stopping have no best iteration and were scored
+    # with the LightGBM default, which `build_final_model` applies without the key
+    if best_trial.user_attrs.get("best_iteration"):
+        params["n_estimators"] = best_trial.user_attrs["best_iteration"]
+    best_params = {"params": params}
     model_yaml_path = os.path.join(
         os.path.dirname(os.path.abspath(__file__)), "../config/model"
     )
     path_yaml = os.path.join(model_yaml_path, model_best_params_yaml_name)
-        
+
     with open(path_yaml, "w") as file:
         yaml.safe_dump(best_params, file, default_flow_style=False)
+
+
+if __name__ == "__main__":
+    optimize()
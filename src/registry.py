@@ -0,0 +1,400 @@
+"""module responsible for the versioned artifact registry
+
+Artifacts are stored once under the sha256 of their content, and a manifest ties
+the files of a release, for instance a model and the exact pipeline it was trained
+with, to a version. A release is promoted by renaming a pointer into place, so
+readers see the previous release or the new one, never a half-written file.
+
+Layout under REGISTRY_DIR, `<models>/registry` by default:
+
+    blobs/<sha256>                   artifact content, never rewritten
+    manifests/<name>/<version>.json  files of a release and their digests
+    refs/<name>                      version promoted for the name
+
+The registry files live in a local directory, or in a Google Cloud Storage bucket
+when REGISTRY_BUCKET is set. `api/model_registry.ManifestBackend` serves the
+promoted release of a name from a registry directory.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Callable, Dict, List, Optional
+
+import structlog
+
+from utils import _model_dir, file_digest
+
+logger = structlog.getLogger()
+
+SERVING_NAME = 'final_model'
+PLAN = 'pipeline_plan.joblib'
+MODEL = 'final_model.joblib'
+PROJECT_NAME = 'customer-intention'
+DOWNLOAD_FOLDER = '/tmp/registry'
+SERVING_ARTIFACTS = [
+    'pipeline.joblib',
+    'final_model.joblib',
+    'final_model.txt',
+    'operating_threshold.joblib',
+    'pipeline_stats.joblib',
+]
+
+
+class LocalStore:
+    """Registry files in a local directory, stand-in for the bucket"""
+
+    def __init__(self, directory: str) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        directory : str : the directory where the registry files are located
+        """
+        self.directory = directory
+
+    def path(self, key: str) -> str:
+        """Returns the local path of a registry file"""
+        return os.path.join(self.directory, *key.split('/'))
+
+    def exists(self, key: str) -> bool:
+        """Returns whether a registry file exists"""
+        return os.path.exists(self.path(key))
+
+    def _replace(self, key: str, write: Callable[[str], None]) -> None:
+        """Writes a registry file next to its path and renames it into place"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            write(partial_path)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    def put_file(self, key: str, source: str) -> None:
+        """Copies a local file to a registry file"""
+        self._replace(key, lambda path: shutil.copyfile(source, path))
+
+    def write_text(self, key: str, text: str) -> None:
+        """Writes a registry text file"""
+
+        def write(path: str) -> None:
+            with open(path, 'w') as file:
+                file.write(text)
+
+        self._replace(key, write)
+
+    def read_text(self, key: str) -> str:
+        """Returns the content of a registry text file"""
+        with open(self.path(key)) as file:
+            return file.read()
+
+    def list(self, prefix: str) -> List[str]:
+        """Returns the names of the registry files under a prefix"""
+        directory = self.path(prefix)
+        if not os.path.isdir(directory):
+            return []
+        names = os.listdir(directory)
+        return sorted(name for name in names if not name.endswith('.tmp'))
+
+
+class GCSStore:
+    """Registry files in a Google Cloud Storage bucket
+
+    Uploading an object is atomic in GCS, so writing `refs/<name>` promotes a
+    release in one step like the rename of `LocalStore`. Blobs are downloaded once
+    to a local folder, since their content never changes.
+    """
+
+    def __init__(
+        self,
+        bucket_name: str,
+        project: str = PROJECT_NAME,
+        prefix: str = '',
+        folder: str = DOWNLOAD_FOLDER,
+    ) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        bucket : google.cloud.storage.Bucket : bucket of the registry files
+        prefix : str : folder of the registry in the bucket
+        folder : str : local folder where the registry files are downloaded
+        """
+        from google.cloud import storage
+
+        self.bucket = storage.Client(project).bucket(bucket_name)
+        self.prefix = prefix.strip('/')
+        self.folder = folder
+
+    def _name(self, key: str) -> str:
+        """Returns the object name of a registry file"""
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+    def path(self, key: str) -> str:
+        """Returns the local path of a registry file, downloading it when needed"""
+        path = os.path.join(self.folder, *key.split('/'))
+        if key.startswith('blobs/') and os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            self.bucket.blob(self._name(key)).download_to_filename(partial_path)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return path
+
+    def exists(self, key: str) -> bool:
+        """Returns whether a registry file exists"""
+        return self.bucket.blob(self._name(key)).exists()
+
+    def put_file(self, key: str, source: str) -> None:
+        """Uploads a local file to a registry file"""
+        self.bucket.blob(self._name(key)).upload_from_filename(source)
+
+    def write_text(self, key: str, text: str) -> None:
+        """Writes a registry text file"""
+        self.bucket.blob(self._name(key)).upload_from_string(text)
+
+    def read_text(self, key: str) -> str:
+        """Returns the content of a registry text file"""
+        return self.bucket.blob(self._name(key)).download_as_text()
+
+    def list(self, prefix: str) -> List[str]:
+        """Returns the names of the registry files under a prefix"""
+        directory = self._name(prefix) + '/'
+        blobs = self.bucket.list_blobs(prefix=directory, delimiter='/')
+        return sorted(blob.name[len(directory) :] for blob in blobs)
+
+
+class ArtifactRegistry:
+    """Content-addressed artifacts, versioned releases and promotion pointers"""
+
+    def __init__(self, store: LocalStore) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        store : LocalStore | GCSStore : where the registry files are stored
+        """
+        self.store = store
+
+    def publish(
+        self,
+        name: str,
+        files: Dict[str, str],
+        sources: Optional[Dict[str, str]] = None,
+        metadata: Optional[dict] = None,
+    ) -> str:
+        """
+        Stores the files of a release and returns its version, without promoting it.
+
+        Parameters:
+        name (str): name of the released model
+        files (dict): local path of each artifact, by artifact file name
+        sources (dict): digest of the artifact each derived artifact was built from
+        metadata (dict): JSON data kept in the manifest, such as params or metrics
+
+        Returns:
+        str : version of the release, derived from the digests of its artifacts, so
+        publishing the same files again returns the same version
+        """
+        artifacts = {}
+        for filename, path in sorted(files.items()):
+            digest = file_digest(path)
+            if not self.store.exists(f'blobs/{digest}'):
+                self.store.put_file(f'blobs/{digest}', path)
+            artifacts[filename] = digest
+
+        sources = sources or {}
+        content = {'artifacts': artifacts, 'sources': sources}
+        version = hashlib.sha256(
+            json.dumps(content, sort_keys=True).encode()
+        ).hexdigest()[:16]
+        key = f'manifests/{name}/{version}.json'
+        if not self.store.exists(key):
+            manifest = {
+                'name': name,
+                'version': version,
+                'created_at': time.time(),
+                'artifacts': artifacts,
+                'sources': sources,
+                'metadata': metadata or {},
+            }
+            self.store.write_text(key, json.dumps(manifest, indent=2, sort_keys=True))
+        return version
+
+    def promote(self, name: str, version: str) -> None:
+        """
+        Points the name to a published version, atomically.
+
+        Promoting an older version rolls the name back to it.
+        """
+        manifest = self.manifest(name, version)
+        missing = [
+            filename
+            for filename, digest in manifest['artifacts'].items()
+            if not self.store.exists(f'blobs/{digest}')
+        ]
+        if missing:
+            raise FileNotFoundError(f"Missing artifacts of {name} {version}: {missing}")
+        self.store.write_text(f'refs/{name}', version)
+        logger.info(f"Promoted {name} version {version}")
+
+    def current(self, name: str) -> Optional[str]:
+        """Returns the version promoted for the name, None before any promotion"""
+        if not self.store.exists(f'refs/{name}'):
+            return None
+        return self.store.read_text(f'refs/{name}').strip()
+
+    def manifest(self, name: str, version: Optional[str] = None) -> dict:
+        """Returns the manifest of a version, the promoted one by default"""
+        version = version or self.current(name)
+        if version is None:
+            raise FileNotFoundError(f"No version of {name} was promoted")
+        return json.loads(self.store.read_text(f'manifests/{name}/{version}.json'))
+
+    def versions(self, name: str) -> List[str]:
+        """Returns the published versions of the name, oldest first"""
+        manifests = [
+            self.manifest(name, os.path.splitext(filename)[0])
+            for filename in self.store.list(f'manifests/{name}')
+        ]
+        manifests.sort(key=lambda manifest: manifest['created_at'])
+        return [manifest['version'] for manifest in manifests]
+
+    def fetch(self, name: str, filename: str, version: Optional[str] = None) -> str:
+        """Returns the local path of an artifact, of the promoted version by default"""
+        artifacts = self.manifest(name, version)['artifacts']
+        if filename not in artifacts:
+            raise FileNotFoundError(f"{filename} is not an artifact of {name}")
+        return self.store.path(f"blobs/{artifacts[filename]}")
+
+
+def registry_dir() -> str:
+    """Returns the registry directory, REGISTRY_DIR when it is set"""
+    return os.environ.get('REGISTRY_DIR', os.path.join(_model_dir(), 'registry'))
+
+
+def get_artifact_registry() -> ArtifactRegistry:
+    """
+    Returns the registry of the REGISTRY_BUCKET bucket when it is set, under the
+    REGISTRY_PREFIX folder, otherwise of the local registry directory.
+    """
+    bucket = os.environ.get('REGISTRY_BUCKET')
+    if bucket:
+        return ArtifactRegistry(
+            GCSStore(bucket, prefix=os.environ.get('REGISTRY_PREFIX', ''))
+        )
+    return ArtifactRegistry(LocalStore(registry_dir()))
+
+
+def release(
+    name: str,
+    filenames: List[str],
+    sources: Optional[Dict[str, str]] = None,
+    metadata: Optional[dict] = None,
+    promote: bool = True,
+) -> str:
+    """
+    Publishes files of the model directory as a version of the name.
+
+    Parameters:
+    name (str): name of the released model
+    filenames (list): artifact file names in the model directory
+    sources (dict): digest of the artifact each derived artifact was built from
+    metadata (dict): JSON data kept in the manifest
+    promote (bool): point the name to the new version
+
+    Returns:
+    str : version of the release
+    """
+    registry = get_artifact_registry()
+    files = {filename: os.path.join(_model_dir(), filename) for filename in filenames}
+    version = registry.publish(name, files, sources=sources, metadata=metadata)
+    if promote:
+        registry.promote(name, version)
+    return version
+
+
+def release_serving(
+    metadata: Optional[dict] = None,
+    plan_source: Optional[str] = None,
+    model_source: Optional[str] = None,
+    promote: bool = True,
+) -> Optional[str]:
+    """
+    Publishes the serving artifacts of the model directory as a 'final_model' version.
+
+    Parameters:
+    metadata (dict): JSON data kept in the manifest
+    plan_source (str): digest of the pipeline the compiled plan was just exported from
+    model_source (str): digest of the pipeline the final model was just trained with
+    promote (bool): point 'final_model' to the new version
+
+    Returns:
+    str : version of the release, None when the pipeline or the model is missing
+
+    The compiled plan is released only along with the pipeline it was exported from:
+    its source is `plan_source`, or the one recorded in the promoted release when the
+    plan did not change since. A plan exported from another pipeline is not released
+    and raises instead, since workers serving with `COMPILED_PIPELINE=1` could not
+    load a release without it, see `export_pipeline.compile_pipeline` to export it
+    again first.
+
+    The final model is checked the same way against the pipeline it was trained
+    with, `model_source` or the one recorded in the promoted release, so a pipeline
+    refitted by `train.py` is never released with a model trained on the previous
+    one, run `final_model.py` again first.
+    """
+    model_dir = _model_dir()
+    if not all(
+        os.path.exists(os.path.join(model_dir, filename))
+        for filename in ('pipeline.joblib', 'final_model.joblib')
+    ):
+        logger.info("No pipeline and final model to release yet")
+        return None
+
+    filenames = [
+        filename
+        for filename in SERVING_ARTIFACTS
+        if os.path.exists(os.path.join(model_dir, filename))
+    ]
+    pipeline_digest = file_digest(os.path.join(model_dir, 'pipeline.joblib'))
+    if model_source is None:
+        model_digest = file_digest(os.path.join(model_dir, MODEL))
+        model_source = _recorded_source(MODEL, model_digest)
+    if model_source != pipeline_digest:
+        raise ValueError(
+            f"{MODEL} was not trained with the current pipeline, run "
+            "src/final_model.py before releasing"
+        )
+    sources = {MODEL: model_source}
+    plan_path = os.path.join(model_dir, PLAN)
+    if os.path.exists(plan_path):
+        if plan_source is None:
+            plan_source = _recorded_source(PLAN, file_digest(plan_path))
+        if plan_source != pipeline_digest:
+            raise ValueError(
+                f"{PLAN} was not exported from the current pipeline, run "
+                "src/export_pipeline.py or remove it before releasing"
+            )
+        filenames.append(PLAN)
+        sources[PLAN] = plan_source
+    return release(SERVING_NAME, filenames, sources, metadata, promote)
+
+
+def _recorded_source(filename: str, digest: str) -> Optional[str]:
+    """Returns the source of an artifact recorded in the promoted serving release"""
+    try:
+        manifest = get_artifact_registry().manifest(SERVING_NAME)
+    except FileNotFoundError:
+        return None
+    if manifest['artifacts'].get(filename) != digest:
+        return None
+    return manifest['sources'].get(filename)
@@ -0,0 +1,187 @@
+"""module responsible for retraining the final model on the new rows only
+
+Delta files with new sessions are dropped in data/processed/deltas. Each run boosts
+`--num-boost-round` more trees into the saved final model (LightGBM `init_model`) on
+the pending deltas only, with the pipeline frozen: the trees split on the scaled
+features, so refitting the encoders or the scaler would invalidate them.
+
+The running category counts and min/max of the pipeline are updated with the deltas
+instead, and when the encodings a refit would learn differ from the frozen ones, or a
+scaled feature goes out of its fitted range by more than `--max-range-drift` of that
+range, the pipeline and the model are retrained from scratch on the training split
+and every delta. Pending deltas holding a single class are not boosted, a classifier
+fitted on them would only know that class, and stay pending until a later delta
+brings the other one.
+
+    python src/retrain.py [--num-boost-round 50] [--max-range-drift 0.05]
+"""
+import argparse
+import os
+from typing import List, Tuple
+
+import lightgbm
+import numpy as np
+import pandas as pd
+import structlog
+from omegaconf import OmegaConf
+
+from final_model import build_final_model, check_booster_parity
+from incremental import PipelineStats, all_deltas, mark_applied, pending_deltas, read_deltas
+from instrumentation import stage
+from registry import release_serving
+from utils import (
+    _model_dir,
+    file_digest,
+    load_model,
+    save_booster,
+    save_model,
+    to_category_features,
+)
+
+logger = structlog.getLogger()
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../config')
+
+
+def _delta_features(
+    paths: List[str], features: List[str]
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Returns the raw features and the target of delta files"""
+    delta = read_deltas(paths, columns=features + ['Revenue'])
+    X = to_category_features(delta[features].copy())
+    return X, delta['Revenue'].to_numpy()
+
+
+def retrain(num_boost_round: int = 50, max_range_drift: float = 0.05) -> str:
+    """
+    Boosts the pending delta files into the final model.
+
+    Parameters:
+    num_boost_round (int): trees added to the model for each run
+    max_range_drift (float): share of its fitted range a scaled feature may go out of
+    before the pipeline is refitted
+
+    Returns:
+    str : 'skipped' without pending deltas or when they hold a single class,
+    'incremental' or 'full'
+    """
+    paths = pending_deltas()
+    if not paths:
+        logger.info("No pending delta files, the final model is up to date")
+        return 'skipped'
+
+    pipeline_digest = file_digest(os.path.join(_model_dir(), 'pipeline.joblib'))
+    pipe = load_model('pipeline')
+    stats: PipelineStats = load_model('pipeline_stats')
+    features = [str(feature) for feature in pipe.named_steps['rare_enc'].feature_names_in_]
+    X_delta, y_delta = _delta_features(paths, features)
+
+    stats.update(X_delta)
+    drift = stats.drift(pipe)
+    logger.info(
+        "Drift of the pipeline statistics", files=len(paths), rows=len(X_delta), **drift
+    )
+    if drift['categories'] or drift['range_drift'] > max_range_drift:
+        logger.info("Drift over threshold, retraining from scratch")
+        full_retrain()
+        return 'full'
+
+    if len(np.unique(y_delta)) < 2:
+        logger.info(
+            "Pending delta files hold a single class, keeping them for the next run",
+            files=len(paths),
+            rows=len(X_delta),
+        )
+        return 'skipped'
+
+    model = load_model('final_model')
+    with stage('incremental_fit', rows=len(X_delta)):
+        X_delta_transformed = pipe.transform(X_delta)
+        lgbm = lightgbm.LGBMClassifier(**model.get_params())
+        lgbm.set_params(n_estimators=num_boost_round)
+        lgbm.fit(X_delta_transformed, y_delta, init_model=model.booster_)
+
+    check_booster_parity(lgbm, X_delta_transformed)
+    save_model(lgbm, 'final_model')
+    save_booster(lgbm, 'final_model')
+    save_model(stats, 'pipeline_stats')
+    mark_applied(paths)
+    release_serving(
+        metadata={
+            'retrain': 'incremental',
+            'deltas': [os.path.basename(path) for path in paths],
+        },
+        model_source=pipeline_digest,
+    )
+    logger.info(
+        f"Boosted {len(X_delta)} new rows into the final model, "
+        f"{lgbm.booster_.num_trees()} trees"
+    )
+    return 'incremental'
+
+
+def full_retrain() -> None:
+    """
+    Refits the pipeline and the final model on the training split and every delta.
+
+    The compiled plan is exported again when one exists, and the new artifacts are
+    released in the registry. The native booster and the compiled plan are checked
+    against the model and the pipeline before any artifact is replaced, so a failed
+    check leaves the previous ones in place. The models of the zoo were fitted with
+    the previous pipeline, so `train.py` has to run again before using them.
+    """
+    from data_preparation import data_preparation
+    from train import build_pipeline
+
+    X_train, X_test, y_train, _ = data_preparation()
+    paths = all_deltas()
+    X_delta, y_delta = _delta_features(paths, list(X_train.columns))
+    X = pd.concat([X_train, X_delta], ignore_index=True)
+    y = np.concatenate([y_train, y_delta])
+
+    pipe = build_pipeline(OmegaConf.load(os.path.join(CONFIG_PATH, 'process/process.yaml')))
+    params = OmegaConf.load(os.path.join(CONFIG_PATH, 'model/model.yaml')).params
+    with stage('full_retrain', rows=len(X)):
+        X_transformed = pipe.fit_transform(X, y)
+        lgbm = build_final_model(params)
+        lgbm.fit(X_transformed, y)
+
+    check_booster_parity(lgbm, X_transformed)
+    compiled = None
+    if os.path.exists(os.path.join(_model_dir(), 'pipeline_plan.joblib')):
+        from export_pipeline import compile_pipeline
+
+        compiled = compile_pipeline(pipe, [X, X_test])
+    stats = PipelineStats.from_data(pipe, X)
+
+    save_model(pipe, 'pipeline')
+    if compiled is not None:
+        save_model(compiled.plan, 'pipeline_plan')
+    save_model(lgbm, 'final_model')
+    save_booster(lgbm, 'final_model')
+    save_model(stats, 'pipeline_stats')
+    mark_applied(paths, reset=True)
+    pipeline_digest = file_digest(os.path.join(_model_dir(), 'pipeline.joblib'))
+    release_serving(
+        metadata={
+            'retrain': 'full',
+            'deltas': [os.path.basename(path) for path in paths],
+        },
+        plan_source=pipeline_digest if compiled is not None else None,
+        model_source=pipeline_digest,
+    )
+    logger.info(f"Retrained the pipeline and the final model on {len(X)} rows")
+
+
+def main() -> None:
+    """Command line entry point, see `python src/retrain.py --help`"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-boost-round', type=int, default=50)
+    parser.add_argument('--max-range-drift', type=float, default=0.05)
+    args = parser.parse_args()
+
+    retrain(num_boost_round=args.num_boost_round, max_range_drift=args.max_range_drift)
+
+
+if __name__ == "__main__":
+    main()
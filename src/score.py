@@ -0,0 +1,131 @@
+"""module responsible for scoring data files offline with the final model"""
+import argparse
+import multiprocessing
+import os
+from collections import deque
+from functools import partial
+from typing import Optional
+
+import pandas as pd
+import structlog
+
+from storage import FEATURES, TableWriter, data_path, filename, iter_table
+from utils import load_model, to_category_features
+
+logger = structlog.getLogger()
+
+_pipe = None
+_model = None
+
+
+def _load_artifacts() -> None:
+    """Loads the pipeline and the final model into this process"""
+    global _pipe, _model
+    _pipe = load_model('pipeline')
+    _model = load_model('final_model')
+
+
+def _score_chunk(chunk: pd.DataFrame, id_column: Optional[str] = None) -> pd.DataFrame:
+    """
+    Returns the purchase probability of each row of a chunk.
+
+    Parameters:
+    chunk (pd.DataFrame): raw rows, extra columns such as 'Revenue' are ignored
+    id_column (str): column copied to the output to identify the rows
+
+    Returns:
+    pd.DataFrame : the id column, when given, and the 'probability' column
+    """
+    features = list(_pipe.named_steps['rare_enc'].feature_names_in_)
+    data = to_category_features(chunk[features].copy())
+    predict_kwargs = {'num_threads': 1} if hasattr(_model, 'booster_') else {}
+    probability = _model.predict_proba(_pipe.transform(data), **predict_kwargs)[:, 1]
+
+    scores = pd.DataFrame({'probability': probability})
+    if id_column:
+        scores.insert(0, id_column, chunk[id_column].to_numpy())
+    return scores
+
+
+def score_file(
+    input_path: str,
+    output_path: str,
+    chunksize: int = 100_000,
+    processes: int = 0,
+    start_method: str = 'fork',
+    id_column: Optional[str] = None,
+) -> int:
+    """
+    Scores a data file and writes the probabilities to a columnar file.
+
+    Parameters:
+    input_path (str): .parquet, .feather or .csv file with the raw features
+    output_path (str): .parquet or .csv file receiving the probabilities, in input order
+    chunksize (int): rows per chunk sent to a worker
+    processes (int): worker processes, 0 uses every core
+    start_method (str): 'fork' loads the artifacts once in this process and the workers
+    share them copy-on-write, 'spawn' loads them once in every worker
+    id_column (str): column copied to the output to identify the rows
+
+    Returns:
+    int : number of rows scored
+
+    The input is streamed and at most two chunks per worker are in flight, so memory
+    does not grow with the file size. Only the features and the id column are read.
+    """
+    processes = processes or os.cpu_count() or 1
+    context = multiprocessing.get_context(start_method)
+    if start_method == 'fork':
+        _load_artifacts()
+        initializer = None
+    else:
+        initializer = _load_artifacts
+
+    logger.info(f"Starting scoring {input_path} on {processes} processes...")
+    columns = list(FEATURES)
+    if id_column and id_column not in columns:
+        columns.append(id_column)
+    chunks = iter_table(input_path, chunksize, columns=columns)
+    score_chunk = partial(_score_chunk, id_column=id_column)
+    pending = deque()
+    with context.Pool(processes, initializer=initializer) as pool:
+        dtypes = {id_column: 'object'} if id_column else {}
+        with TableWriter(output_path, dtypes={**dtypes, 'probability': 'float64'}) as writer:
+            for chunk in chunks:
+                pending.append(pool.apply_async(score_chunk, (chunk,)))
+                if len(pending) >= 2 * processes:
+                    writer.write(pending.popleft().get())
+            while pending:
+                writer.write(pending.popleft().get())
+
+    logger.info(f"Success scoring {writer.rows} rows into {output_path}")
+    return writer.rows
+
+
+def main() -> None:
+    """Command line entry point, see `python src/score.py --help`"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('input', help='file with the raw features to be scored')
+    parser.add_argument(
+        '--output',
+        default=data_path('final', filename('scores', 'parquet')),
+        help='parquet or csv file receiving the probabilities',
+    )
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    parser.add_argument('--processes', type=int, default=0)
+    parser.add_argument('--start-method', choices=['fork', 'spawn'], default='fork')
+    parser.add_argument('--id-column', default=None)
+    args = parser.parse_args()
+
+    score_file(
+        args.input,
+        args.output,
+        chunksize=args.chunksize,
+        processes=args.processes,
+        start_method=args.start_method,
+        id_column=args.id_column,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,226 @@
 """module responsible to split raw data into train and test"""
+import hashlib
+import json
 import os
+from typing import Optional
 
+import numpy as np
 import pandas as pd
 import structlog
 from sklearn.model_selection import train_test_split
 
 from data_ingest import DataIngest
+from instrumentation import stage
+from storage import FEATURES, TARGET, TableWriter, data_path, filename, write_table
+from utils import file_digest
 
 logger = structlog.getLogger()
 di = DataIngest()
 
 
 class SplitData:
-    def __init__(self) -> None:
+    def __init__(self, chunksize: Optional[int] = None) -> None:
         """
         Initialize the class.
         
         This function sets the following attributes:
-        path : str : the directory where the csv files will be saved
-        train_filename : str : name of the training data csv file
-        test_filename : str : name of the testing data csv file
-        full_data : pandas DataFrame : Dataframe of the original data
+        path : str : the directory where the data files will be saved
+        train_filename : str : name of the training data file, in the DATA_FORMAT format
+        test_filename : str : name of the testing data file, in the DATA_FORMAT format
+        manifest_filename : str : name of the json file recording the materialized split
+        test_size : float : proportion of the data in the testing set
+        random_state : int : seed of the split
+        chunksize : int : rows per chunk to split the raw data in one streaming pass, None
+        to split it in memory
+        full_data : pandas DataFrame : Dataframe of the original data, loaded on first use
         """
-        self.path = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), "../data/processed"
-        )
-        self.train_filename = 'train.csv'
-        self.test_filename = 'test.csv'
-        self.full_data = di.load_data()
+        self.path = data_path("processed")
+        self.train_filename = filename('train')
+        self.test_filename = filename('test')
+        self.manifest_filename = 'split.json'
+        self.test_size = 0.3
+        self.random_state = 42
+        self.chunksize = chunksize
+        self._full_data = None
+
+    @property
+    def full_data(self) -> pd.DataFrame:
+        """Original data, only read from the raw directory when a split is needed"""
+        if self._full_data is None:
+            self._full_data = di.load_data(columns=FEATURES + [TARGET])
+        return self._full_data
 
-    def split_data(self) -> None:
+    def split_key(self) -> str:
         """
-        Splits the dataset into training and testing sets, and saves them to csv files.
+        Returns the content address of the split.
+
+        The key is a hash of the raw data file and of every parameter that changes
+        the split, so the same raw file and parameters always map to the same key.
+        """
+        params = {
+            'raw_data': file_digest(di._path_raw_data()),
+            'test_size': self.test_size,
+            'random_state': self.random_state,
+            'stratify': ['Month', 'Revenue'],
+            'streaming': self.chunksize is not None,
+            'train_filename': self.train_filename,
+            'test_filename': self.test_filename,
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def split_data(self) -> str:
+        """
+        Splits the dataset into training and testing sets, and saves them to data files.
         
         This function takes the 'Month' and 'Revenue' columns from the original dataset and concatenates 
         them into a new column 'to_split'. Then it uses the 'to_split' column as the stratification criteria 
         to split the data into training and testing sets with a test size of 0.3 and random state 42. The 
         training set is saved to the file 'train_filename' and the testing set is saved to the file
         'test_filename'
+
+        When the files already hold the split for the current key nothing is read or written.
+        With a chunksize the split is done in one streaming pass, see _split_streaming.
+
+        Returns:
+        str : key of the materialized split
         """
-        self.full_data['to_split'] = self.full_data.Month.str.cat(
+        with stage('split_data', streaming=self.chunksize is not None) as current:
+            key = self.split_key()
+            if self.is_materialized(key):
+                logger.info(f"Reusing split {key[:12]}...")
+                current.rows = 0
+                return key
+
+            if self.chunksize is not None:
+                current.rows = self._split_streaming()
+            else:
+                current.rows = self._split_in_memory()
+            self._write_manifest(key)
+        return key
+
+    def _split_in_memory(self) -> int:
+        """
+        Splits the full data loaded in memory and saves the train and test files.
+
+        Returns:
+        int : number of rows split
+        """
+        self.full_data['to_split'] = self.full_data.Month.astype(str).str.cat(
             self.full_data['Revenue'].astype(str), sep='_'
         )
         X_train, X_test = train_test_split(
             self.full_data,
-            test_size=0.3,
-            random_state=42,
+            test_size=self.test_size,
+            random_state=self.random_state,
             stratify=self.full_data[['to_split']],
         )
         logger.info("Starting splitting data...")
-        self._to_csv(X_train, self.train_filename)
-        self._to_csv(X_test, self.test_filename)
+        self._remove_manifest()
+        self._save(X_train, self.train_filename)
+        self._save(X_test, self.test_filename)
+        return len(self.full_data)
+
+    def _split_streaming(self) -> int:
+        """
+        Splits the raw data chunk by chunk and appends each part to the train and test files.
+
+        Rows are stratified on 'Month' and 'Revenue' with systematic sampling: the n-th row of
+        a stratum goes to the testing set when floor((n + 1) * test_size + phase) is greater than
+        floor(n * test_size + phase), where phase is a hash of the stratum and the random state.
+        Every stratum keeps test_size of its rows in the testing set, only a counter per stratum
+        is kept between chunks, and the assignment only depends on the row order, so it is the
+        same for any chunk size.
+
+        Returns:
+        int : number of rows split
+        """
+        seen = {}
+        phases = {}
+        train_path = os.path.join(self.path, self.train_filename)
+        test_path = os.path.join(self.path, self.test_filename)
+        logger.info("Starting splitting data in chunks...")
+        self._remove_manifest()
+        with TableWriter(train_path) as train_writer, TableWriter(test_path) as test_writer:
+            for chunk in di.iter_data(self.chunksize, columns=FEATURES + [TARGET]):
+                strata = chunk.Month.astype(str).str.cat(
+                    chunk['Revenue'].astype(str), sep='_'
+                )
+                chunk['to_split'] = strata
+
+                for stratum in strata.unique():
+                    if stratum not in phases:
+                        digest = hashlib.sha256(f'{self.random_state}:{stratum}'.encode())
+                        phases[stratum] = int(digest.hexdigest()[:16], 16) / 2**64
+                position = (
+                    strata.groupby(strata).cumcount().to_numpy()
+                    + strata.map(seen).fillna(0).to_numpy()
+                )
+                phase = strata.map(phases).to_numpy()
+                is_test = np.floor((position + 1) * self.test_size + phase) > np.floor(
+                    position * self.test_size + phase
+                )
+
+                for stratum, count in strata.value_counts().items():
+                    seen[stratum] = seen.get(stratum, 0) + count
+                train_writer.write(chunk[~is_test])
+                test_writer.write(chunk[is_test])
 
-    def _to_csv(self, data: pd.DataFrame, filename: str) -> None:
+        logger.info(f"Split {train_writer.rows} train and {test_writer.rows} test rows")
+        return train_writer.rows + test_writer.rows
+
+    def is_materialized(self, key: str) -> bool:
         """
-        Saves a DataFrame to a csv file.
+        Returns whether the split files on disk were produced for the given key.
+
+        Parameters:
+        key (str): key returned by split_key
+        """
+        manifest_path = os.path.join(self.path, self.manifest_filename)
+        if not os.path.exists(manifest_path):
+            return False
+
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        return manifest.get('key') == key and all(
+            os.path.exists(os.path.join(self.path, filename))
+            for filename in (self.train_filename, self.test_filename)
+        )
+
+    def _remove_manifest(self) -> None:
+        """Forgets the materialized split before its files are rewritten"""
+        manifest_path = os.path.join(self.path, self.manifest_filename)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+    def _write_manifest(self, key: str) -> None:
+        """
+        Records the key of the split written to disk.
+
+        The manifest is written last and renamed into place, so an interrupted split
+        is never mistaken for a materialized one.
+        """
+        manifest_path = os.path.join(self.path, self.manifest_filename)
+        with open(f'{manifest_path}.tmp', 'w') as file:
+            json.dump(
+                {
+                    'key': key,
+                    'train_filename': self.train_filename,
+                    'test_filename': self.test_filename,
+                },
+                file,
+            )
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+
+    def _save(self, data: pd.DataFrame, filename: str) -> None:
+        """
+        Saves a DataFrame to a data file.
         
         Parameters:
         data (pd.DataFrame): DataFrame to be saved
         filename (str): Name of the file to save the DataFrame to
         
-        This function saves the data DataFrame to a csv file with the provided filename. The file is saved 
+        This function saves the data DataFrame to a file with the provided filename, in the format
+        given by its extension and with the dtypes of the schema. The file is saved 
         in the directory specified by 'path' attribute of the class
         """
-        data.to_csv(
-            os.path.join(self.path, filename),
-            index=False,
-        )
+        write_table(data, os.path.join(self.path, filename))
@@ -0,0 +1,268 @@
+"""module responsible for reading and writing datasets with an explicit schema"""
+import os
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+DATA_FORMAT = os.environ.get('DATA_FORMAT', 'parquet')
+DATA_DIR = os.environ.get(
+    'DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '../data')
+)
+
+schema = {
+    'Administrative': 'int16',
+    'Administrative_Duration': 'float64',
+    'Informational': 'int16',
+    'Informational_Duration': 'float64',
+    'ProductRelated': 'int16',
+    'ProductRelated_Duration': 'float64',
+    'BounceRates': 'float64',
+    'ExitRates': 'float64',
+    'PageValues': 'float64',
+    'SpecialDay': 'float64',
+    'Month': 'category',
+    'OperatingSystems': 'int8',
+    'Browser': 'int8',
+    'Region': 'int8',
+    'TrafficType': 'int8',
+    'VisitorType': 'category',
+    'Weekend': 'bool',
+    'Revenue': 'bool',
+}
+
+# columns each stage reads, so the other columns of the files are never loaded
+TARGET = 'Revenue'
+FEATURES = [column for column in schema if column != TARGET]
+
+
+def filename(stem: str, data_format: str = DATA_FORMAT) -> str:
+    """
+    Returns the file name of a dataset in the given format.
+
+    Parameters:
+    stem (str): name of the dataset without extension, such as 'train'
+    data_format (str): 'parquet', 'feather' or 'csv'
+    """
+    return f'{stem}.{data_format}'
+
+
+def data_path(*parts: str) -> str:
+    """
+    Returns a path inside the data directory, DATA_DIR when it is set.
+
+    Parameters:
+    parts (str): path components below the data directory, such as 'raw'
+    """
+    return os.path.join(DATA_DIR, *parts)
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts the known columns of a DataFrame to the dtypes of the schema.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame to be cast
+
+    Returns:
+    pd.DataFrame : DataFrame with small ints, categories and bools from the schema
+    """
+    dtypes = {
+        column: dtype
+        for column, dtype in schema.items()
+        if column in df.columns and df[column].dtype != dtype
+    }
+    return df.astype(dtypes) if dtypes else df
+
+
+def read_table(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads a dataset, only the given columns when `columns` is set.
+
+    Parameters:
+    path (str): path of a .parquet, .feather or .csv file
+    columns (list): columns to be read, None to read all of them
+
+    Returns:
+    pd.DataFrame : DataFrame with the dtypes of the schema
+
+    Parquet and Feather mostly keep the dtypes they were written with, so casting them
+    is a no-op except for the categories written as strings by TableWriter.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == '.parquet':
+        return pd.read_parquet(path, columns=columns).pipe(apply_schema)
+    if extension == '.feather':
+        return pd.read_feather(path, columns=columns).pipe(apply_schema)
+    if extension == '.csv':
+        return pd.read_csv(
+            path,
+            usecols=columns,
+            dtype={
+                column: dtype
+                for column, dtype in schema.items()
+                if dtype != 'bool' and (columns is None or column in columns)
+            },
+        ).pipe(apply_schema)
+    raise ValueError(f"Unsupported data format: {path}")
+
+
+def write_table(df: pd.DataFrame, path: str) -> None:
+    """
+    Writes a dataset with the dtypes of the schema.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame to be saved
+    path (str): path of a .parquet, .feather or .csv file
+    """
+    df = apply_schema(df).reset_index(drop=True)
+    extension = os.path.splitext(path)[1]
+    if extension == '.parquet':
+        df.to_parquet(path, index=False)
+    elif extension == '.feather':
+        df.to_feather(path)
+    elif extension == '.csv':
+        df.to_csv(path, index=False)
+    else:
+        raise ValueError(f"Unsupported data format: {path}")
+
+
+def iter_table(
+    path: str, chunksize: int, columns: Optional[List[str]] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads a dataset in chunks, so only one chunk is held in memory.
+
+    Parameters:
+    path (str): path of a .parquet, .feather or .csv file
+    chunksize (int): rows per chunk, Feather files yield the record batches they were
+    written with
+    columns (list): columns to be read, None to read all of them
+
+    Returns:
+    Iterator[pd.DataFrame] : chunks with the dtypes of the schema
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == '.parquet':
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(
+            batch_size=chunksize, columns=columns
+        ):
+            yield apply_schema(batch.to_pandas())
+    elif extension == '.feather':
+        import pyarrow.ipc as ipc
+
+        reader = ipc.open_file(path)
+        for i in range(reader.num_record_batches):
+            chunk = reader.get_batch(i).to_pandas()
+            yield apply_schema(chunk[columns] if columns else chunk)
+    elif extension == '.csv':
+        for chunk in pd.read_csv(
+            path,
+            usecols=columns,
+            chunksize=chunksize,
+            dtype={
+                column: dtype
+                for column, dtype in schema.items()
+                if dtype not in ('bool', 'category')
+                and (columns is None or column in columns)
+            },
+        ):
+            yield apply_schema(chunk)
+    else:
+        raise ValueError(f"Unsupported data format: {path}")
+
+
+class TableWriter:
+    """Writes a dataset chunk by chunk, as a context manager"""
+
+    def __init__(self, path: str, dtypes: Optional[Dict[str, str]] = None) -> None:
+        """
+        Initialize the class.
+
+        This function sets the following attributes:
+        path : str : path of a .parquet or .csv file, Feather files cannot be appended to
+        dtypes : dict : columns of the file written when no chunk is, `schema` by default
+        rows : int : number of rows written
+        """
+        self.path = path
+        self.dtypes = schema if dtypes is None else dtypes
+        self.rows = 0
+        self._extension = os.path.splitext(path)[1]
+        self._writer = None
+        self._started = False
+        if self._extension not in ('.parquet', '.csv'):
+            raise ValueError(f"Unsupported data format for chunked writes: {path}")
+
+    def __enter__(self) -> 'TableWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        """
+        Appends a chunk to the dataset.
+
+        Categories are written as strings, since every chunk has its own categories.
+        The Parquet schema takes the columns of `schema` from it rather than from the
+        first chunk, so an empty first chunk does not make them null columns.
+        """
+        chunk = apply_schema(chunk).reset_index(drop=True)
+        categories = chunk.select_dtypes('category').columns
+        chunk[categories] = chunk[categories].astype(str)
+
+        if self._extension == '.csv':
+            chunk.to_csv(
+                self.path,
+                index=False,
+                mode='a' if self._started else 'w',
+                header=not self._started,
+            )
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, _arrow_schema(table.schema))
+            self._writer.write_table(table.cast(self._writer.schema))
+        self._started = True
+        self.rows += len(chunk)
+
+    def close(self) -> None:
+        """
+        Finishes the file.
+
+        When no chunk was written, the file is an empty table with the columns of
+        `dtypes`, so a dataset without rows can still be read back.
+        """
+        if not self._started:
+            empty = {column: pd.Series(dtype=dtype) for column, dtype in self.dtypes.items()}
+            self.write(pd.DataFrame(empty))
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def _arrow_schema(inferred):
+    """
+    Returns the Parquet schema of a chunked dataset.
+
+    The columns of `schema` get the Arrow type of their dtype, categories being
+    written as strings, and the other columns keep their inferred type, strings when
+    the first chunk had no value to infer it from.
+    """
+    import pyarrow as pa
+
+    fields = []
+    for field in inferred:
+        dtype = schema.get(field.name)
+        if dtype == 'category':
+            field = field.with_type(pa.string())
+        elif dtype is not None:
+            field = field.with_type(pa.from_numpy_dtype(dtype))
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields)
@@ -1,82 +1,131 @@
 """module responsible for training model"""
+import importlib
 import os
+from typing import Tuple
 
 import hydra
-import mlflow
-import pandas as pd
 import structlog
 from feature_engine.encoding import OneHotEncoder, RareLabelEncoder
 from feature_engine.wrappers import SklearnTransformerWrapper
-from omegaconf import DictConfig
-from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import cross_val_predict, train_test_split
+from omegaconf import DictConfig, OmegaConf
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.tree import DecisionTreeClassifier
-from xgboost import XGBClassifier
-import lightgbm
 
-from split_data import SplitData
-from utils import classification_metrics, load_train_data, name_category_features, save_model
+from data_preparation import _data_key, data_preparation
+from feature_store import feature_store_enabled, materialize
+from instrumentation import (
+    collect_records,
+    emit_record,
+    log_records,
+    merge_records,
+    stage,
+)
+from metrics import best_threshold
+from model_zoo import fit_models, successive_halving
+from registry import release
+from utils import _model_dir, classification_metrics, save_model
 
 logger = structlog.getLogger()
 
-mlflow.set_tracking_uri('sqlite:///mlflow.db')
-mlflow.set_experiment('customer_intention')
+model_classes = {
+    'LogisticRegression': 'sklearn.linear_model.LogisticRegression',
+    'XGBClassifier': 'xgboost.XGBClassifier',
+    'GradientBoostingClassifier': 'sklearn.ensemble.GradientBoostingClassifier',
+    'RandomForestClassifier': 'sklearn.ensemble.RandomForestClassifier',
+    'DecisionTreeClassifier': 'sklearn.tree.DecisionTreeClassifier',
+    'LGBMClassifier': 'lightgbm.LGBMClassifier',
+}
 
 
-def spliting_data() -> None:
-    SplitData().split_data()
+def model_class(model_name: str) -> type:
+    """
+    Returns the class of a model of the zoo, importing its library on first use.
+
+    Parameters:
+    model_name (str): key of `model_classes`
+    """
+    module_name, class_name = model_classes[model_name].rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
 
 
-def to_category_features(df: pd.DataFrame) -> pd.DataFrame:
+def build_pipeline(config: DictConfig) -> Pipeline:
     """
-    Convert the columns in the dataframe to categorical data type.
-    
+    Build the preprocessing pipeline, not fitted.
+
     Parameters:
-    df (pd.DataFrame): DataFrame containing the columns to be converted to categorical data type
-    
-    Returns:
-    pd.DataFrame : DataFrame with the columns converted to categorical data type
+    config : DictConfig : A configuration object that contains the enconding parameters
 
-    This function takes a DataFrame and converts the columns specified by the 
-    name_category_features() function to categorical data type.
+    Returns:
+    Pipeline : rare label encoding, one-hot encoding and min-max scaling steps
     """
-    df[name_category_features()] = df[name_category_features()].astype(object)
-    return df
+    rare_enc = RareLabelEncoder(
+        n_categories=config.enconding.rare_enc_n_categories, variables=list(config.enconding.rare_enc)
+    )
+    onehot_enc = OneHotEncoder(variables=list(config.enconding.onehot_enc))
+    mm = MinMaxScaler()
+    minmax_scaler = SklearnTransformerWrapper(
+        transformer=mm, variables=list(config.enconding.minmax_scaler)
+    )
 
+    return Pipeline(
+        [('rare_enc', rare_enc), ('onehot', onehot_enc), ('minmax', minmax_scaler)]
+    )
 
-def data_preparation() -> pd.DataFrame:
+
+def select_models(models: dict, X, y, training: DictConfig) -> Tuple[dict, dict]:
     """
-    Prepare the data for modeling.
-    
+    Keeps the models promoted by successive halving and logs the pruned ones in mlflow.
+
+    Parameters:
+    models (dict): model name to unfitted estimator
+    X (pd.DataFrame): transformed training data
+    y (np.ndarray): training target
+    training (DictConfig): `training` settings, see config/process/process.yaml
+
     Returns:
-    Tuple: containing 4 dataframes (X_train, X_test, y_train, y_test) 
-    that are splitted and prepared for modeling
-    
-    This function loads the train data, converts specified columns to categorical data type, 
-    splits the data into training and testing sets, drops the 'to_split' column and returns the 
-    data in 4 dataframes (X_train, X_test, y_train, y_test)
+    dict : the promoted models, best first
+    dict : their fold outputs, see `Selection.folds`
+
+    Each pruned model is logged as a nested run tagged 'pruned', with the rung it was
+    dropped at, the folds it was scored on, its score and the seconds of its fits.
     """
-    spliting_data()
-    df = load_train_data()
-    df[name_category_features()] = df[name_category_features()].astype(object)
-
-    X = df.drop('Revenue', axis=1)
-    y = df['Revenue'].ravel()
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        X,
-        y,
-        test_size=0.3,
-        random_state=42,
-        stratify=df[['to_split']],
-    )
-    X_train.drop('to_split', axis=1, inplace=True)
-    X_test.drop('to_split', axis=1, inplace=True)
+    import mlflow
 
-    return X_train, X_test, y_train, y_test
+    selection = training.selection
+    with stage('model_selection', rows=len(X)):
+        result = successive_halving(
+            models,
+            X,
+            y,
+            cv=training.cv,
+            min_folds=selection.min_folds,
+            eta=selection.eta,
+            metric=selection.metric,
+            time_budget=selection.time_budget,
+            n_jobs=training.n_jobs,
+            model_threads=training.model_threads,
+            cache_dir=os.path.join(_model_dir(), 'cache') if training.cache else None,
+        )
+
+    for pruned in result.pruned:
+        logger.info(f"Pruned model: {pruned['model']}", **pruned)
+        with mlflow.start_run(nested=True):
+            mlflow.set_tag("selection", "pruned")
+            mlflow.log_params(
+                {
+                    "model_name": pruned['model'],
+                    "pruned_reason": pruned['reason'],
+                    "pruned_rung": pruned['rung'],
+                    "pruned_folds": pruned['folds'],
+                }
+            )
+            metrics = {"selection_seconds": pruned['seconds']}
+            if pruned['score'] is not None:
+                metrics[f"selection_{selection.metric}"] = pruned['score']
+            mlflow.log_metrics(metrics)
+
+    logger.info(f"Promoted models: {result.promoted}")
+    return {name: models[name] for name in result.promoted}, result.folds
 
 
 @hydra.main(config_path='../config/process', config_name='process')
@@ -90,44 +139,78 @@ def train(config: DictConfig):
     This function prepares the data for modeling, applies transformation on the data and trains different models 
     (LogisticRegression, XGBClassifier, GradientBoostingRegressor, RandomForestClassifier and DecisionTreeClassifier)
     using transformed data and cross validation. It logs the results of each model in mlflow.
+
+    The folds and full fits of every model run concurrently on a process pool sized by
+    `config.training.n_jobs`, with `config.training.model_threads` threads per model.
+    Models and their params come from `config.models`; with `config.training.cache` the
+    folds, out-of-fold predictions and fitted models are cached, so only the models whose
+    params or data changed are fitted again.
+
+    The data preparation, the pipeline fit and transform and the fits of each model are
+    timed with `instrumentation.stage` and logged as metrics of the run.
+
+    With `config.training.selection.enabled` the models first go through successive
+    halving on a few folds, see `select_models`, and only the promoted ones get the
+    full cross validation, reusing the folds the halving already fitted.
     """
-    X_train, X_test, y_train, y_test = data_preparation()
+    import mlflow
 
-    rare_enc = RareLabelEncoder(
-        n_categories=config.enconding.rare_enc_n_categories, variables=list(config.enconding.rare_enc)
-    )
-    onehot_enc = OneHotEncoder(variables=list(config.enconding.onehot_enc))
-    mm = MinMaxScaler()
-    minmax_scaler = SklearnTransformerWrapper(
-        transformer=mm, variables=list(config.enconding.minmax_scaler)
-    )
+    mlflow.set_tracking_uri('sqlite:///mlflow.db')
+    mlflow.set_experiment('customer_intention')
 
-    pipe = Pipeline(
-        [('rare_enc', rare_enc), ('onehot', onehot_enc), ('minmax', minmax_scaler)]
-    )
-    
-    X_train_transformed = pipe.fit_transform(X_train, y_train)
-    X_test_transformed = pipe.transform(X_test)
+    with collect_records() as records:
+        X_train, X_test, y_train, y_test = data_preparation()
+
+        pipe = build_pipeline(config)
+
+        with stage('pipeline_fit_transform', rows=len(X_train)):
+            X_train_transformed = pipe.fit_transform(X_train, y_train)
+        with stage('pipeline_transform', rows=len(X_test)):
+            X_test_transformed = pipe.transform(X_test)
 
     save_model(model=pipe, name_file='pipeline')
+    if feature_store_enabled():
+        # the model zoo workers attach the stored matrices instead of unpickling copies
+        X_train_transformed, X_test_transformed, y_train, y_test = materialize(
+            _data_key(), X_train_transformed, X_test_transformed, y_train, y_test
+        )
 
     logger.info("Starting training...")
 
     with mlflow.start_run(nested=True):
+        log_records(records)
         models = {
-            'LogisticRegression': LogisticRegression(max_iter=1000),
-            'XGBClassifier': XGBClassifier(),
-            'GradientBoostingClassifier': GradientBoostingClassifier(),
-            'RandomForestClassifier': RandomForestClassifier(),
-            'DecisionTreeClassifier': DecisionTreeClassifier(),
-            'LGBMClassifier': lightgbm.LGBMClassifier()
+            model_name: model_class(model_name)(**OmegaConf.to_container(params))
+            for model_name, params in config.models.items()
         }
+        selection, fitted_folds = config.training.selection, None
+        if selection.enabled:
+            models, fitted_folds = select_models(
+                models, X_train_transformed, y_train, config.training
+            )
+
+        fitted_models = fit_models(
+            models,
+            X_train_transformed,
+            y_train,
+            cv=config.training.cv,
+            n_jobs=config.training.n_jobs,
+            model_threads=config.training.model_threads,
+            cache_dir=os.path.join(_model_dir(), 'cache') if config.training.cache else None,
+            fitted_folds=fitted_folds,
+        )
 
-        for model_name, model in models.items():
-            logger.info(f"Starting training in model: {model_name}")
+        for model_name, result in fitted_models.items():
+            logger.info(f"Logging results of model: {model_name}")
+            y_pred_train, mlmodel = result.oof_pred, result.estimator
 
-            y_pred_train = cross_val_predict(model, X_train_transformed, y_train, cv=10)
             mlflow.log_param("model_name", model_name)
+            if result.stages:
+                emit_record(
+                    merge_records(f'fit.{model_name}', result.stages, model=model_name)
+                )
+            if selection.enabled:
+                mlflow.set_tag("selection", "promoted")
 
             metrics_train = {
                 f"train_{metric}": value
@@ -136,7 +219,6 @@ def train(config: DictConfig):
                 ).items()
             }
 
-            mlmodel = model.fit(X_train_transformed, y_train)
             save_model(model=mlmodel, name_file=f'{model_name}_model')
             y_pred_test = mlmodel.predict(X_test_transformed)
             metrics_test = {
@@ -145,21 +227,29 @@ def train(config: DictConfig):
                     y_test, y_pred_test
                 ).items()
             }
-            metrics = {**metrics_test, **metrics_train}
+            threshold, metrics_threshold = best_threshold(y_train, result.oof_proba)
+            metrics_threshold = {
+                f"train_best_threshold_{metric}": value
+                for metric, value in metrics_threshold.items()
+            }
+            metrics = {
+                **metrics_test,
+                **metrics_train,
+                **metrics_threshold,
+                "train_best_threshold": threshold,
+            }
             
             mlflow.log_artifact(
-                local_path=os.path.join(
-                    os.path.dirname(os.path.abspath(__file__)),
-                    f'../models/{model_name}_model.joblib',
-                )
-            )
-            mlflow.log_artifact(
-                os.path.join(
-                    os.path.dirname(os.path.abspath(__file__)),
-                    f'../models/pipeline.joblib',
-                )
+                local_path=os.path.join(_model_dir(), f'{model_name}_model.joblib')
             )
+            mlflow.log_artifact(os.path.join(_model_dir(), 'pipeline.joblib'))
             mlflow.log_metrics(metrics)
+            version = release(
+                model_name,
+                ['pipeline.joblib', f'{model_name}_model.joblib'],
+                metadata={'metrics': metrics},
+            )
+            mlflow.set_tag("registry_version", version)
             mlflow.end_run()
             logger.info(f"Logged in mlflow for model: {model_name}")
 
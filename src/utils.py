@@ -1,9 +1,13 @@
 """module responsible for utils functions"""
+import hashlib
 import os
 
 import pandas as pd
 import joblib
-from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+
+from storage import data_path, filename, read_table
+
+_file_digests = {}
 
 
 def name_category_features() -> list:
@@ -25,23 +29,71 @@ def name_category_features() -> list:
     ]
 
 
-def load_train_data() -> pd.DataFrame:
+def to_category_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the columns in the dataframe to categorical data type.
+    
+    Parameters:
+    df (pd.DataFrame): DataFrame containing the columns to be converted to categorical data type
+    
+    Returns:
+    pd.DataFrame : DataFrame with the columns converted to categorical data type
+
+    This function takes a DataFrame and converts the columns specified by the 
+    name_category_features() function, and the columns read with a category dtype,
+    to categorical data type.
+    """
+    category_features = list(
+        dict.fromkeys(name_category_features() + list(df.select_dtypes('category').columns))
+    )
+    df[category_features] = df[category_features].astype(object)
+    return df
+
+
+def load_train_data(columns: list = None) -> pd.DataFrame:
     """
     Loads the training data.
     
+    Parameters:
+    columns (list) : columns to be read, all of them when None
+
     Returns:
     pd.DataFrame : DataFrame containing the training data
     
-    This function loads the training data from a csv file 
-    located in the directory specified by 'path' and 'file_name' attributes.
+    This function loads the training data from a file in the format set by
+    DATA_FORMAT, located in the directory specified by 'path' and 'file_name' attributes.
     """
-    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/processed")
-    file_name = 'train.csv'
+    path = data_path("processed")
+    file_name = filename('train')
 
-    df = pd.read_csv(os.path.join(path, file_name))
+    df = read_table(os.path.join(path, file_name), columns=columns)
     return df
 
 
+def file_digest(path: str) -> str:
+    """
+    Returns the sha256 digest of a file.
+
+    Parameters:
+    path (str) : path of the file
+
+    Returns:
+    str : hexadecimal digest of the file content
+
+    The digest is memoized by path, modification time and size, so the file
+    is only read again when it changes on disk.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _file_digests:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        _file_digests[key] = digest.hexdigest()
+    return _file_digests[key]
+
+
 def classification_metrics(actual: pd.Series, pred: pd.Series) -> dict:
     """
     Compute classification metrics.
@@ -54,39 +106,72 @@ def classification_metrics(actual: pd.Series, pred: pd.Series) -> dict:
     dict : A dictionary containing recall, precision, F1 and accuracy scores
     
     This function computes classification metrics (Recall, Precision, F1 and Accuracy) 
-    for the given actual and predicted values.
+    for the given actual and predicted values, from confusion counts built once, see
+    `metrics.classification_metrics`.
     """
-    return {
-        "Recall": recall_score(actual, pred),
-        "Precision": precision_score(actual, pred),
-        "F1": f1_score(actual, pred),
-        "Accuracy": accuracy_score(actual, pred),
-    }
+    from metrics import classification_metrics as metrics_from_labels
+
+    return metrics_from_labels(actual, pred)
 
 def save_model(model, name_file: str):
     """Save model in .joblib
     Args:
         model: model to save in joblib
         name_file: str, name for file to be save
+    The file is not compressed, so its NumPy arrays can be memory-mapped on load, and
+    it is renamed into place, so processes mapping the previous file keep reading it.
     """
     mdir = _model_dir()
-    joblib.dump(model, f'{mdir}/{name_file}.joblib')
+    joblib.dump(model, f'{mdir}/{name_file}.joblib.tmp')
+    os.replace(f'{mdir}/{name_file}.joblib.tmp', f'{mdir}/{name_file}.joblib')
   
-def load_model(name_file: str):
+def load_model(name_file: str, mmap_mode: str = None):
     """Return model from model directory
     Args:
         name_file: str, name for file to be save
+        mmap_mode: str, 'r' to memory-map the NumPy arrays of the model, so processes
+            loading the same file share their pages, None to read them in memory
     Returns:
         model loaded from directory
     """
     mdir = _model_dir()
-    model = joblib.load(f'{mdir}/{name_file}.joblib')
+    model = joblib.load(f'{mdir}/{name_file}.joblib', mmap_mode=mmap_mode)
     return model
-    
+
+
+def save_booster(model, name_file: str):
+    """Save the LightGBM booster of a model in the native text format
+    Args:
+        model: LGBMClassifier or lightgbm.Booster
+        name_file: str, name for file to be save
+    """
+    booster = getattr(model, 'booster_', model)
+    mdir = _model_dir()
+    # the same text `final_model.check_booster_parity` parses
+    with open(f'{mdir}/{name_file}.txt.tmp', 'w') as file:
+        file.write(booster.model_to_string())
+    os.replace(f'{mdir}/{name_file}.txt.tmp', f'{mdir}/{name_file}.txt')
+
+
+def load_booster(name_file: str):
+    """Return a LightGBM booster saved by `save_booster`
+    Args:
+        name_file: str, name for file to be save
+    Returns:
+        lightgbm.Booster parsed straight from the model file, without unpickling
+    """
+    import lightgbm
+
+    mdir = _model_dir()
+    return lightgbm.Booster(model_file=f'{mdir}/{name_file}.txt')
+
+
 def _model_dir() -> str:
     """Return the directory models
     Returns:
-        model_dir: str, models directory
+        model_dir: str, models directory, MODEL_DIR when it is set
     """
-    model_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../models')
+    model_dir = os.environ.get(
+        'MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '../models')
+    )
     return model_dir
\ No newline at end of file
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'api'))
+
+from async_server import MicroBatcher, Server, validate_columns
+from main import feature_names
+
+FEATURES, CATEGORY_FEATURES = feature_names()
+
+
+def session(**values) -> dict:
+    """One valid session, with the given feature values"""
+    row = {feature: 1.0 for feature in FEATURES}
+    row.update({feature: 'a' for feature in CATEGORY_FEATURES})
+    row.update(values)
+    return row
+
+
+def columns(*rows) -> dict:
+    return {feature: [row[feature] for row in rows] for feature in FEATURES}
+
+
+class Scorer:
+    """Scores each row with its Administrative value and records the batch sizes"""
+
+    def __init__(self) -> None:
+        self.batches = []
+
+    def __call__(self, columns: dict) -> list:
+        values = columns['Administrative']
+        self.batches.append(len(values))
+        if any(value < 0 for value in values):
+            raise ValueError("negative value")
+        return [[1 - value, value] for value in values]
+
+
+async def submit_all(batcher: MicroBatcher, requests: list) -> list:
+    """Runs the batcher and submits the requests concurrently"""
+    running = asyncio.create_task(batcher.run())
+    await asyncio.sleep(0)
+    try:
+        return await asyncio.gather(
+            *(batcher.submit(request) for request in requests), return_exceptions=True
+        )
+    finally:
+        running.cancel()
+
+
+def test_concurrent_requests_are_scored_in_one_batch():
+    scorer = Scorer()
+    batcher = MicroBatcher(scorer, max_batch_size=100, max_wait_ms=50)
+    requests = [columns(session(Administrative=i / 10)) for i in range(5)]
+
+    results = asyncio.run(submit_all(batcher, requests))
+
+    assert scorer.batches == [5]
+    assert results == [[[1 - i / 10, i / 10]] for i in range(5)]
+    assert batcher.stats() == {'batches': 1, 'rows': 5, 'mean_batch_rows': 5.0}
+
+
+def test_batch_is_closed_at_max_batch_size():
+    scorer = Scorer()
+    batcher = MicroBatcher(scorer, max_batch_size=4, max_wait_ms=50)
+    rows = [session(Administrative=0.5)] * 2
+    requests = [columns(*rows) for _ in range(4)]
+
+    results = asyncio.run(submit_all(batcher, requests))
+
+    assert scorer.batches == [4, 4]
+    assert all(result == [[0.5, 0.5]] * 2 for result in results)
+
+
+def test_workers_score_batches_concurrently():
+    # each call waits for the other one, so it only returns when both run at once
+    barrier = threading.Barrier(2, timeout=5)
+
+    def score(columns: dict) -> list:
+        barrier.wait()
+        return [[0.5, 0.5]] * len(columns['Administrative'])
+
+    batcher = MicroBatcher(score, max_batch_size=1, max_wait_ms=50, workers=2)
+    requests = [columns(session()) for _ in range(2)]
+
+    results = asyncio.run(submit_all(batcher, requests))
+
+    assert results == [[[0.5, 0.5]]] * 2
+    assert batcher.stats()['batches'] == 2
+
+
+def test_failing_request_does_not_fail_the_batch():
+    scorer = Scorer()
+    batcher = MicroBatcher(scorer, max_batch_size=100, max_wait_ms=50)
+    requests = [
+        columns(session(Administrative=0.25)),
+        columns(session(Administrative=-1.0)),
+        columns(session(Administrative=0.75)),
+    ]
+
+    results = asyncio.run(submit_all(batcher, requests))
+
+    assert scorer.batches == [3, 1, 1, 1]
+    assert results[0] == [[0.75, 0.25]]
+    assert isinstance(results[1], ValueError)
+    assert results[2] == [[0.25, 0.75]]
+    assert batcher.stats()['rows'] == 2
+
+
+def test_validate_columns_coerces_numbers_to_float():
+    validated = validate_columns(columns(session(Administrative=3, Month='May')))
+
+    assert validated['Administrative'] == [3.0]
+    assert isinstance(validated['Administrative'][0], float)
+    assert validated['Month'] == ['May']
+
+
+@pytest.mark.parametrize(
+    'payload',
+    [
+        columns(session(Administrative='3')),
+        columns(session(Administrative=None)),
+        columns(session(Administrative=True)),
+        columns(session(Month=None)),
+        columns(session(Month=['May'])),
+        {**columns(session()), 'ExitRates': 3},
+        {**columns(session()), 'ExitRates': [1.0, 2.0]},
+    ],
+)
+def test_malformed_requests_are_rejected_before_batching(payload):
+    scorer = Scorer()
+    server = Server(MicroBatcher(scorer))
+
+    status, response = asyncio.run(
+        server.dispatch('POST', '/', json.dumps(payload).encode())
+    )
+
+    assert status == 400
+    assert 'error' in response
+    assert scorer.batches == []
@@ -0,0 +1,101 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from omegaconf import OmegaConf
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'api'))
+
+from compiled_pipeline import CompiledPipeline, check_parity
+from train import build_pipeline
+from utils import to_category_features
+
+CONFIG = OmegaConf.load(os.path.join(ROOT, 'config/process/process.yaml'))
+
+
+def sessions(rows: int, seed: int) -> pd.DataFrame:
+    """Raw sessions with a few dominant categories and a long tail of rare ones"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(
+        {
+            feature: rng.gamma(1.0, 10.0, rows)
+            for feature in CONFIG.enconding.minmax_scaler
+        }
+    )
+    data['SpecialDay'] = rng.choice([0.0, 0.2, 0.4, 0.6, 0.8, 1.0], rows)
+    data['Month'] = rng.choice(
+        ['May', 'Nov', 'Mar', 'Dec', 'Oct', 'Sep', 'Aug', 'Jul', 'June', 'Feb'],
+        rows,
+        p=[0.3, 0.25, 0.15, 0.13, 0.06, 0.04, 0.03, 0.02, 0.01, 0.01],
+    )
+    for feature, categories in (
+        ('OperatingSystems', 8),
+        ('Browser', 13),
+        ('Region', 9),
+        ('TrafficType', 20),
+    ):
+        p = np.r_[0.5, 0.25, 0.1, np.full(categories - 3, 0.15 / (categories - 3))]
+        data[feature] = rng.choice(np.arange(1, categories + 1), rows, p=p)
+    data['VisitorType'] = rng.choice(
+        ['Returning_Visitor', 'New_Visitor', 'Other'], rows, p=[0.85, 0.14, 0.01]
+    )
+    data['Weekend'] = rng.random(rows) < 0.23
+    return to_category_features(data)
+
+
+@pytest.fixture(scope='module')
+def fitted():
+    train = sessions(2000, seed=1)
+    target = np.random.default_rng(0).random(len(train)) < 0.15
+    pipe = build_pipeline(CONFIG).fit(train, target)
+    return pipe, CompiledPipeline.from_pipeline(pipe)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_transform_matches_pipeline(fitted, dtype):
+    pipe, compiled = fitted
+    data = sessions(500, seed=2)
+
+    expected = pipe.transform(data)
+    result = compiled.transform(data, dtype=dtype)
+
+    assert compiled.feature_names_out == list(expected.columns)
+    assert result.tobytes() == expected.to_numpy(dtype=dtype).tobytes()
+    check_parity(pipe, compiled, data, dtype=dtype)
+
+
+def test_rare_categories_are_grouped_like_the_pipeline(fitted):
+    pipe, compiled = fitted
+    rare_enc = pipe.named_steps['rare_enc']
+    data = sessions(50, seed=3)
+    for feature in rare_enc.variables_:
+        frequent = set(rare_enc.encoder_dict_[feature])
+        rare = [value for value in data[feature].unique() if value not in frequent]
+        assert rare, f"no rare category of {feature} in the data"
+
+    assert np.array_equal(compiled.transform(data), pipe.transform(data).to_numpy())
+
+
+def test_unseen_categories_match_pipeline(fitted):
+    pipe, compiled = fitted
+    data = sessions(20, seed=4)
+    data.loc[:4, 'Month'] = 'Jan'
+    data.loc[:4, 'TrafficType'] = 99
+    data.loc[5:9, 'Region'] = 42
+
+    expected = pipe.transform(data).to_numpy()
+    result = compiled.transform(data)
+
+    assert np.array_equal(result, expected)
+
+
+def test_columnar_dict_matches_frame(fitted):
+    pipe, compiled = fitted
+    data = sessions(100, seed=5)
+    columns = {feature: data[feature].tolist() for feature in data.columns}
+
+    assert np.array_equal(compiled.transform(columns), pipe.transform(data).to_numpy())
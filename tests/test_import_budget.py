@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+from import_budget import BUDGETS, check
+
+# multiplier of the budgets, for slower machines
+SCALE = float(os.environ.get('IMPORT_BUDGET_SCALE', 1.0))
+
+
+@pytest.mark.parametrize('module', list(BUDGETS))
+def test_import_budget(module):
+    result = check(module, repeat=3, scale=SCALE)
+
+    assert result['errors'] == [], f"{module}: {', '.join(result['errors'])}"
@@ -0,0 +1,91 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from sklearn import metrics as sk_metrics
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'src'))
+
+from metrics import (
+    best_threshold,
+    classification_metrics,
+    confusion_counts,
+    threshold_sweep,
+)
+
+
+def sklearn_metrics(actual, pred) -> dict:
+    """Metrics of scikit-learn, 0 for the undefined ratios"""
+    return {
+        'Recall': sk_metrics.recall_score(actual, pred, zero_division=0),
+        'Precision': sk_metrics.precision_score(actual, pred, zero_division=0),
+        'F1': sk_metrics.f1_score(actual, pred, zero_division=0),
+        'Accuracy': sk_metrics.accuracy_score(actual, pred),
+    }
+
+
+def labels_and_proba(kind: str, rows: int = 200, seed: int = 0):
+    """Labels and probabilities, rounded so that many rows share a probability"""
+    rng = np.random.default_rng(seed)
+    proba = np.round(rng.random(rows), 1)
+    if kind == 'positive':
+        actual = np.ones(rows, dtype=np.int64)
+    elif kind == 'negative':
+        actual = np.zeros(rows, dtype=np.int64)
+    else:
+        actual = (rng.random(rows) < proba).astype(np.int64)
+    return actual, proba
+
+
+KINDS = ['mixed', 'positive', 'negative']
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_confusion_counts_match_sklearn(kind):
+    actual, proba = labels_and_proba(kind)
+    pred = proba >= 0.5
+
+    counts = confusion_counts(actual, pred)
+
+    tn, fp, fn, tp = sk_metrics.confusion_matrix(actual, pred, labels=[0, 1]).ravel()
+    assert counts == (tp, fp, fn, tn)
+    assert classification_metrics(actual, pred) == pytest.approx(
+        sklearn_metrics(actual, pred)
+    )
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_threshold_sweep_matches_sklearn_at_every_threshold(kind):
+    actual, proba = labels_and_proba(kind)
+
+    sweep = threshold_sweep(actual, proba)
+
+    # one threshold per distinct probability, tied rows are predicted together
+    np.testing.assert_array_equal(sweep['threshold'], np.unique(proba)[::-1])
+    for i, threshold in enumerate(sweep['threshold']):
+        expected = sklearn_metrics(actual, proba >= threshold)
+        for name, value in expected.items():
+            assert sweep[name][i] == pytest.approx(value), (name, threshold)
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_best_threshold_maximizes_the_metric(kind):
+    actual, proba = labels_and_proba(kind)
+
+    threshold, best = best_threshold(actual, proba, metric='F1')
+
+    scores = {
+        t: sk_metrics.f1_score(actual, proba >= t, zero_division=0)
+        for t in np.unique(proba)
+    }
+    top = max(scores.values())
+    # ties go to the highest threshold
+    assert threshold == max(t for t, score in scores.items() if score == top)
+    assert best == pytest.approx(sklearn_metrics(actual, proba >= threshold))
+
+
+def test_best_threshold_without_predictions():
+    with pytest.raises(ValueError):
+        best_threshold([], [])
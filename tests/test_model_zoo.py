@@ -0,0 +1,134 @@
+import math
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.tree import DecisionTreeClassifier
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'api'))
+
+import model_zoo
+from model_zoo import fit_models, successive_halving
+
+CV = 9
+
+
+def training_data(rows: int = 360, seed: int = 0):
+    """Small transformed training data with a noisy linear target"""
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(rows, 4)), columns=['a', 'b', 'c', 'd'])
+    y = (X['a'] + 0.5 * X['b'] + rng.normal(scale=0.5, size=rows) > 0).to_numpy()
+    return X, y.astype(np.int64)
+
+
+def zoo() -> dict:
+    """Seven deterministic models of different quality"""
+    models = {
+        f'tree_{depth}': DecisionTreeClassifier(max_depth=depth, random_state=0)
+        for depth in (1, 2, 3, 5, 8)
+    }
+    models['logistic'] = LogisticRegression()
+    models['logistic_weak'] = LogisticRegression(C=1e-4)
+    return models
+
+
+def count_fold_fits(monkeypatch) -> list:
+    """Records the fold fits, the fits run in process with n_jobs=1"""
+    calls = []
+    fit_fold = model_zoo._fit_fold
+
+    def counted(*args):
+        calls.append(args)
+        return fit_fold(*args)
+
+    monkeypatch.setattr(model_zoo, '_fit_fold', counted)
+    return calls
+
+
+def test_rungs_promote_ceil_n_over_eta():
+    X, y = training_data()
+    selection = successive_halving(zoo(), X, y, cv=CV, min_folds=1, eta=3, n_jobs=1)
+
+    rungs = [pruned['rung'] for pruned in selection.pruned]
+    # 7 models keep ceil(7/3) = 3 on 1 fold, then ceil(3/3) = 1 on 3 folds
+    assert rungs.count(0) == 7 - math.ceil(7 / 3)
+    assert rungs.count(1) == math.ceil(7 / 3) - 1
+    assert len(selection.promoted) == 1
+    assert {pruned['reason'] for pruned in selection.pruned} == {'rung'}
+    assert [pruned['folds'] for pruned in selection.pruned] == [1] * 4 + [3] * 2
+    assert sorted(selection.folds[selection.promoted[0]]) == [0, 1, 2]
+
+
+def test_time_budget_stops_the_rungs():
+    X, y = training_data()
+    selection = successive_halving(
+        zoo(), X, y, cv=CV, min_folds=1, eta=3, time_budget=0, n_jobs=1
+    )
+
+    assert len(selection.promoted) == 1
+    # the first rung runs, the second does not fit in the budget
+    assert all(pruned['rung'] < 2 for pruned in selection.pruned)
+    assert [pruned['reason'] for pruned in selection.pruned].count('budget') == 2
+    assert sorted(selection.folds[selection.promoted[0]]) == [0]
+
+
+def test_estimated_rung_cost_stops_the_rungs(monkeypatch):
+    X, y = training_data()
+    fit_fold = model_zoo._fit_fold
+
+    def slow(*args):
+        pred, proba, record = fit_fold(*args)
+        return pred, proba, {**record, 'wall_seconds': 100.0}
+
+    monkeypatch.setattr(model_zoo, '_fit_fold', slow)
+    selection = successive_halving(
+        zoo(), X, y, cv=CV, min_folds=1, eta=3, time_budget=600, n_jobs=1
+    )
+
+    # 3 models promoted from rung 0 would need 3 * 2 folds in rung 1 and 7 more fits
+    # of the one it keeps, 1300 seconds, so rung 1 never starts
+    assert all(pruned['folds'] == 1 for pruned in selection.pruned)
+    # each promoted model needs 8 more fold fits and a full fit, 900 seconds
+    reasons = [pruned['reason'] for pruned in selection.pruned]
+    assert reasons == ['rung'] * 4 + ['budget'] * 2
+    assert len(selection.promoted) == 1
+    assert sorted(selection.folds[selection.promoted[0]]) == [0]
+
+
+def test_fit_models_reuses_the_rung_folds(monkeypatch):
+    X, y = training_data()
+    selection = successive_halving(zoo(), X, y, cv=CV, min_folds=1, eta=3, n_jobs=1)
+    models = {name: zoo()[name] for name in selection.promoted}
+
+    calls = count_fold_fits(monkeypatch)
+    reused = fit_models(models, X, y, cv=CV, n_jobs=1, fitted_folds=selection.folds)
+    assert len(calls) == CV - len(selection.folds[selection.promoted[0]])
+
+    calls.clear()
+    fitted = fit_models(models, X, y, cv=CV, n_jobs=1)
+    assert len(calls) == CV
+
+    for name in models:
+        np.testing.assert_array_equal(reused[name].oof_pred, fitted[name].oof_pred)
+        np.testing.assert_array_equal(reused[name].oof_proba, fitted[name].oof_proba)
+        assert len(reused[name].stages) == CV + 1
+
+
+@pytest.mark.parametrize('min_folds', [1, 3])
+def test_selection_scores_the_folds_of_fit_models(min_folds):
+    X, y = training_data()
+    selection = successive_halving(
+        zoo(), X, y, cv=CV, min_folds=min_folds, eta=3, n_jobs=1
+    )
+    name = selection.promoted[0]
+    fitted = fit_models({name: zoo()[name]}, X, y, cv=CV, n_jobs=1)[name]
+
+    ids = model_zoo.fold_ids(y, CV)
+    for fold, (pred, proba, _) in selection.folds[name].items():
+        np.testing.assert_array_equal(pred, fitted.oof_pred[ids == fold])
+        np.testing.assert_array_equal(proba, fitted.oof_proba[ids == fold])
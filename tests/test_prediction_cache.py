@@ -0,0 +1,74 @@
+import os
+import sys
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'api'))
+
+import prediction_cache
+from prediction_cache import PredictionCache, canonical_value, row_keys
+
+
+class Clock:
+    """Monotonic clock moved by hand"""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(max_entries=2)
+    cache.put_many(['a', 'b'], [1, 2], version='v1')
+    # reading 'a' makes 'b' the least recently used entry
+    assert cache.get_many(['a'], version='v1') == [1]
+
+    cache.put_many(['c'], [3], version='v1')
+
+    assert cache.get_many(['a', 'b', 'c'], version='v1') == [1, None, 3]
+    assert cache.stats()['entries'] == 2
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prediction_cache, 'time', SimpleNamespace(monotonic=clock))
+    cache = PredictionCache(max_entries=10, ttl_seconds=60)
+    cache.put_many(['a'], [1], version='v1')
+
+    clock.now += 59
+    assert cache.get_many(['a'], version='v1') == [1]
+    clock.now += 2
+    assert cache.get_many(['a'], version='v1') == [None]
+
+    stats = cache.stats()
+    assert stats['expirations'] == 1
+    assert stats['entries'] == 0
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_new_version_drops_every_entry():
+    cache = PredictionCache(max_entries=10)
+    cache.put_many(['a', 'b'], [1, 2], version=('pipeline-1', 'model-1'))
+
+    assert cache.get_many(['a', 'b'], version=('pipeline-1', 'model-2')) == [None, None]
+    assert cache.stats()['invalidations'] == 1
+    assert cache.stats()['entries'] == 0
+
+    cache.put_many(['a'], [3], version=('pipeline-1', 'model-2'))
+    assert cache.get_many(['a'], version=('pipeline-1', 'model-2')) == [3]
+
+
+def test_canonical_values_of_the_keys():
+    assert canonical_value(0) == canonical_value(0.0)
+    assert canonical_value(True) != canonical_value(1)
+    assert canonical_value(False) != canonical_value(0)
+    assert canonical_value('May') == 'May'
+
+    features = ['Administrative', 'Weekend']
+    columns = {'Administrative': [0, 0.0, 1], 'Weekend': [1, 1.0, True]}
+    keys = row_keys(columns, features)
+    assert keys[0] == keys[1]
+    assert keys[1] != keys[2]
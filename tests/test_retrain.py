@@ -0,0 +1,181 @@
+import os
+import sys
+
+import lightgbm
+import numpy as np
+import pandas as pd
+import pytest
+from omegaconf import OmegaConf
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'api'))
+
+import storage
+from incremental import PipelineStats, deltas_dir, mark_applied, pending_deltas
+from registry import get_artifact_registry
+from retrain import retrain
+from train import build_pipeline
+from utils import (
+    _model_dir,
+    file_digest,
+    load_model,
+    save_booster,
+    save_model,
+    to_category_features,
+)
+
+CONFIG = OmegaConf.load(os.path.join(ROOT, 'config/process/process.yaml'))
+
+# every feature has fewer categories than the rare label encoder groups
+pytestmark = pytest.mark.filterwarnings('ignore:The number of unique categories')
+
+
+def sessions(rows: int, seed: int) -> pd.DataFrame:
+    """Raw sessions with at most 5 categories per feature, numbers from 0 to 100"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(
+        {
+            feature: rng.integers(0, 101, rows).astype(np.float64)
+            for feature in CONFIG.enconding.minmax_scaler
+        }
+    )
+    data['Month'] = rng.choice(['May', 'Nov', 'Mar', 'Dec'], rows)
+    for feature in ('OperatingSystems', 'Browser', 'Region', 'TrafficType'):
+        data[feature] = rng.integers(1, 4, rows)
+    data['VisitorType'] = rng.choice(['Returning_Visitor', 'New_Visitor'], rows)
+    data['Weekend'] = rng.random(rows) < 0.25
+    return data
+
+
+def with_target(data: pd.DataFrame) -> pd.DataFrame:
+    """Sessions with a 'Revenue' column learnable from 'PageValues'"""
+    return data.assign(Revenue=data['PageValues'] > 70)
+
+
+@pytest.fixture
+def fitted():
+    """Pipeline fitted on sessions covering the whole range of every number"""
+    train = sessions(1000, seed=1)
+    train.loc[0, CONFIG.enconding.minmax_scaler] = 0.0
+    train.loc[1, CONFIG.enconding.minmax_scaler] = 100.0
+    train = to_category_features(train)
+    y = with_target(train)['Revenue'].to_numpy()
+    pipe = build_pipeline(CONFIG).fit(train, y)
+    return pipe, train, y
+
+
+@pytest.fixture
+def workspace(fitted, tmp_path, monkeypatch):
+    """Model, data and registry directories holding a final model to retrain"""
+    pipe, train, y = fitted
+    for directory in ('models', 'data', 'registry'):
+        (tmp_path / directory).mkdir()
+    monkeypatch.setenv('MODEL_DIR', str(tmp_path / 'models'))
+    monkeypatch.setenv('REGISTRY_DIR', str(tmp_path / 'registry'))
+    monkeypatch.setattr(storage, 'DATA_DIR', str(tmp_path / 'data'))
+
+    lgbm = lightgbm.LGBMClassifier(n_estimators=20).fit(pipe.transform(train), y)
+    save_model(pipe, 'pipeline')
+    save_model(lgbm, 'final_model')
+    save_booster(lgbm, 'final_model')
+    save_model(PipelineStats.from_data(pipe, train), 'pipeline_stats')
+    return tmp_path
+
+
+def write_delta(name: str, data: pd.DataFrame) -> str:
+    """Writes a delta file and returns its path"""
+    os.makedirs(deltas_dir(), exist_ok=True)
+    path = os.path.join(deltas_dir(), f'{name}.parquet')
+    storage.write_table(data, path)
+    return path
+
+
+def test_rows_like_the_training_ones_do_not_drift(fitted):
+    pipe, train, _ = fitted
+    stats = PipelineStats.from_data(pipe, train)
+
+    stats.update(to_category_features(sessions(200, seed=2)))
+
+    assert stats.drift(pipe) == {'range_drift': 0.0, 'categories': {}}
+
+
+def test_new_categories_drift(fitted):
+    pipe, train, _ = fitted
+    stats = PipelineStats.from_data(pipe, train)
+    delta = sessions(200, seed=2)
+    delta['Month'] = 'Jul'
+    delta['VisitorType'] = 'Other'
+
+    stats.update(to_category_features(delta))
+
+    categories = stats.drift(pipe)['categories']
+    assert categories['Month'] == ['Jul']
+    assert categories['VisitorType'] == ['Other']
+
+
+def test_out_of_range_numbers_drift(fitted):
+    pipe, train, _ = fitted
+    stats = PipelineStats.from_data(pipe, train)
+    delta = sessions(200, seed=2)
+    delta.loc[0, 'PageValues'] = 150.0
+    delta.loc[1, 'ExitRates'] = -10.0
+
+    stats.update(to_category_features(delta))
+
+    # 50 above the fitted range of 100
+    assert stats.drift(pipe)['range_drift'] == pytest.approx(0.5)
+    assert stats.drift(pipe)['categories'] == {}
+
+
+def test_mark_applied_records_the_content_of_the_deltas(workspace):
+    first = write_delta('2026-10-01', with_target(sessions(50, seed=3)))
+    second = write_delta('2026-10-02', with_target(sessions(50, seed=4)))
+    assert pending_deltas() == [first, second]
+
+    mark_applied([first])
+    assert pending_deltas() == [second]
+
+    # a delta rewritten in place is applied again
+    write_delta('2026-10-01', with_target(sessions(60, seed=5)))
+    assert pending_deltas() == [first, second]
+
+    mark_applied([first, second])
+    assert pending_deltas() == []
+    mark_applied([second], reset=True)
+    assert pending_deltas() == [first]
+
+
+def test_retrain_boosts_the_pending_deltas_into_the_final_model(workspace):
+    path = write_delta('2026-10-01', with_target(sessions(300, seed=3)))
+    pipeline_digest = file_digest(os.path.join(_model_dir(), 'pipeline.joblib'))
+
+    assert retrain(num_boost_round=5) == 'incremental'
+
+    model = load_model('final_model')
+    assert model.booster_.num_trees() == 25
+    assert list(model.classes_) == [False, True]
+    assert load_model('pipeline_stats').rows == 1300
+    assert pending_deltas() == []
+    manifest = get_artifact_registry().manifest('final_model')
+    assert manifest['sources']['final_model.joblib'] == pipeline_digest
+    assert manifest['metadata']['deltas'] == [os.path.basename(path)]
+    assert retrain(num_boost_round=5) == 'skipped'
+
+
+def test_single_class_delta_stays_pending(workspace):
+    model_path = os.path.join(_model_dir(), 'final_model.joblib')
+    model_digest = file_digest(model_path)
+    delta = with_target(sessions(300, seed=3))
+    negatives = delta[~delta['Revenue']]
+    first = write_delta('2026-10-01', negatives)
+
+    assert retrain(num_boost_round=5) == 'skipped'
+    assert file_digest(model_path) == model_digest
+    assert pending_deltas() == [first]
+
+    write_delta('2026-10-02', with_target(sessions(300, seed=4)))
+    assert retrain(num_boost_round=5) == 'incremental'
+    assert list(load_model('final_model').classes_) == [False, True]
+    assert pending_deltas() == []
+    assert load_model('pipeline_stats').rows == 1000 + len(negatives) + 300
@@ -0,0 +1,185 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'src'))
+
+import split_data
+import storage
+from data_ingest import DataIngest
+from split_data import SplitData
+from storage import read_table, write_table
+
+MONTHS = ['Feb', 'Mar', 'May', 'Nov', 'Dec']
+
+
+def raw_sessions(rows: int = 3000, seed: int = 0) -> pd.DataFrame:
+    """Raw sessions with uneven months and about 15% of purchases"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(
+        {
+            feature: rng.gamma(1.0, 10.0, rows)
+            for feature, dtype in storage.schema.items()
+            if dtype == 'float64'
+        }
+    )
+    # a unique id, to compare the rows assigned to each part
+    data['Administrative'] = np.arange(rows)
+    for feature in ('Informational', 'ProductRelated'):
+        data[feature] = rng.integers(0, 20, rows)
+    for feature in ('OperatingSystems', 'Browser', 'Region', 'TrafficType'):
+        data[feature] = rng.integers(1, 9, rows)
+    data['Month'] = rng.choice(MONTHS, rows, p=[0.05, 0.15, 0.3, 0.3, 0.2])
+    data['VisitorType'] = rng.choice(['Returning_Visitor', 'New_Visitor'], rows)
+    data['Weekend'] = rng.random(rows) < 0.25
+    data['Revenue'] = rng.random(rows) < 0.15
+    return data
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Data directory with a raw data file, used by the split and the ingest"""
+    for part in ('raw', 'processed'):
+        (tmp_path / part).mkdir()
+    monkeypatch.setattr(storage, 'DATA_DIR', str(tmp_path))
+    write_table(raw_sessions(), storage.data_path('raw', storage.filename('data')))
+    monkeypatch.setattr(split_data, 'di', DataIngest())
+    return tmp_path
+
+
+def split_parts(split: SplitData):
+    """Returns the train and test parts written by a split"""
+    return (
+        read_table(os.path.join(split.path, split.train_filename)),
+        read_table(os.path.join(split.path, split.test_filename)),
+    )
+
+
+def test_streaming_split_keeps_the_ratio_of_every_stratum(data_dir):
+    split = SplitData(chunksize=250)
+    split.split_data()
+    train, test = split_parts(split)
+
+    raw = raw_sessions()
+    assert len(train) + len(test) == len(raw)
+    assert sorted(pd.concat([train, test]).Administrative) == list(raw.Administrative)
+    strata = ['Month', 'Revenue']
+    counts = raw.groupby(strata).size()
+    test_counts = test.groupby(strata, observed=True).size().reindex(counts.index)
+    # systematic sampling puts test_size of every stratum in the test part, to a row
+    assert (np.abs(test_counts.fillna(0) - counts * split.test_size) < 1).all()
+    assert test.Revenue.mean() == pytest.approx(raw.Revenue.mean(), abs=0.01)
+    assert train.Revenue.mean() == pytest.approx(raw.Revenue.mean(), abs=0.01)
+
+
+def test_streaming_split_does_not_depend_on_the_chunksize(data_dir):
+    assignments = []
+    for chunksize in (1000, 97, 3000):
+        split = SplitData(chunksize=chunksize)
+        split.split_data()
+        train, test = split_parts(split)
+        assignments.append((list(train.Administrative), list(test.Administrative)))
+        # the key does not depend on the chunk size, forget the split to redo it
+        split._remove_manifest()
+
+    assert assignments[1] == assignments[0]
+    assert assignments[2] == assignments[0]
+
+
+def mtimes(split: SplitData) -> list:
+    """Modification times of the files of a split"""
+    filenames = (split.train_filename, split.test_filename, split.manifest_filename)
+    return [os.stat(os.path.join(split.path, name)).st_mtime_ns for name in filenames]
+
+
+@pytest.mark.parametrize('chunksize', [None, 500])
+def test_second_split_reuses_the_materialized_files(data_dir, chunksize):
+    key = SplitData(chunksize=chunksize).split_data()
+    written = mtimes(SplitData())
+
+    split = SplitData(chunksize=chunksize)
+    assert split.split_data() == key
+    # nothing was read nor written
+    assert split._full_data is None
+    assert mtimes(split) == written
+
+
+def test_changed_raw_file_invalidates_the_split(data_dir):
+    split = SplitData()
+    key = split.split_data()
+    _, test = split_parts(split)
+
+    raw = raw_sessions()
+    raw.loc[0, 'PageValues'] += 1.0
+    write_table(raw, storage.data_path('raw', storage.filename('data')))
+
+    split = SplitData()
+    assert not split.is_materialized(split.split_key())
+    assert split.split_data() != key
+    assert split.is_materialized(split.split_key())
+    _, new_test = split_parts(split)
+    assert len(new_test) == len(test)
+
+
+@pytest.mark.parametrize(
+    'change',
+    [
+        {'test_size': 0.25},
+        {'random_state': 7},
+        {'chunksize': 500},
+    ],
+)
+def test_changed_parameters_invalidate_the_split(data_dir, change):
+    key = SplitData().split_data()
+
+    split = SplitData(chunksize=change.pop('chunksize', None))
+    for name, value in change.items():
+        setattr(split, name, value)
+
+    assert split.split_key() != key
+    assert not split.is_materialized(split.split_key())
+    assert split.split_data() == split.split_key()
+
+
+def test_data_key_follows_the_split_and_the_pipeline(data_dir, tmp_path, monkeypatch):
+    import data_preparation
+
+    monkeypatch.delenv('SPLIT_CHUNKSIZE', raising=False)
+    monkeypatch.setenv('MODEL_DIR', str(tmp_path))
+    pipeline_path = tmp_path / 'pipeline.joblib'
+    pipeline_path.write_bytes(b'pipeline 1')
+    key = data_preparation._data_key()
+    assert data_preparation._data_key() == key
+
+    pipeline_path.write_bytes(b'pipeline 2')
+    split_key, pipeline_digest = data_preparation._data_key()
+    assert split_key == key[0]
+    assert pipeline_digest != key[1]
+
+    monkeypatch.setenv('SPLIT_CHUNKSIZE', '500')
+    assert data_preparation._data_key()[0] != key[0]
+
+
+def test_prepared_data_is_reused_in_process(data_dir, monkeypatch):
+    import data_preparation
+
+    monkeypatch.delenv('SPLIT_CHUNKSIZE', raising=False)
+    monkeypatch.setattr(data_preparation, '_prepared_data', {})
+    loads = []
+    load_train_data = data_preparation.load_train_data
+
+    def counted(*args, **kwargs):
+        loads.append(args)
+        return load_train_data(*args, **kwargs)
+
+    monkeypatch.setattr(data_preparation, 'load_train_data', counted)
+    first = data_preparation.data_preparation()
+    second = data_preparation.data_preparation()
+
+    assert len(loads) == 1
+    pd.testing.assert_frame_equal(first[0], second[0])
+    np.testing.assert_array_equal(first[3], second[3])